@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+def normalize_url(url: str, drop: Iterable[str] = ('apiKey',)) -> str:
+    """Normalize a url for use as a cache key: drop secret query params (apiKey) and sort the rest so param order doesn't matter"""
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in drop)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+class CachedResponse:
+    def __init__(self, body: bytes, content_type: str, status: int = 200):
+        """Minimal stand in for an aiohttp response built from a cached body, so `ResponseParser` can parse it"""
+        self.body = body
+        self.status = status
+        self.headers = {'Content-Type': content_type}
+
+    async def read(self): return self.body
+    async def text(self): return self.body.decode('utf-8')
+    async def json(self): return json.loads(self.body)
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: float = None, max_bytes: int = None, level: int = 6, low_water: float = 0.9):
+        """
+        Persistent on-disk cache of compressed (zlib) response bodies, keyed by the normalized url (apiKey removed).
+        `ttl` (seconds) expires old entries, `max_bytes` caps the total size on disk by evicting least recently used entries.
+        The size is tracked as entries are written, going over `max_bytes` evicts down to `low_water` * `max_bytes` in one scan, so the scan happens once per
+        ~10% of the cache written rather than on every write.
+        Pass to `HttpRequestFetcher(cache=...)`, hits skip the limiter and network entirely.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.level = level
+        assert 0 < low_water <= 1, "low_water must be between 0 and 1"
+        self.low_water = low_water
+        self._size = None # bytes on disk, computed lazily on first write
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, url: str) -> str: return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+    def _file(self, key: str) -> Path: return self.path / key[:2] / key # fan out so no directory gets huge
+    def _entries(self): return (f for f in self.path.glob('*/*') if not f.name.endswith('.tmp'))
+    def _expired(self, stat: os.stat_result, now: float) -> bool: return self.ttl is not None and now - stat.st_mtime > self.ttl
+
+    def __contains__(self, url: str) -> bool: return self.get(url) is not None
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """Returns the cached response for url, or None if missing/expired"""
+        file = self._file(self.key(url))
+        try:
+            if self._expired(file.stat(), time.time()):
+                self._remove(file)
+                self.misses += 1
+                return None
+            header, body = zlib.decompress(file.read_bytes()).split(b'\n', 1)
+        except (FileNotFoundError, zlib.error, ValueError): # missing or corrupt (e.g. killed mid write on another fs)
+            self.misses += 1
+            return None
+        os.utime(file, (time.time(), file.stat().st_mtime)) # bump atime for LRU eviction, keep mtime for ttl
+        self.hits += 1
+        return CachedResponse(body, **json.loads(header))
+
+    def set(self, url: str, body: bytes, content_type: str):
+        """Compress and store a response body. Writes are atomic (tmp file + rename), so a crash never leaves a half written entry"""
+        file = self._file(self.key(url))
+        file.parent.mkdir(exist_ok=True)
+        header = json.dumps({'content_type': content_type}).encode()
+        data = zlib.compress(header + b'\n' + body, self.level)
+
+        old_size = file.stat().st_size if file.exists() else 0
+        tmp = file.with_name(file.name + '.tmp')
+        tmp.write_bytes(data)
+        os.replace(tmp, file)
+
+        if self.max_bytes is not None:
+            if self._size is None: self._size = sum(f.stat().st_size for f in self._entries())
+            else: self._size += len(data) - old_size
+            if self._size > self.max_bytes: self.evict()
+
+    def delete(self, url: str):
+        """Drop the entry for url (e.g. a bad response that should be refetched), no-op if it isn't cached"""
+        self._remove(self._file(self.key(url)))
+
+    def _remove(self, file: Path):
+        try:
+            size = file.stat().st_size
+            file.unlink()
+            if self._size is not None: self._size -= size
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Drop expired entries, then least recently used entries until under `low_water` * `max_bytes`"""
+        now = time.time()
+        entries = []
+        for file in self._entries():
+            stat = file.stat()
+            if self._expired(stat, now): self._remove(file)
+            else: entries.append((stat.st_atime, stat.st_size, file))
+
+        self._size = sum(size for _, size, _ in entries)
+        if self.max_bytes is None: return
+        target = self.max_bytes * self.low_water # headroom, so the next writes don't trigger another scan
+        for _, size, file in sorted(entries, key=lambda e: e[0]): # oldest access first
+            if self._size <= target: break
+            self._remove(file)
+
+    def clear(self):
+        for file in list(self._entries()): self._remove(file)
+        self._size = 0
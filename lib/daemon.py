@@ -0,0 +1,309 @@
+import asyncio
+import bisect
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from lib.cache import ResponseCache
+from lib.fetcher import BatchRequestExecutor, ConnectionPool, HttpRequestFetcher, get_json_decoder
+from lib.limiter import AdaptiveLimiter
+from lib.metrics import FetchMetrics
+from lib.polygon import POLYGON_BASE_URL, make_url
+from lib.streaming import DECODE_ERRORS
+from lib.utils import get_nyse_date_tups, get_polygon_key
+from lib.workers import RawResponseParser
+
+QUEUED, RUNNING, FINISHED, CANCELLED = 'queued', 'running', 'finished', 'cancelled'
+DEFAULT_PORT = 8765
+
+# ! Jobs ==========================================================================
+class Job:
+    def __init__(self, urls: List[str], name: str = None, spool: str = None):
+        """
+        A submitted url plan. Results are appended as ndjson lines (completion order) to a file in `spool` (default: temp dir), only their offsets stay in memory,
+        so any number of clients can stream them (again) from any offset without the daemon holding every body.
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.urls = urls
+        self.state = QUEUED
+        self.path = Path(spool or tempfile.gettempdir()) / f"job-{self.id}.ndjson"
+        self.offsets = [0] # byte offset of each line, plus the end of the last one
+        self.failed = 0
+        self.created = time.time()
+        self.finished = None
+        self.task = None
+        self.discarded = False
+        self.decoder = get_json_decoder()
+        self._file = open(self.path, 'wb')
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event() # readers waiting on the old one wake up, new readers wait for the next change
+
+    @property
+    def completed(self) -> int: return len(self.offsets) - 1
+
+    def _body(self, result) -> bytes:
+        if not isinstance(result, (bytes, bytearray)): return json.dumps(result).encode()
+        try: self.decoder(result)
+        except DECODE_ERRORS: return json.dumps(bytes(result).decode('utf-8', 'replace')).encode() # truncated / not json, sent as a string so the line still parses
+        return bytes(result).replace(b'\n', b' ') # raw json, newlines can only be whitespace
+
+    def add(self, url: str, result):
+        if self.discarded: return
+        if result is None: self.failed += 1
+        line = b'{"url": ' + json.dumps(url).encode() + b', "result": ' + self._body(result) + b'}\n'
+        self._file.write(line)
+        self._file.flush() # readers open the file themselves
+        self.offsets.append(self.offsets[-1] + len(line))
+        self._notify()
+
+    def read(self, start: int, max_bytes: int = 1 << 20) -> Tuple[bytes, int]:
+        """Lines from the `start`th on, about `max_bytes` worth (at least one line). Returns (lines, index of the next line)"""
+        assert 0 <= start < self.completed, f"start must be in [0, {self.completed}), got {start}"
+        end = max(bisect.bisect_right(self.offsets, self.offsets[start] + max_bytes) - 1, start + 1)
+        end = min(end, self.completed)
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[start])
+            return f.read(self.offsets[end] - self.offsets[start]), end
+
+    def finish(self, state: str):
+        self.state = state
+        self.finished = time.time()
+        self._file.close()
+        self._notify()
+
+    def discard(self):
+        """Drop the job's results from disk, readers still streaming it stop"""
+        self.discarded = True
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+        self._notify()
+
+    @property
+    def done(self) -> bool: return self.state in (FINISHED, CANCELLED)
+
+    async def wait(self, seen: int):
+        """Wait until there are more than `seen` lines or the job is done"""
+        while self.completed <= seen and not self.done and not self.discarded: await self._changed.wait()
+
+    def info(self) -> Dict:
+        return {'id': self.id, 'name': self.name, 'state': self.state, 'urls': len(self.urls), 'completed': self.completed, 'failed': self.failed, 'created': self.created, 'finished': self.finished}
+
+# ! Daemon ========================================================================
+class FetchDaemon:
+    def __init__(
+            self,
+            rps: float = 100,
+            cache_dir: str = None,
+            job_in_flight: int = 50,
+            limit_per_host: int = 0,
+            keep_finished: int = 100,
+            host: str = '127.0.0.1',
+            port: int = DEFAULT_PORT,
+            path: str = None,
+            api_key: str = None,
+            base: str = POLYGON_BASE_URL,
+            spool_dir: str = None,
+        ):
+        """
+        Long running fetch service: one warm connection pool, one limiter (`rps` is the budget shared by every job, backs off on 429s) and one response cache
+        live as long as the daemon, so jobs have no startup cost and concurrent users can't overrun the api key between them.
+        Serves a small json api on `host:port` (or a unix socket at `path`), see `DaemonClient`:
+        - POST /jobs `{"urls": [...]}` or `{"tickers": [...], "start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}` (one url per ticker per NYSE session) -> job info
+        - GET /jobs, GET /jobs/{id}, DELETE /jobs/{id} (cancels a running job and forgets it), GET /status (jobs, limiter rate, fetch metrics)
+        - GET /jobs/{id}/results?from=N streams `{"url": ..., "result": ...}` ndjson lines as they complete (result is the raw response, null if it failed)
+        Every job gets at most `job_in_flight` requests at a time, so the limiter's slots are shared evenly between running jobs instead of first come first served.
+        Results are spooled to disk in `spool_dir` (default: a temp dir removed on close) until the job is deleted (or is one of more than `keep_finished` finished jobs).
+        """
+        self.job_in_flight = job_in_flight
+        self.keep_finished = keep_finished
+        self.host = host
+        self.port = port
+        self.path = path
+        self.api_key = api_key
+        self.base = base
+        self.pool = ConnectionPool(limit_per_host=limit_per_host)
+        self.limiter = AdaptiveLimiter(rate=rps, max_rate=rps)
+        self.metrics = FetchMetrics()
+        self.fetcher = HttpRequestFetcher(pool=self.pool, limiter=self.limiter, cache=ResponseCache(cache_dir) if cache_dir else None, parser=RawResponseParser(), metrics=self.metrics)
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self._own_spool = spool_dir is None
+        self.spool_dir = Path(spool_dir or tempfile.mkdtemp(prefix='fetch-daemon-'))
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._runner = None
+
+    # jobs
+    def plan(self, tickers: List[str], start: str, end: str, limit: int = 50000) -> List[str]:
+        """One aggregates url per ticker per NYSE session, like `make_urls`"""
+        api_key = self.api_key or get_polygon_key()
+        tups = get_nyse_date_tups(start, end, unix=True)
+        return [make_url(ticker, o, c, limit=limit, api_key=api_key, base=self.base) for ticker in tickers for o, c in tups]
+
+    def submit(self, urls: List[str], name: str = None) -> Job:
+        assert urls and all(isinstance(url, str) for url in urls), "a job needs a non empty list of url strings"
+        job = Job(list(urls), name, self.spool_dir)
+        self.jobs[job.id] = job
+        job.task = asyncio.ensure_future(self._run(job))
+        self._evict()
+        return job
+
+    async def _run(self, job: Job):
+        job.state = RUNNING
+        try:
+            async for url, result in BatchRequestExecutor(self.job_in_flight).stream(job.urls, self.fetcher):
+                job.add(url, result)
+        except asyncio.CancelledError:
+            job.finish(CANCELLED)
+            return
+        job.finish(FINISHED)
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.jobs.pop(job_id)
+        if not job.done: job.task.cancel()
+        job.discard()
+        return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]: self.jobs.pop(job_id).discard()
+
+    def status(self) -> Dict:
+        return {'jobs': dict(Counter(job.state for job in self.jobs.values())), 'rate': self.limiter.rate, 'metrics': self.metrics.snapshot()}
+
+    # http api
+    def _job(self, request: web.Request) -> Job:
+        job = self.jobs.get(request.match_info['job_id'])
+        if job is None: raise web.HTTPNotFound(text=json.dumps({'error': 'no such job'}), content_type='application/json')
+        return job
+
+    async def _post_job(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            urls = body['urls'] if 'urls' in body else self.plan(body['tickers'], body['start'], body['end'], body.get('limit', 50000))
+            job = self.submit(urls, body.get('name'))
+        except (ValueError, KeyError, TypeError, AssertionError) as e:
+            return web.json_response({'error': f"bad job: {e!r}"}, status=400)
+        return web.json_response(job.info(), status=201)
+
+    async def _get_jobs(self, request: web.Request) -> web.Response: return web.json_response([job.info() for job in self.jobs.values()])
+    async def _get_job(self, request: web.Request) -> web.Response: return web.json_response(self._job(request).info())
+    async def _get_status(self, request: web.Request) -> web.Response: return web.json_response(self.status())
+
+    async def _delete_job(self, request: web.Request) -> web.Response:
+        self._job(request)
+        return web.json_response(self.cancel(request.match_info['job_id']).info())
+
+    async def _get_results(self, request: web.Request) -> web.StreamResponse:
+        job = self._job(request)
+        try: seen = int(request.query.get('from', 0))
+        except ValueError: seen = -1
+        if seen < 0: return web.json_response({'error': f"from must be a line index >= 0, got {request.query['from']!r}"}, status=400)
+        seen = min(seen, len(job.urls)) # past the end streams nothing once the job is done
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        loop = asyncio.get_running_loop()
+        while True:
+            await job.wait(seen)
+            if job.discarded: break
+            if job.completed > seen:
+                lines, seen = await loop.run_in_executor(None, job.read, seen) # from the spool file, a chunk at a time
+                await response.write(lines)
+            elif job.done: break
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/jobs', self._post_job)
+        app.router.add_get('/jobs', self._get_jobs)
+        app.router.add_get('/jobs/{job_id}', self._get_job)
+        app.router.add_delete('/jobs/{job_id}', self._delete_job)
+        app.router.add_get('/jobs/{job_id}/results', self._get_results)
+        app.router.add_get('/status', self._get_status)
+        return app
+
+    async def start(self):
+        await self.pool.open()
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.UnixSite(self._runner, self.path) if self.path else web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.path: self.port = site._server.sockets[0].getsockname()[1] # resolve port 0
+        return self
+
+    async def close(self):
+        for job in list(self.jobs.values()):
+            if not job.done: job.task.cancel()
+        await asyncio.gather(*[job.task for job in self.jobs.values()], return_exceptions=True)
+        if self._runner is not None: await self._runner.cleanup()
+        self._runner = None
+        await self.pool.close()
+        for job in self.jobs.values(): job.discard()
+        self.jobs.clear()
+        if self._own_spool: shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Fetch daemon listening on {self.path or f'http://{self.host}:{self.port}'}")
+        try: await asyncio.Event().wait()
+        finally: await self.close()
+
+    async def __aenter__(self): return await self.start()
+    async def __aexit__(self, exc_type, exc, tb): await self.close()
+
+# ! Client ========================================================================
+class DaemonClient:
+    def __init__(self, url: str = f"http://127.0.0.1:{DEFAULT_PORT}", path: str = None):
+        """Client for a `FetchDaemon` at `url` (or its unix socket `path`). `async with DaemonClient() as client: job = await client.submit(urls=urls)`"""
+        self.url = url if path is None else 'http://daemon' # host is ignored over a unix socket
+        self.path = path
+        self.session = None
+        self.decoder = get_json_decoder()
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.path) if self.path else None)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb): await self.session.close()
+
+    async def _call(self, method: str, path: str, **kwargs) -> Any:
+        async with self.session.request(method, f"{self.url}{path}", **kwargs) as response:
+            body = await response.json()
+            if response.status >= 400: raise RuntimeError(f"{method} {path} failed ({response.status}): {body.get('error')}")
+            return body
+
+    async def submit(self, urls: List[str] = None, tickers: List[str] = None, start: str = None, end: str = None, name: str = None, limit: int = 50000) -> Dict:
+        """Submit a url plan, or tickers + a date range. Returns the job info (`job['id']`)"""
+        payload = {'urls': urls} if urls is not None else {'tickers': tickers, 'start': start, 'end': end, 'limit': limit}
+        return await self._call('POST', '/jobs', json={**payload, 'name': name})
+
+    async def job(self, job_id: str) -> Dict: return await self._call('GET', f"/jobs/{job_id}")
+    async def jobs(self) -> List[Dict]: return await self._call('GET', '/jobs')
+    async def cancel(self, job_id: str) -> Dict: return await self._call('DELETE', f"/jobs/{job_id}")
+    async def status(self) -> Dict: return await self._call('GET', '/status')
+
+    async def results(self, job_id: str, start: int = 0) -> AsyncIterator[Tuple[str, Any]]:
+        """Yields (url, decoded response or None) as the job completes them, starting at the `start`th result. Ends when the job is done"""
+        async with self.session.get(f"{self.url}/jobs/{job_id}/results", params={'from': start}) as response:
+            if response.status >= 400: raise RuntimeError(f"results for {job_id} failed ({response.status})")
+            parts = [] # pieces of the current line, lines can be bigger than aiohttp's readline limit
+            async for chunk in response.content.iter_any():
+                *lines, rest = chunk.split(b'\n')
+                if lines:
+                    lines[0] = b''.join(parts + [lines[0]])
+                    parts = []
+                    for line in lines:
+                        item = self.decoder(line)
+                        yield item['url'], item['result']
+                if rest: parts.append(rest)
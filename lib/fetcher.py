@@ -1,61 +1,501 @@
 from aiolimiter import AsyncLimiter
 import aiohttp
 import asyncio
+import collections
+import json
+import signal
+import threading
 import time
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Any, Callable, List
+
+try: # optional fast json decoders, used by ResponseParser when installed
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from lib.limiter import AdaptiveLimiter, parse_retry_after
+from lib.cache import ResponseCache
+from lib.streaming import AggsStreamDecoder, decode_stream
+from lib.journal import RunJournal, DONE, FAILED
+from lib.retry import RetryPolicy, DeferredRetry, HedgePolicy, FATAL
+from lib.metrics import FetchMetrics
+
+class ConnectionPool:
+    def __init__(self, limit: int = 100, limit_per_host: int = 0, keepalive_timeout: float = 60, ttl_dns_cache: int = 300):
+        """
+        Shared aiohttp session + connector that outlives any single fetcher, pass it to many fetchers with `HttpRequestFetcher(pool=pool)`.
+        Keeps connections alive (and DNS cached) between batches so each new fetcher skips the TCP/TLS handshakes. `limit_per_host=0` means no per host limit.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.session = None
+
+    @property
+    def closed(self) -> bool: return self.session is None or self.session.closed
+
+    async def open(self) -> aiohttp.ClientSession:
+        """Returns the shared session, creating it on first use (must be called from inside the event loop it will be used on)"""
+        if self.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def warm(self, url: str, n: int = 10) -> int:
+        """Opens `n` connections to the host of `url` (concurrent HEAD requests) so they're ready before the first batch. Returns the number that succeeded"""
+        session = await self.open()
+
+        async def _head():
+            try:
+                async with session.head(url) as response:
+                    await response.read() # release the connection back to the pool
+                    return True
+            except aiohttp.ClientError:
+                return False
+
+        results = await asyncio.gather(*[_head() for _ in range(n)])
+        return sum(results)
+
+    async def close(self):
+        if not self.closed: await self.session.close()
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb): await self.close()
+
 
 class HttpRequestFetcher:
-    def __init__(self, retries: int = 2, rps: int = 2, detailed_logs=False):
-        """Fetcher with specified rate limiter and number of retries"""
-        self.limiter = AsyncLimiter(rps, time_period=1) # per second
-        self.retries = retries
+    def __init__(self, retries: int = 2, rps: int = 2, detailed_logs=False, pool: ConnectionPool = None, adaptive=False, limiter=None, cache: ResponseCache = None, retry_policy: RetryPolicy = None, parser: 'ResponseParser' = None, metrics: FetchMetrics = None, timeout: float = None, hedge: HedgePolicy = None):
+        """
+        Fetcher with specified rate limiter and number of retries. If a `pool` is provided its session is reused (and left open on exit).
+        Retries follow `retry_policy` (see `lib.retry`), by default a `RetryPolicy(retries=retries)`: jittered backoff, no retries on fatal errors like 404.
+        With `adaptive=True` the fixed limiter is swapped for an `AdaptiveLimiter` starting at `rps` that backs off on 429/503 and speeds up on success.
+        Pass `limiter` to share one limiter between fetchers (anything usable as `async with limiter:`).
+        With a `cache`, successful response bodies are stored on disk and cache hits skip the limiter and network.
+        `parser` parses responses when `fetch(parse=True)`, pass a configured `ResponseParser` to pick the json decoder or offload big bodies.
+        With `metrics` (see `lib.metrics`), request counts, status codes, bytes and limiter wait / time to first byte / body read latencies are recorded.
+        `timeout` is a deadline (seconds) for each attempt incl. reading the body, a hung connection then fails (and is retried) instead of holding its batch open.
+        With a `hedge` policy (see `lib.retry.HedgePolicy`) requests running slower than a latency percentile get a duplicate sent, the first answer is used.
+        """
+        if limiter is not None: self.limiter = limiter
+        elif adaptive: self.limiter = AdaptiveLimiter(rate=rps)
+        else: self.limiter = AsyncLimiter(rps, time_period=1) # per second
+        self.retry_policy = retry_policy or RetryPolicy(retries=retries)
+        self.retries = self.retry_policy.retries
         self.session = None
+        self._entered = 0
         self.detailed_logs = detailed_logs
+        self.pool = pool
+        self.cache = cache
+        self.parser = parser or ResponseParser()
+        self.metrics = metrics
+        self.timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        self.hedge = hedge
+
+    async def __aenter__(self):
+        if self._entered == 0: self.session = await self.pool.open() if self.pool else aiohttp.ClientSession()
+        self._entered += 1 # nested runs (e.g. repairs while a stream is open) share the session
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._entered -= 1
+        if self._entered == 0 and self.pool is None: await self.session.close() # the pool owns its session
+
+    def _feedback(self, status: int, headers=None):
+        """Report a response status to the limiter, if it adapts to feedback"""
+        feedback = getattr(self.limiter, 'feedback', None)
+        if feedback is None: return
+        retry_after = parse_retry_after(headers.get('Retry-After')) if headers else None
+        feedback(status, retry_after)
+
+    async def _attempt(self, url: str, ref: float, parse: bool, sent: asyncio.Event = None, hedge: bool = False):
+        """One request through the limiter, raises on network / http errors. Sets `sent` once it's past the limiter. Hedges skip the limiter's queue if it has one"""
+        m = self.metrics
+        wait_start = time.perf_counter()
+        priority = getattr(self.limiter, 'priority', None) if hedge else None
+        async with priority() if priority is not None else self.limiter:
+            if m is not None: m.limiter_wait.observe(time.perf_counter() - wait_start)
+            if sent is not None: sent.set()
+            if self.detailed_logs is True: print(f'Request! {time.time() - ref:>5.2f}s')
+            with m.request() if m is not None else nullcontext(): # in flight gauge
+                sent_at = start = time.perf_counter()
+                async with self.session.get(url, **({'timeout': self.timeout} if self.timeout is not None else {})) as response:
+                    if m is not None:
+                        m.ttfb.observe(time.perf_counter() - start)
+                        m.statuses[response.status] += 1
+                    self._feedback(response.status, response.headers)
+                    response.raise_for_status()
+                    stream = parse and self.parser.streaming and self.cache is None # let the parser read the body as it arrives
+                    if (m is not None and not stream) or self.cache is not None:
+                        start = time.perf_counter()
+                        body = await response.read() # aiohttp keeps the body, parsing below won't read it again
+                        if m is not None:
+                            m.body_read.observe(time.perf_counter() - start)
+                            m.bytes += len(body)
+                        if self.cache is not None: self.cache.set(url, body, response.headers.get('Content-Type', ''))
+                    if parse and stream and m is not None:
+                        start = time.perf_counter()
+                        result = await self.parser.parse(response)
+                        m.body_read.observe(time.perf_counter() - start) # download and decode overlap
+                        m.bytes += response.content.total_bytes
+                    elif parse:
+                        result = await self.parser.parse(response)
+                    else:
+                        result = response
+                    if self.hedge is not None: self.hedge.observe(time.perf_counter() - sent_at)
+                    return result
+
+    async def _send(self, url: str, ref: float, parse: bool):
+        """`_attempt`, plus a hedge if the hedge policy says the request is running slow: first answer wins, the other is cancelled"""
+        delay = self.hedge.delay() if self.hedge is not None else None
+        if delay is None: return await self._attempt(url, ref, parse)
+
+        sent = asyncio.Event()
+        async def _timer():
+            await sent.wait() # time on the wire, not in the limiter queue
+            await asyncio.sleep(delay)
 
-    async def __aenter__(self): self.session = aiohttp.ClientSession()
-    async def __aexit__(self, exc_type, exc, tb): await self.session.close()
+        primary = asyncio.ensure_future(self._attempt(url, ref, parse, sent))
+        timer = asyncio.ensure_future(_timer())
+        tasks = [primary, timer]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if primary.done() or not self.hedge.allow(): return await primary
+            if self.metrics is not None: self.metrics.hedges += 1
+            hedge = asyncio.ensure_future(self._attempt(url, ref, parse, hedge=True))
+            tasks.append(hedge)
+            pending, error = {primary, hedge}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge and self.metrics is not None: self.metrics.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error # both failed, retried like any failure
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(lambda task: task.cancelled() or task.exception()) # the loser's error isn't interesting
 
-    async def fetch(self, url: str, ref=time.time(), parse=True):
+    async def fetch(self, url: str, ref=time.time(), parse=True, defer: bool = None):
+        """
+        Fetch (and by default parse) a url, returns None if it fails.
+        If `defer` (defaults to `retry_policy.defer`), a url that runs out of retries on a retryable error raises `DeferredRetry` instead, so the executor can retry it after the main batch.
+        """
+        m = self.metrics
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                if m is not None: m.cache_hits += 1
+                return await self.parser.parse(cached) if parse else cached
+
+        defer = self.retry_policy.defer if defer is None else defer
+        delay = None # previous backoff, for decorrelated jitter
         for attempt in range(self.retries + 1):
-            async with self.limiter:
-                print(f'Request! {time.time() - ref:>5.2f}s')
-                try:
-                    async with self.session.get(url) as response:
-                        response.raise_for_status()
-                        if parse:
-                            return await ResponseParser().parse(response)
-                        else:
-                            return response
-                except aiohttp.ClientError as e:
-                    if attempt == self.retries:
-                        print(f"Failed to fetch {url}. Error: {e}") # print error
-                        return None
-                    elif self.detailed_logs is True:
-                        print(f"Failed to fetch {url}. Error: {e} - retrying... attepmpt: {attempt + 1} of max: {self.retries + 1}")
-                    backoff_duration = 2 ** attempt # exponential backoff
-                    await asyncio.sleep(backoff_duration)
+            try:
+                return await self._send(url, ref, parse)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                kind = self.retry_policy.classify(e)
+                if not self.retry_policy.should_retry(kind, attempt):
+                    if defer and kind != FATAL: raise DeferredRetry(url) from e
+                    if m is not None: m.failures += 1
+                    print(f"Failed to fetch {url}. Error: {e!r}") # print error
+                    return None
+                elif self.detailed_logs is True:
+                    print(f"Failed to fetch {url}. Error: {e!r} ({kind}) - retrying... attepmpt: {attempt + 1} of max: {self.retries + 1}")
+                if m is not None: m.retries += 1
+                headers = getattr(e, 'headers', None)
+                retry_after = parse_retry_after(headers.get('Retry-After')) if headers else None
+                delay = self.retry_policy.backoff(delay, retry_after) # jittered backoff
+                await asyncio.sleep(delay)
+
+_DEFERRED = object() # returned by BatchRequestExecutor._fetch for urls deferred by the retry policy
+
+def _remaining(end: float = None, default: float = None) -> float:
+    """Seconds until `end` (monotonic time), `default` if there's no end"""
+    return max(end - time.monotonic(), 0) if end is not None else default
 
 class BatchRequestExecutor:
-    def __init__(self) -> None: pass
+    def __init__(self, max_in_flight: int = 100, deadline: float = None, grace: float = 2.0) -> None:
+        """
+        Executor for batches of urls. `max_in_flight` caps concurrent requests in `stream` mode.
+        `deadline` (seconds) bounds each batch: urls still in flight when it passes are cancelled and come back as None (journaled as FAILED), so one hung url can't hold a batch open.
+        `cancel()` (or a signal inside `cancel_on_signal()`) stops runs gracefully: requests in flight get `grace` seconds to finish, completed results are still returned.
+        """
+        assert isinstance(max_in_flight, int) and max_in_flight > 0, "max_in_flight must be a positive integer"
+        assert deadline is None or deadline > 0, "deadline must be positive"
+        self.max_in_flight = max_in_flight
+        self.deadline = deadline
+        self.grace = grace
+        self.cancelled = False
+        self.outstanding: List[str] = [] # urls runs didn't get to because of `cancel()`
+        self._runs = {} # cancel event -> loop, for runs in progress
+
+    def cancel(self):
+        """
+        Stop every run on this executor: nothing new is started, requests in flight get `grace` seconds to finish and are then aborted.
+        Runs return what completed (None for the rest, `stream` just stops) and add the urls they didn't get to to `outstanding` (they stay pending in a journal).
+        Safe to call from another thread or a signal handler. The executor stays cancelled, later runs return straight away.
+        """
+        self.cancelled = True
+        for event, loop in list(self._runs.items()): loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def cancel_on_signal(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        """While the block runs, the first SIGINT / SIGTERM calls `cancel()` instead of raising KeyboardInterrupt, a second one interrupts for real"""
+        if threading.current_thread() is not threading.main_thread(): # signal handlers can only be set from the main thread
+            yield self
+            return
+        previous = {sig: signal.getsignal(sig) for sig in signals}
+        def _handler(signum, frame):
+            if self.cancelled: raise KeyboardInterrupt
+            print(f"Cancelling, requests in flight get {self.grace}s to finish (again to abort)")
+            self.cancel()
+        for sig in signals: signal.signal(sig, _handler)
+        try:
+            yield self
+        finally:
+            for sig, handler in previous.items(): signal.signal(sig, handler)
+
+    @asynccontextmanager
+    async def _run(self):
+        """Cancel event for a run, set right away if the executor is already cancelled"""
+        event = asyncio.Event()
+        if self.cancelled: event.set()
+        self._runs[event] = asyncio.get_running_loop()
+        try:
+            yield event
+        finally:
+            del self._runs[event]
+
+    def _expire(self, urls, fetcher: HttpRequestFetcher, journal: RunJournal = None):
+        """Book urls cut off by the deadline as failed"""
+        if not urls: return
+        print(f"Batch deadline of {self.deadline}s passed, {len(urls)} urls unfinished")
+        metrics = getattr(fetcher, 'metrics', None)
+        if metrics is not None:
+            metrics.failures += len(urls)
+            metrics.completed += len(urls)
+        if journal is not None:
+            for url in urls: journal.record(url, FAILED)
+
+    def _abandon(self, urls):
+        """Book urls dropped by `cancel()` as outstanding"""
+        if not urls: return
+        print(f"Cancelled, {len(urls)} urls outstanding")
+        self.outstanding.extend(urls)
+
+    async def _gather(self, tasks, urls, fetcher: HttpRequestFetcher, journal: RunJournal, end: float = None, cancel: asyncio.Event = None):
+        """
+        Results of `tasks` (fetching `urls`), None for the ones still running at `end` (monotonic time, booked as failed)
+        or `grace` seconds after `cancel` is set (booked as outstanding), which are cancelled.
+        """
+        tasks = [asyncio.ensure_future(task) for task in tasks]
+        all_done = asyncio.ensure_future(asyncio.wait(tasks))
+        cancelled = asyncio.ensure_future(cancel.wait())
+        try:
+            await asyncio.wait([all_done, cancelled], timeout=_remaining(end), return_when=asyncio.FIRST_COMPLETED)
+            if not all_done.done() and cancel.is_set(): # drain what's in flight
+                await asyncio.wait([all_done], timeout=min(self.grace, _remaining(end, self.grace)))
+        finally:
+            all_done.cancel()
+            cancelled.cancel()
+        pending = {task for task in tasks if not task.done()}
+        for task in pending: task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        unfinished = [url for url, task in zip(urls, tasks) if task in pending]
+        if cancel.is_set(): self._abandon(unfinished)
+        else: self._expire(unfinished, fetcher, journal)
+        return [None if task in pending else task.result() for task in tasks]
 
     def _validate_urls(self, urls):
         assert isinstance(urls, list), f"urls must be a list, is {type(urls)}"
         assert isinstance(urls[0], str), f"urls must be a list of strings, is list of {type(urls[0])}s"
 
-    async def _execute(self, urls, fetcher: HttpRequestFetcher):
-        """Use asyncio.run() to execute"""
+    async def _fetch(self, url: str, fetcher: HttpRequestFetcher, journal: RunJournal = None, final: bool = False):
+        """
+        Fetch a single url, recording the outcome in the run journal if there is one.
+        Returns `_DEFERRED` if the fetcher's retry policy deferred the url, `final=True` is the deferred retry itself (can't be deferred again).
+        """
+        try:
+            result = await fetcher.fetch(url, ref=time.time(), **({'defer': False} if final else {}))
+        except DeferredRetry:
+            return _DEFERRED # not journaled yet, gets another go after the main batch
+        if journal is not None: journal.record(url, DONE if result is not None else FAILED) # fetch returns None once retries are exhausted
+        metrics = getattr(fetcher, 'metrics', None)
+        if metrics is not None: metrics.completed += 1
+        return result
+
+    async def execute_async(self, urls, fetcher: HttpRequestFetcher, journal: RunJournal = None) -> List:
+        """`execute` from inside a running event loop: results aligned with `urls`, None where a request failed. Pass a `journal` to checkpoint progress"""
         self._validate_urls(urls) # validate urls
-        async with fetcher: # context manager, init aiohttp session
-            tasks = [fetcher.fetch(url, ref=time.time()) for url in urls] # create tasks
-            return await asyncio.gather(*tasks) # returns gathered results
+        metrics = getattr(fetcher, 'metrics', None)
+        if metrics is not None: metrics.total += len(urls) # for progress reporting
+        end = time.monotonic() + self.deadline if self.deadline is not None else None
+        if self.cancelled:
+            self._abandon(urls)
+            return [None] * len(urls)
+        async with fetcher, self._run() as cancel: # context manager, init aiohttp session
+            tasks = [self._fetch(url, fetcher, journal) for url in urls] # create tasks
+            try:
+                results = await self._gather(tasks, urls, fetcher, journal, end, cancel) # returns gathered results
+                deferred = [idx for idx, result in enumerate(results) if result is _DEFERRED]
+                if deferred and cancel.is_set(): # no new requests once cancelled
+                    self._abandon([urls[idx] for idx in deferred])
+                    for idx in deferred: results[idx] = None
+                elif deferred: # retry deferred urls now that the main batch is done
+                    retried = await self._gather([self._fetch(urls[idx], fetcher, journal, final=True) for idx in deferred], [urls[idx] for idx in deferred], fetcher, journal, end, cancel)
+                    for idx, result in zip(deferred, retried): results[idx] = result
+                return results
+            finally:
+                if journal is not None: journal.flush()
+
+    async def stream(self, urls, fetcher: HttpRequestFetcher, max_in_flight: int = None, ordered: bool = False, journal: RunJournal = None):
+        """
+        Async generator that yields (url, result) tuples as requests complete, e.g. `async for url, result in executor.stream(urls, fetcher)`.
+        Only `max_in_flight` requests are scheduled at a time, so memory stays flat regardless of how many urls there are (urls can be any iterable, incl. a generator).
+        If `ordered` is True, results are yielded in the same order as `urls`. Out of order results are buffered and count towards `max_in_flight`.
+        If a `journal` is provided, every completed url is recorded in it (see `lib.journal`).
+        Urls deferred by the fetcher's retry policy are retried once every other url has been scheduled (right away when `ordered`, so they don't stall the window).
+        Once the executor's `deadline` passes, urls in flight (or deferred) are cancelled and yielded with None, urls not started yet are dropped (they stay outstanding in the journal).
+        """
+        end = time.monotonic() + self.deadline if self.deadline is not None else None
+        limit = max_in_flight or self.max_in_flight
+        assert isinstance(limit, int) and limit > 0, "max_in_flight must be a positive integer"
+        metrics = getattr(fetcher, 'metrics', None)
+        if metrics is not None and hasattr(urls, '__len__'): metrics.total += len(urls) # for progress reporting, unknown for generators
+        urls = iter(urls)
+        pending = {} # task -> (seq, url)
+        buffer = {} # seq -> (url, result), only used when ordered
+        next_seq = 0 # next seq to yield when ordered
+        counter = 0 # seq of the next scheduled url
+        exhausted = object() # sentinel for the end of urls
+        deferred = collections.deque() # (seq, url) deferred by the retry policy
+
+        def _schedule(seq, url, final=False):
+            task = asyncio.ensure_future(self._fetch(url, fetcher, journal, final=final))
+            pending[task] = (seq, url)
+
+        def _fill():
+            nonlocal counter
+            while len(pending) + len(buffer) < limit:
+                url = next(urls, exhausted)
+                if url is not exhausted:
+                    assert isinstance(url, str), f"urls must be strings, got {type(url)}"
+                    _schedule(counter, url)
+                    counter += 1
+                elif deferred:
+                    _schedule(*deferred.popleft(), final=True)
+                else:
+                    return
+
+        async with fetcher, self._run() as cancel: # context manager, init aiohttp session
+            cancelled = asyncio.ensure_future(cancel.wait())
+            drain_end = None # set once cancelled: requests in flight get `grace` seconds
+            try:
+                if not cancel.is_set(): _fill()
+                while pending:
+                    if cancel.is_set() and drain_end is None: drain_end = time.monotonic() + self.grace
+                    stop = min((t for t in (end, drain_end) if t is not None), default=None)
+                    done, _ = await asyncio.wait([*pending] + ([cancelled] if not cancelled.done() else []), timeout=_remaining(stop), return_when=asyncio.FIRST_COMPLETED)
+                    done.discard(cancelled)
+                    if not done and drain_end is not None and time.monotonic() >= drain_end: # grace is over
+                        break
+                    if not done and end is not None and time.monotonic() >= end: # deadline passed
+                        expired = sorted(list(pending.values()) + list(deferred))
+                        for task in pending: task.cancel()
+                        await asyncio.gather(*pending, return_exceptions=True)
+                        pending.clear()
+                        self._expire([url for _, url in expired], fetcher, journal)
+                        if ordered: # the window is contiguous, so this drains the buffer in order
+                            buffer.update({seq: (url, None) for seq, url in expired})
+                            for seq in sorted(buffer): yield buffer.pop(seq)
+                        else:
+                            for _, url in expired: yield url, None
+                        return
+                    completed = []
+                    for task in done:
+                        seq, url = pending.pop(task)
+                        result = task.result()
+                        if result is not _DEFERRED: completed.append((seq, url, result))
+                        elif ordered and not cancel.is_set(): _schedule(seq, url, final=True)
+                        else: deferred.append((seq, url))
+                    if ordered:
+                        buffer.update({seq: (url, result) for seq, url, result in completed})
+                        while next_seq in buffer: # yield the contiguous run of results we have
+                            yield buffer.pop(next_seq)
+                            next_seq += 1
+                    else:
+                        for _, url, result in completed:
+                            yield url, result
+                    if not cancel.is_set(): _fill() # refill the window
+
+                if cancel.is_set(): # whatever completed is handed over, the rest is outstanding
+                    aborted = sorted(list(pending.values()) + list(deferred))
+                    for seq in sorted(buffer): yield buffer.pop(seq) # completed behind a gap
+                    self._abandon([url for _, url in aborted] + list(urls))
+            finally: # consumer stopped early or we were cancelled, don't leak tasks
+                cancelled.cancel()
+                for task in pending: task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                if journal is not None: journal.flush()
+
+    def execute(self, urls, fetcher: HttpRequestFetcher, loop: asyncio.AbstractEventLoop = None, journal: RunJournal = None, handle_signals: bool = True):
+        """
+        Use BatchRequestExecutor().execute() to execute. Pass a `journal` to checkpoint progress (see `lib.journal`).
+        With `handle_signals` ctrl-c returns what's been fetched so far (see `cancel_on_signal`), callers that can't tell partial results apart (e.g. worker processes) turn it off.
+        """
+        if loop is None: # get event loop if not provided, else use provided
+            try:
+                loop = asyncio.get_event_loop()
+            except RuntimeError: # no current loop (e.g. a previous asyncio.run() closed it), make one
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+        if not handle_signals: return loop.run_until_complete(self.execute_async(urls, fetcher, journal))
+        with self.cancel_on_signal(): # ctrl-c returns what's been fetched so far, see `cancel`
+            return loop.run_until_complete(self.execute_async(urls, fetcher, journal)) # run until complete
 
-    def execute(self, urls, fetcher: HttpRequestFetcher, loop: asyncio.AbstractEventLoop = None):
-        """Use BatchRequestExecutor().execute() to execute"""
-        loop = loop or asyncio.get_event_loop() # get event loop if not provided, else use provided
-        return loop.run_until_complete(self._execute(urls, fetcher)) # run until complete
 
+JSON_DECODERS = {'json': json.loads} # name -> bytes decoder, fastest installed first
+if msgspec is not None: JSON_DECODERS = {'msgspec': msgspec.json.decode, **JSON_DECODERS}
+if orjson is not None: JSON_DECODERS = {'orjson': orjson.loads, **JSON_DECODERS}
+
+def get_json_decoder(name: str = None) -> Callable[[bytes], Any]:
+    """Returns a json decoder that takes raw bytes. By default the fastest one installed (orjson > msgspec > stdlib json)"""
+    if name is None: return next(iter(JSON_DECODERS.values()))
+    assert name in JSON_DECODERS, f"json decoder {name} is not installed, available: {list(JSON_DECODERS)}"
+    return JSON_DECODERS[name]
 
 class ResponseParser:
-    def __init__(self):
+    def __init__(self, decoder: Callable[[bytes], Any] = None, offload_threshold: int = None, executor: Executor = None, streaming: bool = False, chunk_size: int = 64 * 1024):
+        """
+        Parses responses by content type. JSON bodies are read as raw bytes and decoded with `decoder` (default: fastest installed, see `get_json_decoder`).
+        Bodies of at least `offload_threshold` bytes are decoded in `executor` (default thread pool, or pass a ProcessPoolExecutor) so the event loop stays free to issue requests.
+        With `streaming=True` aggregates bodies are decoded `chunk_size` bytes at a time while they download, bars going straight into column buffers
+        (`results` comes back as `lib.streaming.BarColumns`, see `AggsStreamDecoder`). The whole body is never held, unless something else already read it (e.g. the cache).
+        """
+        self.decoder = decoder or get_json_decoder()
+        self.offload_threshold = offload_threshold
+        self.executor = executor
+        self.streaming = streaming
+        self.chunk_size = chunk_size
         self.parsers = {
             'text/html': self._html,
             'application/json': self._json,
@@ -63,7 +503,18 @@ class ResponseParser:
             'text/plain': self._text,
         }
 
-    async def _json(self, response): return await response.json()
+    async def _json(self, response):
+        if self.streaming:
+            if getattr(response, '_body', None) is None and hasattr(response, 'content'): # body not read yet, decode it as it arrives
+                return await decode_stream(response.content, self.decoder, self.chunk_size)
+            stream = AggsStreamDecoder(self.decoder, batch_bytes=self.chunk_size)
+            stream.feed(await response.read())
+            return stream.close()
+        body = await response.read()
+        if self.offload_threshold is not None and len(body) >= self.offload_threshold:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.decoder, body)
+        return self.decoder(body)
+
     async def _text(self, response): return await response.text()
     async def _html(self, response): return await self._text(response)
     async def _xml(self, response): return await self._text(response)
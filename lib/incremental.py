@@ -0,0 +1,134 @@
+import asyncio
+import os
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import List, Tuple, Dict, Optional
+
+from lib.utils import get_polygon_key, validate_path
+from lib.polygon import POLYGON_BASE_URL, PlannedRequest, EXTENDED_MINUTES, make_url, session_bounds, plan_windows, trim_to_sessions, validate_results_columnar, fetch_complete
+
+RAW_FILE_RE = re.compile(r'^(?P<ticker>.+)-(?P<start>\d{4}-\d{2}-\d{2})-(?P<end>\d{4}-\d{2}-\d{2})\.csv$')
+MINUTE_MS = 60_000
+
+# ! What's on disk ===================================================================
+def existing_files(raw_dir: str, ticker: str) -> List[Tuple[Path, str, str]]:
+    """(path, start, end) of every `{ticker}-{start}-{end}.csv` in `raw_dir`, oldest range first"""
+    files = []
+    for path in Path(raw_dir).glob(f"{ticker}-*.csv"):
+        match = RAW_FILE_RE.match(path.name)
+        if match is not None and match['ticker'] == ticker: files.append((path, match['start'], match['end'])) # BRK.B-... shouldn't match BRK-...
+    return sorted(files, key=lambda f: (f[1], f[2]))
+
+def load_existing(raw_dir: str, ticker: str) -> pd.DataFrame:
+    """Every bar saved for `ticker` (across however many csvs), sorted by `t` with duplicates dropped. Empty if there's nothing yet"""
+    frames = [pd.read_csv(path, index_col=0) for path, _, _ in existing_files(raw_dir, ticker)]
+    if not frames: return pd.DataFrame()
+    return merge_bars(*frames)
+
+def existing_t(raw_dir: str, ticker: str) -> np.ndarray:
+    """Sorted, unique `t` of every bar saved for `ticker`, only that column is parsed. Enough to plan a delta without loading the bars"""
+    ts = [pd.read_csv(path, usecols=['t'])['t'].to_numpy(dtype=np.int64) for path, _, _ in existing_files(raw_dir, ticker)]
+    return np.unique(np.concatenate(ts)) if ts else np.empty(0, dtype=np.int64)
+
+def merge_bars(*frames: pd.DataFrame) -> pd.DataFrame:
+    """Concat bar frames, newest frame wins on duplicate `t`"""
+    frames = [df for df in frames if len(df) > 0]
+    if not frames: return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates('t', keep='last').sort_values('t').reset_index(drop=True)
+
+# ! Planning the delta ===============================================================
+def missing_sessions(t: np.ndarray, opens: np.ndarray, closes: np.ndarray, refresh_last: bool = True) -> np.ndarray:
+    """
+    Boolean mask over sessions with no bars in `t` (unix ms). With `refresh_last` the last session that has bars is also
+    refetched if it doesn't reach its close, i.e. it was saved while the session was still trading.
+    """
+    missing = np.ones(len(opens), dtype=bool)
+    if len(t) == 0: return missing
+    t = np.asarray(t, dtype=np.int64)
+    day = np.searchsorted(opens, t, side='right') - 1 # session each bar falls in
+    inside = (day >= 0) & (t <= closes[np.clip(day, 0, None)])
+    missing[day[inside]] = False
+
+    if refresh_last and inside.any():
+        last = day[inside].max()
+        if t[inside].max() < closes[last] - MINUTE_MS: missing[last] = True # last bar of a full session is at close - 1 minute
+    return missing
+
+def missing_runs(missing: np.ndarray) -> List[Tuple[int, int]]:
+    """[start, stop) session index ranges of consecutive missing sessions"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], missing.astype(np.int8), [0]])))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+def plan_delta(ticker: str, t: np.ndarray, start: str, end: str, limit: int = 50000, fill: float = 0.9, extended_minutes: int = EXTENDED_MINUTES, refresh_last: bool = True, api_key: str = None, base: str = POLYGON_BASE_URL) -> List[PlannedRequest]:
+    """
+    Plan requests for only the sessions between start and end that aren't in `t` (see `missing_sessions`).
+    Each run of consecutive missing sessions is packed into multi-day windows like `lib.polygon.plan_urls`, windows never span a session we already have.
+    """
+    opens, closes = session_bounds(start, end)
+    api_key = api_key or get_polygon_key()
+    plan = []
+    for first, stop in missing_runs(missing_sessions(t, opens, closes, refresh_last)):
+        for w_start, w_end, days, expected_rows, max_rows in plan_windows(opens[first:stop], closes[first:stop], limit, fill, extended_minutes):
+            plan.append(PlannedRequest(make_url(ticker, w_start, w_end, limit=limit, api_key=api_key, base=base), ticker, w_start, w_end, days, expected_rows, max_rows))
+    return plan
+
+# ! Fetch + merge ====================================================================
+def bars_frame(results: List[Optional[Dict]]) -> Tuple[pd.DataFrame, List[Dict]]:
+    """Validated bars (same columns as the saved csvs) and the invalidated raw responses"""
+    return validate_results_columnar([result for result in results if result is not None])
+
+def save_merged(df: pd.DataFrame, raw_dir: str, ticker: str, start: str, end: str, replace: List[Path] = ()) -> Path:
+    """Write `{ticker}-{start}-{end}.csv` atomically, then remove the csvs it supersedes (`replace`)"""
+    validate_path(raw_dir)
+    path = Path(raw_dir) / f"{ticker}-{start}-{end}.csv"
+    tmp = path.with_suffix('.csv.tmp')
+    df.to_csv(tmp)
+    os.replace(tmp, path) # a crash mid-write never leaves a half written csv
+    for old in replace:
+        if Path(old) != path and Path(old).exists(): Path(old).unlink()
+    return path
+
+async def fetch_delta(ticker: str, raw_dir: str, start: str, end: str, fetcher, executor, limit: int = 50000, fill: float = 0.9, refresh_last: bool = True, api_key: str = None, base: str = POLYGON_BASE_URL, repair=None) -> Dict:
+    """
+    Bring `ticker`'s csv in `raw_dir` up to date for start..end: load what's on disk, fetch only the missing sessions and merge them in.
+    The merged csv covers the union of the requested range and every existing file's range, the files it replaces are removed.
+    Returns a summary dict (requests, new rows, total rows, path, invalidated responses).
+    Planning only parses the `t` column, the full csvs are loaded (off the event loop) only when there's something to merge in.
+    With a `repair` (`lib.repair.Repairer`) invalidated responses are refetched (and quarantined if that doesn't help) before merging.
+    """
+    loop = asyncio.get_running_loop()
+    files = existing_files(raw_dir, ticker)
+    t = await loop.run_in_executor(None, existing_t, raw_dir, ticker)
+    plan = plan_delta(ticker, t, start, end, limit, fill, refresh_last=refresh_last, api_key=api_key, base=base)
+    summary = {'ticker': ticker, 'requests': len(plan), 'new_rows': 0, 'rows': len(t), 'path': files[-1][0] if files else None, 'invalidated': []}
+    if not plan: return summary
+
+    urls = [p.url for p in plan]
+    results = await fetch_complete(urls, fetcher, executor)
+    if repair is not None: results = await repair.repair(urls, results)
+    opens, closes = session_bounds(start, end)
+    new, invalidated = bars_frame([trim_to_sessions(result, opens, closes) for result in results]) # multi-day windows include extended hours
+
+    def _merge():
+        existing = load_existing(raw_dir, ticker)
+        merged = merge_bars(existing, new)
+        first = min([start] + [f_start for _, f_start, _ in files])
+        last = max([end] + [f_end for _, _, f_end in files])
+        return len(existing), len(merged), save_merged(merged, raw_dir, ticker, first, last, replace=[f for f, _, _ in files])
+
+    old_rows, rows, path = await loop.run_in_executor(None, _merge) # read + write the csv in a thread, the loop keeps fetching other tickers
+    summary.update({'new_rows': rows - old_rows, 'rows': rows, 'path': path, 'invalidated': invalidated})
+    return summary
+
+async def fetch_deltas(tickers: List[str], raw_dir: str, start: str, end: str, fetcher, executor, concurrency: int = 8, **kwargs) -> List[Dict]:
+    """`fetch_delta` for every ticker, at most `concurrency` at a time so only that many tickers' csvs are ever in memory. Summaries in `tickers` order"""
+    assert concurrency > 0, "concurrency must be positive"
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(ticker):
+        async with semaphore: return await fetch_delta(ticker, raw_dir, start, end, fetcher, executor, **kwargs)
+
+    return await asyncio.gather(*[_one(ticker) for ticker in tickers])
@@ -0,0 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+try: # optional, only needed to check the parquet / arrow dataset (csvs fall back to pandas)
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+from lib.incremental import RAW_FILE_RE, missing_runs
+from lib.utils import get_calendar
+
+MINUTE_MS = 60_000
+COLUMNS = ['t', 'o', 'h', 'l', 'c', 'v', 'vw', 'n'] # what the checks read
+
+class TickerReport(NamedTuple):
+    ticker: str
+    rows: int
+    sessions: int # NYSE sessions in the checked range
+    duplicates: int # rows whose t was already seen
+    non_monotonic: int # places where t goes backwards (in stored order, csvs only: a dataset is read sorted)
+    outside_session: int # bars outside regular hours
+    missing_sessions: int # sessions with no bars at all
+    sparse_sessions: int # sessions with bars, but under `min_coverage` of the expected minutes
+    missing_minutes: int # expected regular session minutes without a bar
+    ohlc: int # bars with l > min(o, c), h < max(o, c), vw outside [l, h] or non-positive prices
+    zero_volume: int # bars with v <= 0 or n <= 0
+    fractional_volume: int # bars with a non-integer v (GE style)
+    refetch: List[Tuple[str, str]] # (first, last) session dates of runs of sessions that should be fetched again
+    rewritten: int = 0 # dataset bars superseded by a newer part file (a re-run), dropped before checking like the readers do, not a defect
+
+    @property
+    def ok(self) -> bool: return not (self.duplicates or self.non_monotonic or self.ohlc or self.zero_volume or self.refetch)
+
+# ! Checks ========================================================================
+def check_bars(ticker: str, cols: Dict[str, np.ndarray], start: str = None, end: str = None, min_coverage: float = 0.5, tolerance: float = 1e-6) -> TickerReport:
+    """
+    Run every check on one ticker's bars (`cols` holds the COLUMNS arrays in stored order) with whole-array operations.
+    Sessions come from the NYSE calendar between start and end (default: the dates of the first and last bar).
+    A session goes on the refetch list if it's missing, sparse, or has duplicate / inconsistent bars.
+    """
+    t = np.asarray(cols['t'], dtype=np.int64)
+    if start is None or end is None:
+        if len(t) == 0: return TickerReport(ticker, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, [])
+        local = pd.to_datetime([t.min(), t.max()], unit='ms', utc=True).tz_convert('America/New_York')
+        start, end = start or local[0].strftime('%Y-%m-%d'), end or local[1].strftime('%Y-%m-%d')
+    dates, opens, closes = get_calendar().sessions(start, end)
+
+    # time axis
+    non_monotonic = int((np.diff(t) < 0).sum())
+    order = np.argsort(t, kind='stable')
+    t_sorted = t[order]
+    dup = np.zeros(len(t), dtype=bool)
+    dup[order[1:]] = t_sorted[1:] == t_sorted[:-1] # every repeat after the first
+    day = np.searchsorted(opens, t, side='right') - 1
+    inside = (day >= 0) & (t <= closes[np.clip(day, 0, None)]) # open <= t <= close, like the per day urls
+
+    # minutes per session
+    expected = (closes - opens) // MINUTE_MS
+    observed = np.bincount(day[inside & ~dup], minlength=len(opens))
+    missing = observed == 0
+    sparse = ~missing & (observed < expected * min_coverage)
+
+    # values
+    o, h, l, c, v, vw, n = (np.asarray(cols[k], dtype=np.float64) for k in ('o', 'h', 'l', 'c', 'v', 'vw', 'n'))
+    low, high = np.minimum(o, c), np.maximum(o, c)
+    bad_ohlc = (l > low + tolerance) | (h < high - tolerance) | (vw < l - tolerance) | (vw > h + tolerance) | (np.minimum(np.minimum(o, c), np.minimum(h, l)) <= 0)
+    zero_volume = (v <= 0) | (n <= 0)
+    fractional = v != np.floor(v)
+
+    # sessions to fetch again
+    bad_session = missing | sparse
+    flagged = (dup | bad_ohlc | zero_volume) & inside
+    bad_session[np.unique(day[flagged])] = True
+    day_str = np.datetime_as_string(dates, unit='D')
+    refetch = [(day_str[first], day_str[stop - 1]) for first, stop in missing_runs(bad_session)]
+
+    return TickerReport(
+        ticker=ticker,
+        rows=len(t),
+        sessions=len(opens),
+        duplicates=int(dup.sum()),
+        non_monotonic=non_monotonic,
+        outside_session=int((~inside).sum()),
+        missing_sessions=int(missing.sum()),
+        sparse_sessions=int(sparse.sum()),
+        missing_minutes=int(np.clip(expected - observed, 0, None).sum()),
+        ohlc=int(bad_ohlc.sum()),
+        zero_volume=int(zero_volume.sum()),
+        fractional_volume=int(fractional.sum()),
+        refetch=refetch,
+    )
+
+# ! Sources =======================================================================
+def _read_dataset_ticker(root: Path, ticker: str, format: str) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    A ticker's bars from a `lib.store` dataset as the readers see them (`lib.store.read_dataset`, `lib.reader.DatasetReader`): sorted on t, newest part file wins on duplicate t.
+    Returns the columns (only the checked ones are read) and how many rewritten bars were dropped.
+    """
+    parts = sorted((root / f"ticker={ticker}").rglob('part-*'))
+    table = ds.dataset([str(p) for p in parts], format=format).to_table(columns=COLUMNS) # files are scanned concurrently, order is kept
+    t = table['t'].to_numpy()
+    order = np.argsort(t, kind='stable')
+    keep = np.append(t[order][1:] != t[order][:-1], True) # last of each run of equal t
+    table = table.take(order[keep])
+    return {k: table[k].to_numpy() for k in COLUMNS}, int((~keep).sum())
+
+def _read_csvs_ticker(paths: List[Path]) -> Tuple[Dict[str, np.ndarray], int]:
+    """A ticker's bars from its csv(s) in stored order, only the checked columns are parsed"""
+    if pa is not None: frames = [pa_csv.read_csv(p, convert_options=pa_csv.ConvertOptions(include_columns=COLUMNS)).to_pandas() for p in paths]
+    else: frames = [pd.read_csv(p, usecols=COLUMNS) for p in paths]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    return {k: df[k].to_numpy() for k in COLUMNS}, 0
+
+def _check_all(readers: Dict[str, Callable[[], Tuple[Dict[str, np.ndarray], int]]], start, end, workers, **kwargs) -> List[TickerReport]:
+    def _one(item):
+        ticker, read = item
+        cols, rewritten = read()
+        return check_bars(ticker, cols, start, end, **kwargs)._replace(rewritten=rewritten)
+    with ThreadPoolExecutor(max_workers=workers) as pool: # reading and numpy both release the gil
+        return list(pool.map(_one, sorted(readers.items())))
+
+def check_dataset(root: str, tickers: List[str] = None, start: str = None, end: str = None, format: str = 'parquet', workers: int = 8, **kwargs) -> List[TickerReport]:
+    """
+    Check every ticker (or `tickers`) of a `lib.store.DatasetWriter` dataset in parallel, see `check_bars` for the checks and kwargs.
+    Bars written more than once are deduplicated first (newest part wins, like the readers) and only counted in `rewritten`.
+    """
+    assert pa is not None, "pyarrow is required to check the dataset, pip install pyarrow"
+    root = Path(root)
+    tickers = tickers or sorted(path.name.split('=', 1)[1] for path in root.glob('ticker=*') if path.is_dir())
+    return _check_all({ticker: (lambda ticker=ticker: _read_dataset_ticker(root, ticker, format)) for ticker in tickers}, start, end, workers, **kwargs)
+
+def check_csvs(raw_dir: str, tickers: List[str] = None, start: str = None, end: str = None, workers: int = 8, **kwargs) -> List[TickerReport]:
+    """Check `{ticker}-{start}-{end}.csv` files (several per ticker are checked together) in parallel, see `check_bars`"""
+    files = {}
+    for path in sorted(Path(raw_dir).glob('*.csv')):
+        match = RAW_FILE_RE.match(path.name)
+        if match is not None and (tickers is None or match['ticker'] in tickers): files.setdefault(match['ticker'], []).append(path)
+    return _check_all({ticker: (lambda paths=paths: _read_csvs_ticker(paths)) for ticker, paths in files.items()}, start, end, workers, **kwargs)
+
+# ! Reporting =====================================================================
+def format_report(reports: List[TickerReport], only_problems: bool = True) -> str:
+    """Compact fixed width table, one line per ticker (only tickers with problems by default) and a totals line"""
+    fields = ['rows', 'duplicates', 'non_monotonic', 'outside_session', 'missing_sessions', 'sparse_sessions', 'missing_minutes', 'ohlc', 'zero_volume', 'fractional_volume', 'rewritten']
+    short = ['rows', 'dup', 'non_mono', 'outside', 'miss_days', 'sparse', 'miss_min', 'ohlc', 'zero_v', 'frac_v', 'rewritten']
+    lines = [f"{'ticker':<8s}" + ''.join(f"{name:>10s}" for name in short) + f"{'refetch':>9s}"]
+    for r in reports:
+        if only_problems and r.ok: continue
+        lines.append(f"{r.ticker:<8s}" + ''.join(f"{getattr(r, f):>10d}" for f in fields) + f"{len(r.refetch):>9d}")
+    lines.append(f"{'total':<8s}" + ''.join(f"{sum(getattr(r, f) for r in reports):>10d}" for f in fields) + f"{sum(len(r.refetch) for r in reports):>9d}")
+    lines.append(f"{sum(r.ok for r in reports)}/{len(reports)} tickers clean")
+    return '\n'.join(lines)
+
+def refetch_windows(reports: List[TickerReport]) -> Dict[str, List[Tuple[str, str]]]:
+    """ticker -> (first, last) session date windows to fetch again, e.g. with `lib.polygon.plan_urls` / `lib.incremental`"""
+    return {r.ticker: r.refetch for r in reports if r.refetch}
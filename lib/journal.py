@@ -0,0 +1,102 @@
+import json
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode
+
+from lib.cache import normalize_url
+
+DONE = 'done'
+FAILED = 'failed'
+INVALID = 'invalid'
+STATUSES = (DONE, FAILED, INVALID)
+
+class RunJournal:
+    def __init__(self, root: str, run_id: str, flush_every: int = 1000, flush_interval: float = 1.0):
+        """
+        Manifest + append-only journal for a fetch run, stored in `{root}/{run_id}/`. Use `RunJournal.create` to start a run and `resume` to pick one back up.
+        The manifest lists every planned url (apiKey removed), the journal gets one `{index} {status}` line per recorded url, last line wins.
+        Records are buffered and written every `flush_every` records or `flush_interval` seconds, so the journal never bottlenecks a 100+ rps run.
+        """
+        self.root = Path(root)
+        self.run_id = run_id
+        self.dir = self.root / run_id
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        manifest = json.loads((self.dir / 'manifest.json').read_text())
+        self.meta = manifest['meta']
+        self.urls = manifest['urls']
+        self._index = {url: idx for idx, url in enumerate(self.urls)} # normalized url -> idx
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self.status = self._replay() # idx -> latest status
+
+    @classmethod
+    def create(cls, root: str, urls: List[str], run_id: str = None, meta: Dict = None, **kwargs) -> 'RunJournal':
+        """Write the manifest for a new run and return its journal. `meta` is any json-able info about the run (tickers, dates, ...)"""
+        run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        run_dir = Path(root) / run_id
+        run_dir.mkdir(parents=True, exist_ok=False)
+
+        normalized = list(dict.fromkeys(normalize_url(url) for url in urls)) # dedupe, keep plan order
+        manifest = {'run_id': run_id, 'created': datetime.now().isoformat(), 'meta': meta or {}, 'urls': normalized}
+        (run_dir / 'manifest.json').write_text(json.dumps(manifest))
+        (run_dir / 'journal.log').touch()
+        return cls(root, run_id, **kwargs)
+
+    def _replay(self) -> Dict[int, str]:
+        path = self.dir / 'journal.log'
+        data = path.read_bytes()
+        end = data.rfind(b'\n') + 1
+        if end < len(data): # torn last line from a crash, cut it or the next append would join onto it ("12" + "5 done" -> "125 done")
+            with open(path, 'r+b') as f: f.truncate(end)
+        status = {}
+        for line in data[:end].decode().splitlines():
+            parts = line.split()
+            if len(parts) != 2 or parts[1] not in STATUSES: continue
+            status[int(parts[0])] = parts[1]
+        return status
+
+    def record(self, url: str, status: str):
+        """Record the outcome of a planned url (DONE, FAILED or INVALID)"""
+        assert status in STATUSES, f"status must be one of {STATUSES}, got {status}"
+        idx = self._index.get(normalize_url(url))
+        assert idx is not None, f"url is not part of run {self.run_id}: {normalize_url(url)}"
+        self.status[idx] = status
+        self._buffer.append(f"{idx} {status}\n")
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval: self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with open(self.dir / 'journal.log', 'a') as f: f.write(''.join(self._buffer))
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def is_done(self, url: str) -> bool: return self.status.get(self._index.get(normalize_url(url))) == DONE
+
+    def pending(self, urls: List[str]) -> List[str]:
+        """Filter `urls` down to the ones not yet completed in this run (keeps the original urls, incl. apiKey)"""
+        return [url for url in urls if not self.is_done(url)]
+
+    def outstanding(self, params: Dict[str, str] = None) -> List[str]:
+        """Planned urls that haven't completed (never attempted, failed or invalidated). `params` are re-added to each url, e.g. {'apiKey': key}"""
+        urls = [url for idx, url in enumerate(self.urls) if self.status.get(idx) != DONE]
+        if params: urls = [f"{url}{'&' if '?' in url else '?'}{urlencode(params)}" for url in urls]
+        return urls
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in STATUSES}
+        for status in self.status.values(): counts[status] += 1
+        counts['outstanding'] = len(self.urls) - counts[DONE]
+        return counts
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.flush()
+
+def resume(run_id: str, root: str, params: Dict[str, str] = None, **kwargs) -> Tuple[RunJournal, List[str]]:
+    """Re-open a run and re-plan only its outstanding work. Returns (journal, outstanding urls)"""
+    journal = RunJournal(root, run_id, **kwargs)
+    return journal, journal.outstanding(params)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delay in seconds or an HTTP date) into seconds from now. Returns None if missing/unparseable"""
+    if value is None: return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveLimiter:
+    def __init__(self, rate: float = 10, min_rate: float = 1, max_rate: float = None, increase: float = 1, decrease: float = 0.5, cooldown: float = 1):
+        """
+        AIMD (additive increase, multiplicative decrease) rate limiter. Drop in for `AsyncLimiter` via `async with limiter:`.
+        Every success adds ~`increase` requests/sec per second of successes, a 429/503 multiplies the rate by `decrease` (at most once per `cooldown` seconds, so one burst of 429s only counts once).
+        Retry-After is honored by holding all requests until it has passed. Current rate is exposed as `limiter.rate`.
+        Waiting requests queue up and are handed slots one at a time, each at the rate (and Retry-After) current when it gets it, so feedback applies to requests already queued.
+        """
+        assert 0 < min_rate <= rate, "rate must be >= min_rate > 0"
+        assert max_rate is None or max_rate >= rate, "max_rate must be >= rate"
+        assert 0 < decrease < 1, "decrease must be between 0 and 1"
+        self._rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate) if max_rate is not None else float('inf')
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._last = float('-inf') # monotonic time the last slot was handed out
+        self._blocked_until = 0.0 # set from Retry-After
+        self._waiters = deque() # futures of queued requests, released in order by `_pace`
+        self._pacer = None
+        self._last_decrease = float('-inf')
+
+    @property
+    def rate(self) -> float: return self._rate
+
+    async def acquire(self, priority: bool = False):
+        """Queue for the next slot and wait until it's handed out. `priority` jumps the queue (hedges shouldn't wait behind the batch they're hedging)"""
+        waiter = asyncio.get_running_loop().create_future()
+        if priority: self._waiters.appendleft(waiter)
+        else: self._waiters.append(waiter)
+        if self._pacer is None or self._pacer.done(): self._pacer = asyncio.ensure_future(self._pace())
+        await waiter
+
+    async def _pace(self):
+        """Release queued requests one slot apart, re-checking rate and Retry-After before each one"""
+        while self._waiters:
+            now = time.monotonic()
+            slot = max(self._last + 1 / self._rate, self._blocked_until)
+            if slot > now:
+                await asyncio.sleep(slot - now)
+                continue # feedback may have moved the slot while we slept
+            waiter = self._waiters.popleft()
+            if waiter.done(): continue # cancelled while queued, doesn't use a slot
+            waiter.set_result(None)
+            self._last = now
+
+    @asynccontextmanager
+    async def priority(self):
+        """`async with limiter.priority():` takes the next slot ahead of queued requests"""
+        await self.acquire(priority=True)
+        yield
+
+    async def __aenter__(self): await self.acquire()
+    async def __aexit__(self, exc_type, exc, tb): pass
+
+    def success(self):
+        self._rate = min(self.max_rate, self._rate + self.increase / self._rate) # additive increase, spread over a second of requests
+
+    def throttle(self, retry_after: float = None):
+        now = time.monotonic()
+        if retry_after is not None: self._blocked_until = max(self._blocked_until, now + retry_after)
+        if now - self._last_decrease < self.cooldown: return # same burst of 429s, already backed off
+        self._rate = max(self.min_rate, self._rate * self.decrease) # multiplicative decrease
+        self._last_decrease = now
+
+    def feedback(self, status: int, retry_after: float = None):
+        """Feed a response status back to the limiter (called by HttpRequestFetcher)"""
+        if status in (429, 503): self.throttle(retry_after)
+        elif status < 400: self.success()
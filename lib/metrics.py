@@ -0,0 +1,174 @@
+import asyncio
+import bisect
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # seconds
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Fixed bucket histogram, O(log buckets) per observation and constant memory however many requests"""
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile (upper bound of the bucket it falls in), 0 if empty"""
+        if self.count == 0: return 0.0
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target: return bound
+        return float('inf')
+
+    def snapshot(self) -> Dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+class FetchMetrics:
+    def __init__(self):
+        """
+        Runtime metrics for a fetch run, pass to `HttpRequestFetcher(metrics=...)` (and share it between fetchers to aggregate a whole run).
+        Counters: requests, retries, failures, cache hits, hedges, bytes and responses by status code. Histograms: limiter wait, time to first byte and body read. Gauge: in flight.
+        `completed`/`total` are kept up to date by `BatchRequestExecutor` for progress reporting.
+        """
+        self.started = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.hedges = 0 # duplicate requests sent for slow ones (see `lib.retry.HedgePolicy`)
+        self.hedge_wins = 0 # hedges that answered first
+        self.bytes = 0
+        self.statuses = Counter()
+        self.in_flight = 0
+        self.completed = 0 # urls finished by the executor, incl. failures and cache hits
+        self.total = 0 # urls submitted to the executor, if known
+        self.limiter_wait = Histogram()
+        self.ttfb = Histogram()
+        self.body_read = Histogram()
+
+    @property
+    def elapsed(self) -> float: return time.monotonic() - self.started
+
+    @contextmanager
+    def request(self):
+        """Count a request and keep it in the in flight gauge while the block runs"""
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def snapshot(self) -> Dict:
+        elapsed = self.elapsed
+        return {
+            'elapsed': elapsed,
+            'requests': self.requests,
+            'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+            'retries': self.retries,
+            'failures': self.failures,
+            'cache_hits': self.cache_hits,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'bytes': self.bytes,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'total': self.total,
+            'limiter_wait': self.limiter_wait.snapshot(),
+            'ttfb': self.ttfb.snapshot(),
+            'body_read': self.body_read.snapshot(),
+        }
+
+    def to_json(self, **kwargs) -> str: return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix: str = 'asyncfetcher') -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        lines = []
+        def _metric(name, kind, value, help_):
+            lines.extend([f"# HELP {prefix}_{name} {help_}", f"# TYPE {prefix}_{name} {kind}", f"{prefix}_{name} {value}"])
+
+        _metric('requests_total', 'counter', self.requests, 'HTTP requests sent (incl. retries)')
+        _metric('retries_total', 'counter', self.retries, 'Requests retried')
+        _metric('failures_total', 'counter', self.failures, 'Urls that failed after all retries')
+        _metric('cache_hits_total', 'counter', self.cache_hits, 'Urls served from the response cache')
+        _metric('hedges_total', 'counter', self.hedges, 'Hedge requests sent for slow requests')
+        _metric('hedge_wins_total', 'counter', self.hedge_wins, 'Hedge requests that answered first')
+        _metric('response_bytes_total', 'counter', self.bytes, 'Response body bytes read')
+        _metric('in_flight', 'gauge', self.in_flight, 'Requests currently in flight')
+        _metric('completed_total', 'counter', self.completed, 'Urls completed by the executor')
+
+        lines.extend([f"# HELP {prefix}_responses_total Responses by status code", f"# TYPE {prefix}_responses_total counter"])
+        lines.extend(f'{prefix}_responses_total{{status="{status}"}} {count}' for status, count in sorted(self.statuses.items()))
+
+        for name, hist, help_ in [('limiter_wait', self.limiter_wait, 'Time waiting on the rate limiter'), ('ttfb', self.ttfb, 'Time to first byte (response headers)'), ('body_read', self.body_read, 'Time reading the response body')]:
+            lines.extend([f"# HELP {prefix}_{name}_seconds {help_}", f"# TYPE {prefix}_{name}_seconds histogram"])
+            cumulative = 0
+            for bound, count in zip(hist.buckets + (float('inf'),), hist.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_{name}_seconds_bucket{{le="{le}"}} {cumulative}')
+            lines.extend([f"{prefix}_{name}_seconds_sum {hist.sum}", f"{prefix}_{name}_seconds_count {hist.count}"])
+        return '\n'.join(lines) + '\n'
+
+class ProgressReporter:
+    def __init__(self, metrics: FetchMetrics, interval: float = 5.0, out: Callable[[str], None] = print):
+        """Prints a one line progress summary every `interval` seconds from a background task. Only reads counters, so it costs nothing per request"""
+        self.metrics = metrics
+        self.interval = interval
+        self.out = out
+        self._task = None
+        self._last = (time.monotonic(), 0) # (time, requests) at the last report, for the current rate
+
+    def line(self) -> str:
+        m = self.metrics
+        now = time.monotonic()
+        last_time, last_requests = self._last
+        rate = (m.requests - last_requests) / (now - last_time) if now > last_time else 0.0
+        self._last = (now, m.requests)
+
+        progress = f"{m.completed}/{m.total} urls ({m.completed / m.total:6.1%})" if m.total else f"{m.completed} urls"
+        eta = ''
+        if m.total and m.completed:
+            remaining = (m.total - m.completed) * m.elapsed / m.completed
+            hours, rest = divmod(int(remaining), 3600)
+            eta = f" | eta {hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+        errors = sum(count for status, count in m.statuses.items() if status >= 400)
+        return f"[{m.elapsed:8.1f}s] {progress} | {rate:6.1f} req/s | in flight {m.in_flight:3d} | retries {m.retries} | errors {errors}{eta}"
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.out(self.line())
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Start reporting on `loop` (or the running loop), works before `loop.run_until_complete` e.g. around `BatchRequestExecutor.execute`"""
+        loop = loop or asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+
+    def stop(self, final: bool = True):
+        if self._task is not None: self._task.cancel()
+        self._task = None
+        if final: self.out(self.line())
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb): self.stop()
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+from urllib.parse import urlencode
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+MINUTE_MS = 60_000
+NYSE_TZ = ZoneInfo('America/New_York')
+SESSION_MINUTES = 390 # 9:30 - 16:00 ET, holidays and early closes are ignored
+
+# ! Latency distributions =========================================================
+# callables returning a delay in seconds, classes rather than lambdas so servers can be started in another process
+class ConstantLatency:
+    def __init__(self, seconds: float): self.seconds = seconds
+    def __call__(self) -> float: return self.seconds
+
+class LognormalLatency:
+    def __init__(self, median: float = 0.05, sigma: float = 0.5, seed: int = None):
+        """Long tailed latency, roughly what a real API looks like"""
+        self.median = median
+        self.sigma = sigma
+        self.rng = random.Random(seed)
+
+    def __call__(self) -> float: return self.rng.lognormvariate(0, self.sigma) * self.median
+
+# ! Synthetic payloads ============================================================
+def _to_ms(value: str, end: bool = False) -> int:
+    """Polygon accepts unix ms or YYYY-MM-DD for from/to, a date `to` includes the whole day"""
+    if value.isdigit(): return int(value)
+    day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=NYSE_TZ)
+    return int(day.timestamp() * 1000) + (86_400_000 - 1 if end else 0)
+
+def session_minutes(start_ms: int, end_ms: int, density: float = 1.0) -> Iterable[int]:
+    """Minute timestamps (ms) inside regular weekday sessions between start and end (inclusive). `density` < 1 drops minutes deterministically"""
+    day = datetime.fromtimestamp(start_ms / 1000, tz=NYSE_TZ).date()
+    while True:
+        open_ms = int(datetime(day.year, day.month, day.day, 9, 30, tzinfo=NYSE_TZ).timestamp() * 1000)
+        if open_ms > end_ms: return
+        if day.weekday() < 5:
+            for idx in range(SESSION_MINUTES):
+                t = open_ms + idx * MINUTE_MS
+                if start_ms <= t <= end_ms and (density >= 1 or (t // MINUTE_MS * 2654435761) % 1000 < density * 1000):
+                    yield t
+        day = day.fromordinal(day.toordinal() + 1)
+
+def synthetic_bar(ticker: str, t: int, float_volume: bool = False) -> Dict:
+    """Deterministic bar for (ticker, t), so refetching returns identical data"""
+    seed = zlib.crc32(f"{ticker}{t}".encode())
+    base = 50 + (seed % 5000) / 100
+    o = round(base, 4)
+    c = round(base * (1 + ((seed >> 8) % 200 - 100) / 100_000), 4)
+    v = 100 + (seed >> 4) % 100_000
+    return {
+        'v': v + 0.5 if float_volume else v, # GE style float volume
+        'vw': round((o + c) / 2, 4),
+        'o': o,
+        'c': c,
+        'h': round(max(o, c) * 1.0005, 4),
+        'l': round(min(o, c) * 0.9995, 4),
+        't': t,
+        'n': 1 + (seed >> 12) % 1000,
+    }
+
+def snapshot_payload(ticker: str, start: str, end: str, limit: int = 5000, density: float = 1.0, float_volume: bool = False, next_url_base: str = None, query: Dict = None) -> Dict:
+    """Snapshot shaped aggregates payload. If there are more than `limit` bars, results are truncated and `next_url` points at the rest (like Polygon)"""
+    end_ms = _to_ms(end, end=True)
+    results = []
+    for t in session_minutes(_to_ms(start), end_ms, density):
+        if len(results) == limit: break
+        results.append(synthetic_bar(ticker, t, float_volume))
+    payload = {
+        'ticker': ticker,
+        'queryCount': len(results),
+        'resultsCount': len(results),
+        'adjusted': True,
+        'results': results,
+        'status': 'OK',
+        'request_id': f"mock-{ticker}-{start}-{end}",
+        'count': len(results),
+    }
+    if len(results) == limit and next_url_base is not None and results[-1]['t'] < end_ms:
+        remaining = next(iter(session_minutes(results[-1]['t'] + MINUTE_MS, end_ms, density)), None)
+        if remaining is not None:
+            payload['next_url'] = f"{next_url_base}/v2/aggs/ticker/{ticker}/range/1/minute/{results[-1]['t'] + MINUTE_MS}/{end_ms}?{urlencode(query or {})}"
+    if not results: del payload['results'] # polygon omits results when there are none
+    return payload
+
+# ! Server ========================================================================
+class MockPolygonServer:
+    def __init__(
+            self,
+            latency: Callable[[], float] = None,
+            error_rate: float = 0.0,
+            error_statuses: List[int] = (500, 502, 503),
+            throttle_rate: float = 0.0,
+            rps_limit: float = None,
+            density: float = 1.0,
+            float_volume_tickers: Iterable[str] = ('GE',),
+            seed: int = None,
+            payload_cache: int = 4096,
+            host: str = '127.0.0.1',
+            port: int = 0,
+        ):
+        """
+        Local stand in for the polygon aggregates endpoint (`/v2/aggs/ticker/{ticker}/range/1/minute/{from}/{to}`) serving synthetic `Snapshot` payloads.
+        - `latency` is called per request for the delay (seconds) before responding, see `ConstantLatency` / `LognormalLatency`
+        - `error_rate` / `throttle_rate` inject random 5xx / 429 responses, `rps_limit` enforces a real rate limit (429 + Retry-After over a 1s sliding window)
+        - `density` < 1 leaves gaps in the minute bars, tickers in `float_volume_tickers` return float `v` like GE does
+        - the last `payload_cache` encoded payloads are kept, so repeated urls don't make the server the bottleneck of a benchmark
+        Use as `async with MockPolygonServer() as server:` in a running loop, or `with server.run_in_thread():` / `with server.run_in_process():` to keep it off the caller's loop.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.throttle_rate = throttle_rate
+        self.rps_limit = rps_limit
+        self.density = density
+        self.float_volume_tickers = set(float_volume_tickers)
+        self.rng = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.kwargs = {'latency': latency, 'error_rate': error_rate, 'error_statuses': error_statuses, 'throttle_rate': throttle_rate, 'rps_limit': rps_limit, 'density': density, 'float_volume_tickers': float_volume_tickers, 'seed': seed, 'payload_cache': payload_cache, 'host': host}
+        self.stats = {'requests': 0, 'ok': 0, 'throttled': 0, 'errors': 0}
+        self._window = deque() # request times in the last second, for rps_limit
+        self._payload = lru_cache(maxsize=payload_cache)(self._render)
+        self._runner = None
+
+    @property
+    def base_url(self) -> str: return f"http://{self.host}:{self.port}"
+
+    def url(self, ticker: str, start, end, limit: int = 1000, api_key: str = 'test') -> str:
+        return f"{self.base_url}/v2/aggs/ticker/{ticker}/range/1/minute/{start}/{end}?adjusted=true&sort=asc&limit={limit}&apiKey={api_key}"
+
+    def _rate_limited(self) -> bool:
+        if self.rps_limit is None: return False
+        now = time.monotonic()
+        while self._window and now - self._window[0] >= 1: self._window.popleft()
+        if len(self._window) >= self.rps_limit: return True
+        self._window.append(now)
+        return False
+
+    async def _aggs(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        if self.latency is not None: await asyncio.sleep(self.latency())
+
+        if self._rate_limited() or self.rng.random() < self.throttle_rate:
+            self.stats['throttled'] += 1
+            return web.json_response({'status': 'ERROR', 'error': 'exceeded the maximum requests per second'}, status=429, headers={'Retry-After': '1'})
+        if self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response({'status': 'ERROR', 'error': 'internal error'}, status=self.rng.choice(self.error_statuses))
+
+        info = request.match_info
+        query = tuple((k, v) for k, v in request.query.items() if k != 'apiKey') # polygon's next_url doesn't carry the key either
+        body = self._payload(info['ticker'], info['start'], info['end'], query)
+        self.stats['ok'] += 1
+        return web.Response(body=body, content_type='application/json')
+
+    def _render(self, ticker: str, start: str, end: str, query: tuple) -> bytes:
+        payload = snapshot_payload(
+            ticker, start, end,
+            limit=int(dict(query).get('limit', 5000)),
+            density=self.density,
+            float_volume=ticker in self.float_volume_tickers,
+            next_url_base=self.base_url,
+            query=dict(query),
+        )
+        return json.dumps(payload).encode()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{start}/{end}', self._aggs)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1] # resolve port 0
+        return self
+
+    async def close(self):
+        if self._runner is not None: await self._runner.cleanup()
+        self._runner = None
+
+    async def __aenter__(self): return await self.start()
+    async def __aexit__(self, exc_type, exc, tb): await self.close()
+
+    @contextmanager
+    def run_in_thread(self):
+        """Serve from a background thread with its own event loop, so server work doesn't skew client side benchmarks"""
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        try:
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(self.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    @contextmanager
+    def run_in_process(self):
+        """Serve from a separate process, so neither the server's cpu nor the GIL skews client side benchmarks. `stats` aren't updated in this mode"""
+        ctx = multiprocessing.get_context('spawn')
+        ports, stop = ctx.Queue(), ctx.Event()
+        process = ctx.Process(target=_serve, args=(self.kwargs, ports, stop), daemon=True)
+        process.start()
+        self.port = ports.get(timeout=30)
+        try:
+            yield self
+        finally:
+            stop.set()
+            process.join(timeout=5)
+            if process.is_alive(): process.terminate()
+
+def _serve(kwargs: Dict, ports, stop):
+    """Entry point of `MockPolygonServer.run_in_process`"""
+    async def _run():
+        async with MockPolygonServer(**kwargs) as server:
+            ports.put(server.port)
+            while not stop.is_set(): await asyncio.sleep(0.1)
+    asyncio.run(_run())
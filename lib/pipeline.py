@@ -0,0 +1,184 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.journal import RunJournal, INVALID
+from lib.polygon import validate_results_columnar
+from lib.repair import is_no_data
+from lib.utils import validate_path
+
+_DONE = object() # end of stream marker passed down the queues
+
+# ! Sinks =========================================================================
+class CsvSink:
+    def __init__(self, root: str, name: Callable[[str], str] = lambda ticker: f"{ticker}.csv"):
+        """
+        Writes bar frames to one csv per ticker under `root`, chunk by chunk (each `write` appends). `name(ticker)` is the file name.
+        Files are truncated on the first write of a run, and the index keeps counting across chunks so the csv reads back like a single `df.to_csv`.
+        Not thread safe, `Pipeline` calls it from a single io thread.
+        """
+        self.root = Path(root)
+        self.name = name
+        self.rows = {} # ticker -> rows written this run
+        validate_path(self.root)
+
+    def path(self, ticker: str) -> Path: return self.root / self.name(ticker)
+
+    def write(self, df: pd.DataFrame):
+        for ticker, chunk in df.groupby('ticker', sort=False):
+            offset = self.rows.get(ticker, 0)
+            chunk = chunk.set_axis(range(offset, offset + len(chunk)))
+            chunk.to_csv(self.path(ticker), mode='a' if offset else 'w', header=not offset)
+            self.rows[ticker] = offset + len(chunk)
+
+    def close(self): pass
+
+# ! Pipeline ======================================================================
+class Pipeline:
+    def __init__(
+            self,
+            fetcher: HttpRequestFetcher,
+            sink,
+            executor: BatchRequestExecutor = None,
+            validate: Callable[[List[Dict]], Tuple[pd.DataFrame, List[Dict]]] = validate_results_columnar,
+            batch_size: int = 256,
+            queue_size: int = 4,
+            cpu_executor: Executor = None,
+            ordered: bool = False,
+            parse_pool=None,
+            repair=None,
+        ):
+        """
+        Fetch -> validate -> write as concurrent stages joined by bounded queues, so network, cpu and disk work overlap instead of running one after the other.
+        - fetch: `executor.stream` (bounded window), responses are batched `batch_size` at a time. `ordered=True` keeps url order, so sinks append bars in time order
+        - validate: `validate` (default `validate_results_columnar`) on each batch, in `cpu_executor` (default thread pool) so the loop keeps fetching
+        - write: `sink.write(df)` per validated batch in a dedicated io thread (writes stay in order, the loop never blocks on disk)
+        With a `parse_pool` (`lib.workers.ParsePool`, fetcher built with `parser=RawResponseParser()`) raw bodies are decoded and validated in worker processes instead,
+        with a batch per worker in flight, so the loop only does io and parsing scales with cores. `validate` and `cpu_executor` are then unused.
+        With a `repair` (`lib.repair.Repairer`) invalidated responses are refetched before their batch moves on (so bars still reach the sink in order),
+        only the ones it gives up on are journaled INVALID. Empty sessions (`lib.repair.NO_DATA`) are accepted then, not counted as invalidated.
+        Each queue holds at most `queue_size` batches. When validation or the disk falls behind the queues fill up, the fetch stage stops pulling
+        from the stream and the stream stops scheduling requests, so a slow stage throttles fetching instead of growing memory.
+        """
+        assert batch_size > 0 and queue_size > 0, "batch_size and queue_size must be positive"
+        self.fetcher = fetcher
+        self.sink = sink
+        self.executor = executor or BatchRequestExecutor()
+        self.validate = validate
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.cpu_executor = cpu_executor
+        self.ordered = ordered
+        self.parse_pool = parse_pool
+        self.repair = repair
+
+    async def run(self, urls: Iterable[str], journal: RunJournal = None) -> Dict:
+        """
+        Run every url through the pipeline. Returns a summary: urls, rows written, failed urls, invalidated responses (after repairs), repaired responses and seconds spent per stage
+        (`blocked` is time the fetch stage waited on a full queue, i.e. backpressure).
+        After `cancel()` the run still returns normally: everything fetched is validated and written, `outstanding` lists the urls it didn't get to.
+        """
+        loop = asyncio.get_running_loop()
+        raw_q, out_q = asyncio.Queue(self.queue_size), asyncio.Queue(self.queue_size)
+        io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-io')
+        summary = {'urls': 0, 'rows': 0, 'failed': [], 'invalidated': [], 'repaired': 0, 'outstanding': [], 'cancelled': False, 'elapsed': 0.0, 'blocked': 0.0, 'validate': 0.0, 'repair': 0.0, 'write': 0.0}
+        seen = len(self.executor.outstanding) # the executor's list spans runs
+
+        async def _put(queue, item):
+            start = time.perf_counter()
+            await queue.put(item)
+            summary['blocked'] += time.perf_counter() - start
+
+        async def _fetch():
+            batch = []
+            async for url, result in self.executor.stream(urls, self.fetcher, ordered=self.ordered, journal=journal):
+                summary['urls'] += 1
+                if result is None: summary['failed'].append(url)
+                else: batch.append((url, result))
+                if len(batch) >= self.batch_size:
+                    await _put(raw_q, batch)
+                    batch = []
+            if batch: await _put(raw_q, batch)
+            await raw_q.put(_DONE)
+
+        def _validate_batch(results):
+            df, invalidated = self.validate(results)
+            invalid_ids = {id(result) for result in invalidated}
+            return df, invalidated, [idx for idx, result in enumerate(results) if id(result) in invalid_ids]
+
+        async def _validate():
+            in_flight = self.parse_pool.workers + 1 if self.parse_pool is not None else 1 # one batch queued per pool so no worker idles
+            pending = deque() # (batch, future) in arrival order, so batches reach the sink in order
+
+            def _submit(batch):
+                results = [result for _, result in batch]
+                if self.parse_pool is not None: return asyncio.ensure_future(self.parse_pool.parse(results))
+                return loop.run_in_executor(self.cpu_executor, _validate_batch, results)
+
+            async def _finish():
+                batch, future = pending.popleft()
+                start = time.perf_counter()
+                df, invalidated, positions = await future
+                summary['validate'] += time.perf_counter() - start
+                if self.repair is not None and positions:
+                    start = time.perf_counter()
+                    fixed = await self.repair.repair([batch[idx][0] for idx in positions], invalidated)
+                    repaired = [(idx, result) for idx, result in zip(positions, fixed) if self.repair.check(result)]
+                    no_data = {idx for idx, result in zip(positions, fixed) if is_no_data(result)} # fixed is decoded, raw bodies included
+                    if repaired:
+                        batch = list(batch)
+                        for idx, result in repaired: batch[idx] = (batch[idx][0], result)
+                        df, invalidated, positions = await _submit(batch) # whole batch again, keeps bar order
+                        summary['repaired'] += len(repaired)
+                    summary['repair'] += time.perf_counter() - start
+                    kept = [(idx, result) for idx, result in zip(positions, invalidated) if idx not in no_data] # empty sessions aren't bad data
+                    positions, invalidated = [idx for idx, _ in kept], [result for _, result in kept]
+                summary['invalidated'].extend(invalidated)
+                if journal is not None:
+                    for idx in positions: journal.record(batch[idx][0], INVALID)
+                await out_q.put(df)
+
+            try:
+                while (batch := await raw_q.get()) is not _DONE:
+                    pending.append((batch, _submit(batch)))
+                    if len(pending) >= in_flight: await _finish()
+                while pending: await _finish()
+            finally:
+                for _, future in pending: future.cancel()
+            await out_q.put(_DONE)
+
+        async def _write():
+            while (df := await out_q.get()) is not _DONE:
+                if len(df) == 0: continue
+                start = time.perf_counter()
+                await loop.run_in_executor(io, self.sink.write, df)
+                summary['write'] += time.perf_counter() - start
+                summary['rows'] += len(df)
+
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(stage()) for stage in (_fetch, _validate, _write)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException: # one stage failed (or we were cancelled), don't leave the others blocked on a queue
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await loop.run_in_executor(io, self.sink.close)
+            io.shutdown(wait=True)
+            if journal is not None: journal.flush()
+            summary['elapsed'] = time.perf_counter() - start
+            summary['outstanding'] = self.executor.outstanding[seen:]
+            summary['cancelled'] = self.executor.cancelled
+        return summary
+
+    def cancel(self):
+        """Stop fetching (see `BatchRequestExecutor.cancel`), responses already fetched still go through validate and write before `run` returns"""
+        self.executor.cancel()
+        if self.repair is not None: self.repair.cancel()
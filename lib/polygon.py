@@ -1,16 +1,26 @@
+import math
+import re
+from operator import itemgetter
+import numpy as np
 import pandas as pd
-from typing import List, Tuple, Union, Dict
+from typing import List, Tuple, Union, Dict, Optional, NamedTuple
+from urllib.parse import parse_qsl, urlencode
 
-from lib.utils import get_polygon_key
+from lib.utils import get_polygon_key, get_calendar
+from lib.streaming import BAR_FIELDS, BarColumns
 from lib.models import Snapshot
+from lib.journal import FAILED
 
-def make_url(ticker, start, end, limit=1000, adjusted=True, api_key=get_polygon_key()):
-    """Make a url for polygon API call."""
+POLYGON_BASE_URL = "https://api.polygon.io"
 
+def make_url(ticker, start, end, limit=1000, adjusted=True, api_key=None, base=POLYGON_BASE_URL):
+    """Make a url for polygon API call. `base` can point at another host (e.g. `lib.mock_server`), `api_key` defaults to `get_polygon_key()`"""
+
+    api_key = api_key or get_polygon_key() # looked up per call, not at import
     assert api_key is not None, "api_key must be provided"
     assert isinstance(ticker, str), "ticker must be a string"
 
-    base_url = "https://api.polygon.io/v2/aggs/ticker/"
+    base_url = f"{base}/v2/aggs/ticker/"
     adj = 'true' if adjusted else 'false'
     url = f"{base_url}{ticker}/range/1/minute/{start}/{end}?adjusted={adj}&sort=asc&limit={limit}&apiKey={api_key}"
     return url
@@ -47,6 +57,7 @@ def validate_results(results : List[Dict]) -> Tuple[List[Snapshot], List[Dict]]:
     invalidated_results = []
     for result in results:
         try:
+            if isinstance(result.get('results'), BarColumns): result = {**result, 'results': result['results'].to_list()} # streamed
             validated_result = Snapshot(**result)
             validated_results.append(validated_result)
         except Exception as e:
@@ -55,4 +66,214 @@ def validate_results(results : List[Dict]) -> Tuple[List[Snapshot], List[Dict]]:
 
     print(f'Validated: {len(validated_results)}')
     print(f'Invalidated: {len(invalidated_results)}')
-    return validated_results, invalidated_results
\ No newline at end of file
+    return validated_results, invalidated_results
+
+# ! Columnar validation ==============================================================
+SNAPSHOT_FIELDS = {'adjusted': bool, 'queryCount': int, 'request_id': str, 'resultsCount': int, 'status': str, 'ticker': str}
+
+def _bar_columns(result) -> Optional[Dict[str, np.ndarray]]:
+    """Typed columns for one response, None if it wouldn't pass the Snapshot model"""
+    if not isinstance(result, dict): return None
+    if not all(isinstance(result.get(k), kind) for k, kind in SNAPSHOT_FIELDS.items()): return None
+    if not isinstance(result.get('next_url') or '', str) or not isinstance(result.get('results'), (list, BarColumns)): return None
+
+    bars, n = result['results'], len(result['results'])
+    try:
+        if isinstance(bars, BarColumns): cols = dict(bars.columns) # streamed, already columns
+        else: cols = {k: np.fromiter(map(itemgetter(k), bars), dtype=np.float64, count=n) for k in BAR_FIELDS} # one pass per field, no per bar objects
+    except (KeyError, TypeError, ValueError): # missing field, bar isn't a dict, non numeric value
+        return None
+    if any(np.isnan(col).any() for col in cols.values()): return None # None decodes to nan
+    for k in ('n', 't'):
+        if not (cols[k] == np.floor(cols[k])).all(): return None # must be whole numbers
+        cols[k] = cols[k].astype(np.int64)
+    return cols
+
+def is_valid_result(result) -> bool:
+    """Whether a decoded response would pass validation, without keeping its columns"""
+    return _bar_columns(result) is not None
+
+def validate_results_columnar(results: List[Dict], as_frame: bool = True) -> Tuple[Union[pd.DataFrame, Dict[str, np.ndarray]], List[Dict]]:
+    """
+    Same checks as `validate_results`, but straight from decoded json to typed numpy columns (c/h/l/n/o/t/v/vw + ticker), checked a whole array at a time.
+    No Snapshot / Result objects are built, so it's much faster and lighter on big responses.
+    Returns the bars of every valid response (a DataFrame in `validate_results` + model_dump column order, or a dict of arrays with `as_frame=False`)
+    and the invalidated raw responses.
+    """
+    parts, tickers, invalidated = [], [], []
+    for result in results:
+        cols = _bar_columns(result)
+        if cols is None: invalidated.append(result)
+        else:
+            parts.append(cols)
+            tickers.append(result['ticker'])
+
+    counts = [len(cols['t']) for cols in parts]
+    columns = {k: np.concatenate([cols[k] for cols in parts]) if parts else np.empty(0, dtype=np.int64 if k in ('n', 't') else np.float64) for k in BAR_FIELDS}
+    if len(columns['v']) and (columns['v'] == np.floor(columns['v'])).all(): columns['v'] = columns['v'].astype(np.int64) # float only for GE style volume
+    columns['ticker'] = np.repeat(np.array(tickers, dtype=object), counts) if parts else np.empty(0, dtype=object)
+
+    print(f'Validated: {len(parts)}')
+    print(f'Invalidated: {len(invalidated)}')
+    return (pd.DataFrame(columns) if as_frame else columns), invalidated
+
+# ! Pagination / range splitting =====================================================
+RANGE_RE = re.compile(r'(?P<base>.*/v2/aggs/ticker/(?P<ticker>[^/]+)/range/(?P<multiplier>\d+)/(?P<timespan>\w+))/(?P<start>[^/]+)/(?P<end>[^/?]+)(?:\?(?P<query>.*))?$')
+
+def parse_aggs_url(url: str) -> Dict:
+    """Split an aggregates url into its parts (base, ticker, start, end, query dict)"""
+    match = RANGE_RE.match(url)
+    assert match is not None, f"not a polygon aggregates url: {url}"
+    parts = match.groupdict()
+    parts['query'] = dict(parse_qsl(parts['query'] or ''))
+    return parts
+
+def with_range(url: str, start: int, end: int) -> str:
+    """Same aggregates url over a different (unix ms) window"""
+    parts = parse_aggs_url(url)
+    return f"{parts['base']}/{start}/{end}?{urlencode(parts['query'])}"
+
+def to_ms(value: Union[str, int], end: bool = False) -> int:
+    """Unix ms from a url's from/to (unix ms or YYYY-MM-DD in NYSE time, a date `end` covers the whole day)"""
+    if str(value).isdigit(): return int(value)
+    day = pd.Timestamp(value, tz='America/New_York')
+    if end: day = day + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)
+    return int(day.timestamp() * 1000)
+
+def is_truncated(result: Optional[Dict], limit: int) -> bool:
+    """Whether a response is missing data: it hit the `limit` or polygon handed back a `next_url`"""
+    if not isinstance(result, dict): return False
+    return bool(result.get('next_url')) or result.get('resultsCount', 0) >= limit
+
+def split_remaining(url: str, result: Dict, limit: int, fill: float = 0.8) -> List[str]:
+    """
+    Urls covering the rest of a truncated response's window (after its last bar), split into sub-ranges sized from the bar density seen so far
+    so each is expected to come back at ~`fill` of `limit`.
+    """
+    parts = parse_aggs_url(url)
+    start, end = to_ms(parts['start']), to_ms(parts['end'], end=True)
+    bars = result['results']
+    last = bars[-1]['t']
+    density = len(bars) / max(last - start, 1) # bars per ms so far
+    n = max(2, math.ceil(density * (end - last) / (limit * fill)))
+    width = math.ceil((end - last) / n)
+    return [with_range(url, last + 1 + i * width, min(last + (i + 1) * width, end)) for i in range(n) if last + 1 + i * width <= end]
+
+def stitch(parts: List[Dict]) -> Dict:
+    """Merge responses for pieces of one window into a single response, bars in timestamp order (duplicates dropped)"""
+    merged = {k: v for k, v in parts[0].items() if k != 'next_url'}
+    bars = {bar['t']: bar for part in parts for bar in part.get('results', [])}
+    merged['results'] = [bars[t] for t in sorted(bars)]
+    merged['resultsCount'] = merged['queryCount'] = len(merged['results'])
+    return merged
+
+async def fetch_complete(urls: List[str], fetcher, executor, follow_next_url: bool = False, max_rounds: int = 8, journal=None) -> List[Optional[Dict]]:
+    """
+    Fetch aggregates urls and make sure no data is silently dropped by the `limit` (results are aligned with `urls`, None if a piece failed).
+    Truncated responses are completed by splitting the rest of their window into sub-ranges fetched concurrently through the same executor
+    (repeated for up to `max_rounds` if a sub-range is still truncated), then stitched back together in timestamp order.
+    With `follow_next_url=True` polygon's `next_url` pages are followed instead (one request at a time per url, slower).
+    `journal` (see `lib.journal`) records the planned `urls`, sub-range requests aren't part of the plan.
+    """
+    api_key = {k: v for k, v in parse_aggs_url(urls[0])['query'].items() if k == 'apiKey'} # next_url doesn't carry the key
+    results = await executor.execute_async(urls, fetcher, journal)
+    parts = {idx: [result] for idx, result in enumerate(results)} # idx -> responses that make up that url's window
+    todo = [(idx, url, result) for idx, (url, result) in enumerate(zip(urls, results))] # (idx, url, response) still to check
+
+    for round_ in range(max_rounds + 1):
+        next_urls = [] # (idx, url)
+        for idx, url, result in todo:
+            if parts[idx] is None: continue
+            if result is None:
+                parts[idx] = None # a piece failed, the whole window is incomplete
+                continue
+            limit = int(parse_aggs_url(url)['query'].get('limit', 5000))
+            if not is_truncated(result, limit) or not result.get('results'): continue
+            if follow_next_url:
+                next_url = result.get('next_url')
+                if next_url: next_urls.append((idx, f"{next_url}{'&' if '?' in next_url else '?'}{urlencode(api_key)}"))
+            else:
+                next_urls.extend((idx, sub_url) for sub_url in split_remaining(url, result, limit))
+
+        if not next_urls: break
+        if round_ == max_rounds:
+            print(f"Warning: {len({idx for idx, _ in next_urls})} windows still truncated after {max_rounds} rounds")
+            break
+        sub_results = await executor.execute_async([url for _, url in next_urls], fetcher)
+        for (idx, _), result in zip(next_urls, sub_results):
+            if parts[idx] is not None: parts[idx].append(result)
+        todo = [(idx, url, result) for (idx, url), result in zip(next_urls, sub_results)]
+
+    complete = []
+    for idx in range(len(urls)):
+        if parts[idx] is None:
+            if journal is not None and results[idx] is not None: journal.record(urls[idx], FAILED) # fetched, but a sub-range wasn't
+            complete.append(None)
+        elif len(parts[idx]) == 1: complete.append(parts[idx][0]) # wasn't truncated, leave it as is
+        else: complete.append(stitch(parts[idx]))
+    return complete
+
+
+# ! Request planning ==================================================================
+EXTENDED_MINUTES = 570 # pre (4:00 - 9:30) + post (16:00 - 20:00) market minutes between two sessions
+
+class PlannedRequest(NamedTuple):
+    url: str
+    ticker: str
+    start: int # unix ms, open of the first day
+    end: int # unix ms, close of the last day
+    days: int
+    expected_rows: int # regular session bars (what's kept after `trim_to_sessions`)
+    max_rows: int # upper bound incl. extended hours bars between the sessions, what's sized against the limit
+
+def session_bounds(start: str, end: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Unix ms (open, close) arrays for every NYSE session between start and end, early closes included"""
+    _, opens, closes = get_calendar().sessions(start, end)
+    return opens, closes
+
+def plan_windows(opens: np.ndarray, closes: np.ndarray, limit: int = 50000, fill: float = 0.9, extended_minutes: int = EXTENDED_MINUTES) -> List[Tuple[int, int, int, int, int]]:
+    """
+    Greedily pack consecutive sessions into windows whose worst case bar count fits under `fill * limit`.
+    A window from the first day's open to the last day's close also spans the extended hours between its sessions, those are counted in the worst case.
+    Returns (start_ms, end_ms, days, expected_rows, max_rows) tuples.
+    """
+    assert len(opens) == len(closes) and len(opens) > 0, "need at least one session"
+    bars = ((closes - opens) // 60_000).astype(np.int64) # bars per session, 390 or 210 on early closes
+    budget = int(limit * fill)
+    assert bars.max() <= budget, f"a single session ({bars.max()} bars) doesn't fit under limit * fill ({budget})"
+
+    windows, first, expected = [], 0, 0
+    for idx, day_bars in enumerate(bars):
+        worst = expected + day_bars + (idx - first) * extended_minutes # bars if day idx joins the window
+        if idx > first and worst > budget: # close the window before this day
+            windows.append((int(opens[first]), int(closes[idx - 1]), idx - first, expected, expected + (idx - 1 - first) * extended_minutes))
+            first, expected = idx, 0
+        expected += day_bars
+    windows.append((int(opens[first]), int(closes[-1]), len(bars) - first, expected, expected + (len(bars) - 1 - first) * extended_minutes))
+    return windows
+
+def plan_urls(tickers: Union[List[str], str], start: str, end: str, limit: int = 50000, fill: float = 0.9, extended_minutes: int = EXTENDED_MINUTES, api_key: str = None) -> List[PlannedRequest]:
+    """
+    Plan multi-day aggregate requests from the NYSE schedule instead of one request per ticker per day (see `plan_windows`).
+    At `limit=50000` that's ~45 days per request instead of 1. Trim the extended hours back out with `trim_to_sessions` to get the same bars as a per day plan.
+    """
+    tickers = validate(tickers)
+    opens, closes = session_bounds(start, end)
+    assert len(opens) > 0, "no NYSE sessions between start and end"
+    windows = plan_windows(opens, closes, limit, fill, extended_minutes)
+    api_key = api_key or get_polygon_key()
+    return [
+        PlannedRequest(make_url(ticker, w_start, w_end, limit=limit, api_key=api_key), ticker, w_start, w_end, days, expected_rows, max_rows)
+        for ticker in tickers for w_start, w_end, days, expected_rows, max_rows in windows
+    ]
+
+def trim_to_sessions(result: Dict, opens: np.ndarray, closes: np.ndarray) -> Dict:
+    """Drop bars outside regular sessions (open <= t <= close, like the per day urls) from a multi-day response"""
+    if not isinstance(result, dict) or not result.get('results'): return result
+    bars = result['results']
+    t = bars.columns['t'].astype(np.int64) if isinstance(bars, BarColumns) else np.fromiter((bar['t'] for bar in bars), dtype=np.int64, count=len(bars))
+    day = np.searchsorted(opens, t, side='right') - 1 # session each bar would belong to
+    keep = (day >= 0) & (t <= closes[np.clip(day, 0, None)])
+    trimmed = {**result, 'results': bars[keep] if isinstance(bars, BarColumns) else [bar for bar, k in zip(bars, keep) if k]}
+    trimmed['resultsCount'] = len(trimmed['results'])
+    return trimmed
@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+try: # optional, only needed for the parquet / arrow dataset
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+from lib.polygon import to_ms
+from lib.store import BAR_SCHEMA
+from lib.utils import get_polygon_root, validate_path
+
+class DatasetReader:
+    def __init__(self, root: str, format: str = 'parquet', cache_dir: str = None, workers: int = 8):
+        """
+        Time range reads over a dataset written by `lib.store.DatasetWriter`.
+        Each ticker's partitions are compacted once into a single arrow ipc file sorted (and deduplicated) on `t` in `cache_dir` (default `{root}/_mapped`,
+        skipped by pyarrow when reading the dataset itself). Those files are memory mapped, so a query is a binary search on the mapped `t` column
+        plus a zero-copy slice, no parsing and no reading of rows outside the range. The compacted file is rebuilt when the ticker has newer part files.
+        Multi-ticker queries run in `workers` threads.
+        """
+        assert pa is not None, "pyarrow is required for DatasetReader, pip install pyarrow"
+        self.root = Path(root)
+        self.format = format
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else self.root / '_mapped'
+        self.workers = workers
+        self._tables: Dict[str, 'pa.Table'] = {} # ticker -> memory mapped table
+        self._t: Dict[str, np.ndarray] = {} # ticker -> zero-copy view of its sorted t column
+
+    def tickers(self) -> List[str]:
+        return sorted(path.name.split('=', 1)[1] for path in self.root.glob('ticker=*') if path.is_dir())
+
+    def _parts(self, ticker: str) -> List[Path]: return sorted((self.root / f"ticker={ticker}").rglob("part-*"))
+
+    def _stale(self, ticker: str, mapped: Path) -> bool:
+        if not mapped.exists(): return True
+        built = mapped.stat().st_mtime
+        return any(part.stat().st_mtime > built for part in self._parts(ticker))
+
+    def build(self, ticker: str) -> Path:
+        """Compact a ticker's partitions into `{cache_dir}/{ticker}.arrow`: one record batch, sorted on `t`, newest part wins on duplicate `t`"""
+        assert self._parts(ticker), f"no data for {ticker} in {self.root}"
+        table = ds.dataset([str(part) for part in self._parts(ticker)], format=self.format).to_table(columns=BAR_SCHEMA.names) # part files in name (= write time) order
+        t = table['t'].to_numpy()
+        order = np.argsort(t, kind='stable')
+        keep = np.append(t[order][1:] != t[order][:-1], True) # last of each run of equal t
+        table = table.take(order[keep]).combine_chunks()
+
+        validate_path(self.cache_dir)
+        path = self.cache_dir / f"{ticker}.arrow"
+        tmp = path.with_suffix('.arrow.tmp')
+        with ipc.new_file(tmp, BAR_SCHEMA) as writer: writer.write_table(table, max_chunksize=max(len(table), 1))
+        os.replace(tmp, path) # readers with the old file mapped keep it until they drop it
+        self._tables.pop(ticker, None)
+        self._t.pop(ticker, None)
+        return path
+
+    def _mapped(self, ticker: str) -> 'pa.Table':
+        if ticker not in self._tables:
+            path = self.cache_dir / f"{ticker}.arrow"
+            if self._stale(ticker, path): self.build(ticker)
+            table = ipc.open_file(pa.memory_map(str(path), 'r')).read_all() # buffers point into the mapping, nothing is read yet
+            self._tables[ticker] = table
+            self._t[ticker] = table['t'].chunk(0).to_numpy(zero_copy_only=True) if table.num_rows else np.empty(0, dtype=np.int64)
+        return self._tables[ticker]
+
+    def refresh(self):
+        """Forget mapped tables, so the next query picks up data written since (rebuilding stale tickers)"""
+        self._tables.clear()
+        self._t.clear()
+
+    def slice(self, ticker: str, start: int = None, end: int = None, columns: List[str] = None) -> 'pa.Table':
+        """Zero-copy slice of one ticker's bars with start <= t <= end (unix ms, None for open ended)"""
+        table = self._mapped(ticker)
+        t = self._t[ticker]
+        lo = 0 if start is None else int(np.searchsorted(t, start, side='left'))
+        hi = len(t) if end is None else int(np.searchsorted(t, end, side='right'))
+        table = table.slice(lo, hi - lo)
+        return table.select(columns) if columns is not None else table
+
+    def load(self, tickers: Union[List[str], str] = None, start=None, end=None, columns: List[str] = None, as_frame: bool = True) -> Union[pd.DataFrame, 'pa.Table']:
+        """
+        Bars for `tickers` (default all) between `start` and `end`, as unix ms or YYYY-MM-DD (NYSE time, a date `end` includes the whole day).
+        Returns a DataFrame with a (categorical) `ticker` column, or the arrow table (still memory mapped, no copy) with `as_frame=False`.
+        """
+        tickers = [tickers] if isinstance(tickers, str) else (tickers if tickers is not None else self.tickers())
+        start = to_ms(start) if start is not None else None
+        end = to_ms(end, end=True) if end is not None else None
+        cols = [c for c in (columns or BAR_SCHEMA.names) if c != 'ticker']
+
+        def _one(ticker):
+            part = self.slice(ticker, start, end, cols)
+            ticker_col = pa.DictionaryArray.from_arrays(pa.array(np.zeros(part.num_rows, dtype=np.int32)), pa.array([ticker])) # categorical, no string per row
+            return part.append_column('ticker', ticker_col)
+
+        if len(tickers) == 1: parts = [_one(tickers[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(tickers))) as pool: parts = list(pool.map(_one, tickers))
+        table = pa.concat_tables(parts) if parts else pa.table({c: [] for c in cols + ['ticker']})
+        if columns is not None and 'ticker' not in columns: table = table.drop_columns(['ticker'])
+        return table.to_pandas() if as_frame else table
+
+_READERS: Dict[tuple, DatasetReader] = {}
+
+def load(tickers: Union[List[str], str], start=None, end=None, columns: List[str] = None, root: str = None, format: str = 'parquet', as_frame: bool = True):
+    """`DatasetReader(root).load(...)` with the reader (and its mapped files) kept around between calls. `root` defaults to `{get_polygon_root()}/dataset`"""
+    if root is None: root = f"{get_polygon_root()}/dataset"
+    key = (str(root), format)
+    if key not in _READERS: _READERS[key] = DatasetReader(root, format=format)
+    return _READERS[key].load(tickers, start, end, columns, as_frame=as_frame)
@@ -0,0 +1,135 @@
+import asyncio
+import gzip
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+
+import numpy as np
+
+from lib.cache import normalize_url
+from lib.fetcher import BatchRequestExecutor, HttpRequestFetcher, get_json_decoder
+from lib.polygon import is_valid_result
+from lib.streaming import BarColumns, decode_body
+
+# why a response failed validation
+ERROR_PAYLOAD = 'error' # polygon answered 200 with an error status (rate limit blip, upstream hiccup)
+EMPTY = 'empty' # no bars although resultsCount says there are some, transient
+NO_DATA = 'no_data' # OK status, no bars and resultsCount 0: a session without trades (halted, not listed yet), accepted as is
+UNDECODABLE = 'undecodable' # not json, e.g. a truncated body
+SCHEMA = 'schema' # bars are there but don't fit the model (missing / non numeric fields), refetching returns the same thing
+KINDS = (ERROR_PAYLOAD, EMPTY, UNDECODABLE, SCHEMA)
+RETRYABLE = (ERROR_PAYLOAD, EMPTY, UNDECODABLE)
+
+def classify_invalid(result) -> str:
+    """Which of `KINDS` an invalidated response is"""
+    if isinstance(result, (bytes, bytearray, memoryview, str)): return UNDECODABLE
+    if not isinstance(result, dict): return SCHEMA
+    if result.get('status') not in ('OK', 'DELAYED') or 'error' in result: return ERROR_PAYLOAD
+    if not result.get('results'): return EMPTY if result.get('resultsCount') else NO_DATA
+    return SCHEMA
+
+def is_no_data(result) -> bool:
+    """Whether an invalidated response is a legitimately empty session (see `NO_DATA`), not bad data"""
+    return isinstance(result, dict) and classify_invalid(result) == NO_DATA
+
+# ! Quarantine ====================================================================
+def _jsonable(value):
+    if isinstance(value, BarColumns): return value.to_list()
+    if isinstance(value, (bytes, bytearray, memoryview)): return bytes(value).decode('utf-8', 'replace')
+    if isinstance(value, np.generic): return value.item()
+    return str(value)
+
+class Quarantine:
+    def __init__(self, path: str):
+        """
+        Append-only store of responses that couldn't be repaired: one gzipped ndjson line per response with its url (apiKey removed), kind, attempts and payload.
+        Each `add` appends a gzip member in a single write, so the file stays small, a crash never corrupts earlier records and several processes can add to it.
+        Read it back with `iter(quarantine)`.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def add(self, url: str, kind: str, result, attempts: int = 0):
+        record = {'url': normalize_url(url), 'kind': kind, 'attempts': attempts, 'time': time.time(), 'payload': result}
+        member = gzip.compress((json.dumps(record, default=_jsonable) + '\n').encode())
+        with open(self.path, 'ab') as f: f.write(member) # one O_APPEND write per record, so worker processes can share a quarantine
+
+    def __iter__(self) -> Iterator[Dict]:
+        if not self.path.exists(): return
+        with gzip.open(self.path, 'rt') as f:
+            for line in f: yield json.loads(line)
+
+    def counts(self) -> Dict[str, int]: return dict(Counter(record['kind'] for record in self))
+
+# ! Repair loop ===================================================================
+class Repairer:
+    def __init__(
+            self,
+            fetcher: HttpRequestFetcher,
+            executor: BatchRequestExecutor = None,
+            max_attempts: int = 2,
+            backoff: float = 1.0,
+            quarantine: Quarantine = None,
+            retry: tuple = RETRYABLE,
+            check: Callable[[Any], bool] = is_valid_result,
+        ):
+        """
+        Second chance for responses that fetched fine but fail validation. Each invalid response is classified (`classify_invalid`), the `retry` kinds are
+        refetched through `fetcher` (cache entry dropped first, so the bad body isn't served again) up to `max_attempts` times, `backoff` * attempt seconds apart.
+        Whatever is still invalid after that (and every `SCHEMA` response right away) goes to the `quarantine`, if there is one.
+        Empty sessions (`NO_DATA`) are left alone: not refetched, not quarantined.
+        Counts end up in `stats`: repaired, no_data, plus given up responses per kind.
+        """
+        assert max_attempts >= 0, "max_attempts must be >= 0"
+        self.fetcher = fetcher
+        self.executor = executor or BatchRequestExecutor()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.quarantine = quarantine
+        self.retry = set(retry)
+        self.check = check
+        self.decoder = get_json_decoder()
+        self.stats = Counter()
+
+    async def repair(self, urls: List[str], results: List[Any]) -> List[Any]:
+        """
+        Results aligned with `urls`, invalid ones replaced by a valid refetch where possible. Raw bodies (`RawResponseParser`) are decoded for the check,
+        so pass decoded results, or just the invalidated ones. Given up responses stay in place (still invalid) and are quarantined, None (failed fetch) passes through.
+        """
+        results = list(results)
+        todo = []
+        for idx, result in enumerate(results):
+            if result is None: continue
+            results[idx] = result = decode_body(result, self.decoder)
+            if self.check(result): continue
+            if is_no_data(result): self.stats[NO_DATA] += 1
+            else: todo.append(idx)
+
+        attempt, tries = 0, Counter() # rounds so far, refetches per idx
+        while todo and attempt < self.max_attempts and not self.executor.cancelled:
+            retry = [idx for idx in todo if classify_invalid(results[idx]) in self.retry]
+            if not retry: break
+            attempt += 1
+            await asyncio.sleep(self.backoff * attempt)
+            cache = getattr(self.fetcher, 'cache', None)
+            if cache is not None:
+                for idx in retry: cache.delete(urls[idx]) # or the bad body is served again
+            print(f"Repairing {len(retry)} invalid responses, attempt {attempt} of {self.max_attempts}")
+            refetched = await self.executor.execute_async([urls[idx] for idx in retry], self.fetcher)
+            tries.update(retry)
+            for idx, result in zip(retry, refetched):
+                if result is not None: results[idx] = decode_body(result, self.decoder) # a failed refetch keeps the old response
+            repaired = {idx for idx in retry if self.check(results[idx])}
+            self.stats['repaired'] += len(repaired)
+            todo = [idx for idx in todo if idx not in repaired]
+
+        for idx in todo:
+            kind = classify_invalid(results[idx])
+            if kind in self.retry and tries[idx] < self.max_attempts: continue # cancelled before it got its attempts, a resumed run tries again
+            self.stats[kind] += 1
+            if self.quarantine is not None: self.quarantine.add(urls[idx], kind, results[idx], tries[idx])
+        return results
+
+    def cancel(self): self.executor.cancel()
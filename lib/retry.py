@@ -0,0 +1,111 @@
+import asyncio
+import math
+import random
+from collections import deque
+from typing import Iterable, Optional
+
+import aiohttp
+
+RETRYABLE = 'retryable'
+FATAL = 'fatal'
+RATE_LIMITED = 'rate_limited'
+
+class DeferredRetry(Exception):
+    def __init__(self, url: str):
+        """Raised by `HttpRequestFetcher.fetch` when a url runs out of retries and the policy defers it to after the main batch"""
+        super().__init__(f"Deferred {url}")
+        self.url = url
+
+class RetryPolicy:
+    def __init__(
+            self,
+            retries: int = 2,
+            base: float = 0.5,
+            cap: float = 30,
+            budget: int = None,
+            defer: bool = False,
+            retry_statuses: Iterable[int] = (408, 425, 500, 502, 503, 504),
+            rate_limit_statuses: Iterable[int] = (429,),
+        ):
+        """
+        Decides whether and when a failed request is retried. Share one policy between fetchers to share its retry budget.
+        - errors are classified as RETRYABLE (connection errors, timeouts, `retry_statuses`), RATE_LIMITED (`rate_limit_statuses`) or FATAL (every other status, e.g. 404)
+        - backoff uses decorrelated jitter between `base` and `cap` seconds so a rate limited batch doesn't wake up in lockstep
+        - `budget` caps the total number of retries across every request using this policy (None = unlimited)
+        - with `defer=True`, urls that run out of retries are moved to a deferred queue and retried after the main batch by `BatchRequestExecutor`
+        """
+        assert retries >= 0, "retries must be >= 0"
+        assert 0 < base <= cap, "base must be > 0 and <= cap"
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.defer = defer
+        self.retry_statuses = set(retry_statuses)
+        self.rate_limit_statuses = set(rate_limit_statuses)
+        self.spent = 0 # retries used so far
+
+    def classify(self, error: Exception) -> str:
+        if isinstance(error, aiohttp.ClientResponseError):
+            if error.status in self.rate_limit_statuses: return RATE_LIMITED
+            if error.status in self.retry_statuses: return RETRYABLE
+            return FATAL # 4xx etc, retrying won't help
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)): return RETRYABLE # connection reset, dns, timeouts, payload errors
+        return FATAL
+
+    @property
+    def budget_left(self) -> float: return float('inf') if self.budget is None else self.budget - self.spent
+
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        """Whether a request that failed with `kind` on (0 indexed) `attempt` gets another try. Takes one retry from the budget if so"""
+        if kind == FATAL or attempt >= self.retries or self.budget_left <= 0: return False
+        self.spent += 1
+        return True
+
+    def backoff(self, previous: float = None, retry_after: float = None) -> float:
+        """Next sleep (seconds) given the previous one, decorrelated jitter: uniform(base, previous * 3) capped at `cap`. Never less than Retry-After"""
+        delay = min(self.cap, random.uniform(self.base, (previous or self.base) * 3))
+        return max(delay, retry_after) if retry_after is not None else delay
+
+class HedgePolicy:
+    def __init__(self, quantile: float = 0.95, min_delay: float = 0.05, max_delay: float = None, window: int = 1000, min_samples: int = 20, budget: float = 0.05):
+        """
+        Decides when a slow request gets a duplicate (hedge) sent alongside it, the first answer wins and the other is cancelled. Share one between fetchers to share its window and budget.
+        - a hedge fires once a request has been on the wire (past the limiter) longer than the `quantile` of the last `window` request latencies, clamped to [`min_delay`, `max_delay`]
+        - no hedging until `min_samples` latencies have been seen
+        - `budget` caps hedges at that fraction of the requests sent, hedges also take a limiter slot like any request so the rate budget holds
+        """
+        assert 0 < quantile < 1, "quantile must be between 0 and 1"
+        assert 0 <= budget <= 1, "budget must be between 0 and 1"
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.latencies = deque(maxlen=window)
+        self.requests = 0 # requests that could have been hedged
+        self.hedges = 0 # hedges sent
+        self._delay = None # cached quantile, refreshed every 16 samples
+        self._stale = 0
+
+    def observe(self, seconds: float):
+        """Latency of a completed request (from leaving the limiter to the parsed response)"""
+        self.latencies.append(seconds)
+        self._stale += 1
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a request being sent now (None = don't hedge yet). Counts the request towards the budget"""
+        self.requests += 1
+        if len(self.latencies) < max(self.min_samples, 1): return None
+        if self._delay is None or self._stale >= 16:
+            ordered = sorted(self.latencies)
+            delay = max(ordered[min(math.ceil(self.quantile * len(ordered)), len(ordered)) - 1], self.min_delay)
+            self._delay = min(delay, self.max_delay) if self.max_delay is not None else delay
+            self._stale = 0
+        return self._delay
+
+    def allow(self) -> bool:
+        """Whether a hedge can be sent now without going over the budget. Takes it from the budget if so"""
+        if self.hedges + 1 > self.budget * self.requests: return False
+        self.hedges += 1
+        return True
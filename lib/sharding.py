@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List
+
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ConnectionPool
+from lib.repair import Repairer
+
+class SharedTokenBucket:
+    def __init__(self, rate: float, burst: int = 1, ctx=None):
+        """
+        Token bucket living in shared memory, so every worker process draws from one global rate limit. Drop in for `AsyncLimiter` via `async with bucket:`.
+        Tokens are reserved under a lock (the balance can go negative), each caller then sleeps off its own debt, so waiters are served roughly in arrival order.
+        Must be handed to workers when they're started (e.g. `ProcessPoolExecutor(initargs=...)`), not through a queue.
+        """
+        assert rate > 0, "rate must be > 0"
+        assert burst >= 1, "burst must be >= 1"
+        ctx = ctx or multiprocessing.get_context()
+        self.rate = rate
+        self.burst = burst
+        self._lock = ctx.Lock()
+        self._tokens = ctx.Value('d', burst, lock=False) # guarded by self._lock
+        self._updated = ctx.Value('d', time.monotonic(), lock=False) # monotonic clock is system wide, so comparable across processes
+
+    def reserve(self) -> float:
+        """Take a token, returns how long (seconds) the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rate) # refill
+            tokens -= 1
+            self._tokens.value = tokens
+            self._updated.value = now
+        return max(0.0, -tokens / self.rate)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0: await asyncio.sleep(wait)
+
+    async def __aenter__(self): await self.acquire()
+    async def __aexit__(self, exc_type, exc, tb): pass
+
+# ! Worker process state ==========================================================
+# set once per worker by _init_worker, reused for every job the worker runs
+_bucket = None
+_loop = None
+_pool = None
+
+def _init_worker(bucket: SharedTokenBucket, pool_kwargs: Dict):
+    global _bucket, _loop, _pool
+    _bucket = bucket
+    _loop = asyncio.new_event_loop() # each worker gets its own loop, kept alive between jobs
+    asyncio.set_event_loop(_loop)
+    _pool = ConnectionPool(**pool_kwargs) # and its own warm connections
+
+def _run_job(key: str, urls: List[str], handler: Callable, fetcher_kwargs: Dict, max_in_flight: int, repair_kwargs: Dict = None) -> Any:
+    fetcher = HttpRequestFetcher(limiter=_bucket, pool=_pool, **fetcher_kwargs)
+    executor = BatchRequestExecutor(max_in_flight=max_in_flight)
+    results = executor.execute(urls, fetcher, loop=_loop, handle_signals=False) # ctrl-c interrupts the job, partial results would be saved as a whole ticker
+    if repair_kwargs is not None: results = _loop.run_until_complete(Repairer(fetcher, executor, **repair_kwargs).repair(urls, results))
+    return handler(key, urls, results) # cpu bound work (validate, build dataframes, write) happens in the worker
+
+class ShardedRunner:
+    def __init__(self, workers: int = None, rps: float = 100, burst: int = 1, max_in_flight: int = 100, fetcher_kwargs: Dict = None, pool_kwargs: Dict = None, repair_kwargs: Dict = None):
+        """
+        Runs fetch jobs across worker processes, each with its own event loop and connection pool, all sharing one `SharedTokenBucket` at `rps`.
+        Jobs are handed out one at a time as workers free up, so a slow ticker doesn't hold up a whole shard.
+        `fetcher_kwargs` are passed to every worker's `HttpRequestFetcher` (retries, cache, retry_policy, ...), `pool_kwargs` to its `ConnectionPool`.
+        With `repair_kwargs` every job's results go through a `lib.repair.Repairer(**repair_kwargs)` in the worker before the handler sees them (workers can share one `Quarantine`).
+        """
+        self.workers = workers or os.cpu_count()
+        self.max_in_flight = max_in_flight
+        self.fetcher_kwargs = fetcher_kwargs or {}
+        self.pool_kwargs = pool_kwargs or {}
+        self.repair_kwargs = repair_kwargs
+        self.ctx = multiprocessing.get_context('spawn') # don't fork a process that may have a running event loop
+        self.bucket = SharedTokenBucket(rps, burst, ctx=self.ctx)
+
+    def run(self, jobs: Dict[str, List[str]], handler: Callable[[str, List[str], List], Any], verbose: bool = True) -> Dict[str, Any]:
+        """
+        Fetch every job ({key: urls}, e.g. one per ticker) and run `handler(key, urls, results)` on it in the worker.
+        `handler` must be a top level (picklable) function and should return something small. Returns {key: handler result}.
+        """
+        with ProcessPoolExecutor(self.workers, mp_context=self.ctx, initializer=_init_worker, initargs=(self.bucket, self.pool_kwargs)) as executor:
+            futures = {executor.submit(_run_job, key, urls, handler, self.fetcher_kwargs, self.max_in_flight, self.repair_kwargs): key for key, urls in jobs.items()}
+            out = {}
+            for idx, future in enumerate(as_completed(futures)):
+                key = futures[future]
+                out[key] = future.result()
+                if verbose: print(f"Finished {key}... {idx + 1} of {len(futures)}")
+        return out
@@ -0,0 +1,113 @@
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+try: # optional, only needed for the parquet / arrow dataset
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from lib.utils import validate_path
+
+NYSE_TZ = 'America/New_York'
+FORMATS = {'parquet': '.parquet', 'ipc': '.arrow'} # format -> file extension
+
+# one schema for every ticker, so the dataset reads back as a whole. v is float since GE's volume is fractional
+BAR_SCHEMA = pa.schema([
+    ('c', pa.float64()),
+    ('h', pa.float64()),
+    ('l', pa.float64()),
+    ('n', pa.int64()),
+    ('o', pa.float64()),
+    ('t', pa.int64()), # unix ms, like the api
+    ('v', pa.float64()),
+    ('vw', pa.float64()),
+]) if pa is not None else None
+
+def partition_dir(root: str, ticker: str, year: int, month: int) -> Path:
+    """Hive style partition directory, `pyarrow.dataset.dataset(root, partitioning='hive')` restores ticker/year/month as columns"""
+    return Path(root) / f"ticker={ticker}" / f"year={year}" / f"month={month:02d}"
+
+def partition_keys(t: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(year, month) of each unix ms timestamp in NYSE time, so a session never straddles two partitions"""
+    local = pd.DatetimeIndex(pd.to_datetime(t, unit='ms', utc=True)).tz_convert(NYSE_TZ)
+    return local.year.to_numpy(), local.month.to_numpy()
+
+def to_table(df: pd.DataFrame) -> 'pa.Table':
+    """Bars frame (validate_results_columnar / csv columns) -> arrow table in BAR_SCHEMA, ticker is dropped (it's in the partition path)"""
+    return pa.Table.from_pandas(df[BAR_SCHEMA.names], schema=BAR_SCHEMA, preserve_index=False)
+
+class DatasetWriter:
+    def __init__(self, root: str, format: str = 'parquet', compression: str = 'zstd', row_group_size: int = None, max_open: int = 64):
+        """
+        Writes bar frames to a typed, compressed dataset partitioned by ticker / year / month under `root` (`{root}/ticker=AAPL/year=2023/month=10/part-*.parquet`).
+        Every `write` appends a row group to the open file of each partition it touches. Files are closed on `close()` and never rewritten,
+        a later run (or an incremental refresh) adds new part files next to them, readers dedup on (ticker, t) with the newest part winning.
+        At most `max_open` partition files are open at once, the least recently written is closed (a later write to it starts a new part file).
+        `format='ipc'` writes uncompressed arrow ipc files instead, which can be memory mapped without a copy (see `lib.reader`).
+        Usable as a `lib.pipeline.Pipeline` sink, or `with DatasetWriter(root) as writer: writer.write(df)`.
+        """
+        assert pa is not None, "pyarrow is required for DatasetWriter, pip install pyarrow (or use the csv output)"
+        assert format in FORMATS, f"format must be one of {list(FORMATS)}"
+        self.root = Path(root)
+        self.format = format
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.max_open = max_open
+        self.prefix = f"part-{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}" # unique per writer and sorts in write order (readers let newer parts win)
+        self.writers: Dict[Tuple[str, int, int], object] = OrderedDict() # (ticker, year, month) -> open writer, least recently written first
+        self.opened: Dict[Tuple[str, int, int], int] = {} # files opened per partition, for the part file name
+        self.rows = 0
+
+    def _writer(self, key: Tuple[str, int, int]):
+        if key in self.writers:
+            self.writers.move_to_end(key)
+            return self.writers[key]
+        if len(self.writers) >= self.max_open: self.writers.popitem(last=False)[1].close()
+
+        directory = partition_dir(self.root, *key)
+        validate_path(directory)
+        seq = self.opened.get(key, 0)
+        self.opened[key] = seq + 1
+        path = directory / f"{self.prefix}-{seq:06d}{FORMATS[self.format]}" # padded, part-000010 has to sort after part-000009
+        if self.format == 'parquet': self.writers[key] = pq.ParquetWriter(path, BAR_SCHEMA, compression=self.compression)
+        else: self.writers[key] = ipc.new_file(path, BAR_SCHEMA)
+        return self.writers[key]
+
+    def write(self, df: pd.DataFrame):
+        if len(df) == 0: return
+        years, months = partition_keys(df['t'].to_numpy())
+        for (ticker, year, month), part in df.groupby([df['ticker'].to_numpy(), years, months], sort=False):
+            table = to_table(part)
+            writer = self._writer((ticker, int(year), int(month)))
+            if self.format == 'parquet': writer.write_table(table, row_group_size=self.row_group_size)
+            else: writer.write_table(table, max_chunksize=self.row_group_size)
+            self.rows += len(part)
+
+    def close(self):
+        for writer in self.writers.values(): writer.close()
+        self.writers.clear()
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.close()
+
+def read_dataset(root: str, tickers=None, columns=None, format: str = 'parquet') -> pd.DataFrame:
+    """
+    Read (part of) a dataset written by DatasetWriter back into one frame, only the requested columns (and tickers' partitions) are read.
+    Bars written more than once (a re-run, a resumed run) come back once, the newest part file wins on duplicate (ticker, t) like `lib.reader.DatasetReader`.
+    """
+    files = sorted(ds.dataset(root, format=format, partitioning='hive').files) # partition, then part file name (= write time) order
+    dataset = ds.dataset(files, format=format, partitioning='hive', partition_base_dir=str(root))
+    flt = ds.field('ticker').isin(list(tickers)) if tickers is not None else None
+    read = list(dict.fromkeys([*columns, 'ticker', 't'])) if columns is not None else None # keys are needed to dedup
+    df = dataset.to_table(columns=read, filter=flt).to_pandas() # fragments come back in file order
+    df = df[~df.duplicated(['ticker', 't'], keep='last')].reset_index(drop=True)
+    return df[list(columns)] if columns is not None else df
@@ -0,0 +1,142 @@
+import json
+from collections.abc import Sequence
+from operator import itemgetter
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+try: # msgspec's decode error isn't a ValueError
+    import msgspec
+    DECODE_ERRORS = (ValueError, msgspec.DecodeError)
+except ImportError:
+    DECODE_ERRORS = (ValueError,)
+
+BAR_FIELDS = ('c', 'h', 'l', 'n', 'o', 't', 'v', 'vw') # Result fields, in model_dump order
+INT_FIELDS = ('n', 't')
+WHITESPACE = b' \t\r\n'
+
+class BarColumns(Sequence):
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        """
+        The `results` of a streamed aggregates response: one float64 array per bar field instead of a dict per bar.
+        Still a sequence of bar dicts (`bars[-1]['t']`, iteration, slices / masks give BarColumns) for code that expects a list, `lib.polygon.validate_results_columnar` uses the arrays directly.
+        Missing values (json null) are nan.
+        """
+        self.columns = columns
+
+    def __len__(self) -> int: return len(self.columns['t'])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (slice, np.ndarray)): return BarColumns({k: col[idx] for k, col in self.columns.items()})
+        return {k: (int(col[idx]) if k in INT_FIELDS else float(col[idx])) for k, col in self.columns.items()}
+
+    def to_list(self) -> List[Dict]: return [self[idx] for idx in range(len(self))]
+
+    def __repr__(self) -> str: return f"BarColumns({len(self)} bars)"
+
+def _columns(bars: List[Dict], fields=BAR_FIELDS) -> Dict[str, np.ndarray]:
+    """Decoded bar dicts -> float64 columns, raises KeyError / TypeError / ValueError if a bar can't be represented"""
+    return {k: np.fromiter(map(itemgetter(k), bars), dtype=np.float64, count=len(bars)) for k in fields}
+
+class AggsStreamDecoder:
+    HEADER, RESULTS, TAIL, RAW = range(4)
+
+    def __init__(self, decoder: Callable[[bytes], Any] = json.loads, batch_bytes: int = 64 * 1024, fields=BAR_FIELDS):
+        """
+        Incremental decoder for aggregates responses, `feed` it body chunks as they arrive and `close()` for the response dict.
+        The fields before `results` are decoded as soon as the array starts, then complete bars are decoded `batch_bytes` at a time (one `decoder` call per batch)
+        and moved into column buffers, so neither the whole body nor a dict per bar is ever held. Fields after the array (`status`, `next_url`, ...) are decoded at the end.
+        Falls back to decoding whatever is left in one go if the body isn't shaped as expected (nested bars, no `results`, non numeric values),
+        so the result always matches a plain `decoder(body)` apart from `results` being `BarColumns`.
+        """
+        self.decoder = decoder
+        self.batch_bytes = batch_bytes
+        self.fields = fields
+        self.state = self.HEADER
+        self.buf = bytearray()
+        self.meta = {}
+        self.chunks = [] # decoded column batches
+        self.raw_bars = None # plain bar dicts, once bars can't be kept as columns
+        self.bytes = 0
+
+    def feed(self, chunk: bytes):
+        self.buf += chunk
+        self.bytes += len(chunk)
+        if self.state == self.HEADER: self._header()
+        if self.state == self.RESULTS: self._results(final=False)
+
+    def _header(self):
+        key = self.buf.find(b'"results"')
+        start = self.buf.find(b'[', key) if key >= 0 else -1
+        if start < 0: return # wait for more
+        try:
+            self.meta = self.decoder(bytes(self.buf[:key]).rstrip(WHITESPACE).rstrip(b',') + b'}')
+        except DECODE_ERRORS: # not the shape we expect, decode it all at the end
+            self.state = self.RAW
+            return
+        del self.buf[:start + 1]
+        self.state = self.RESULTS
+
+    def _results(self, final: bool):
+        end = self.buf.find(b']') # bars are flat objects of numbers, so the first ] closes the array
+        if end >= 0: cut = end
+        elif len(self.buf) >= self.batch_bytes or final: cut = self.buf.rfind(b'}') + 1 # up to the last complete bar
+        else: return
+        body = bytes(self.buf[:cut]).strip(WHITESPACE).lstrip(b',')
+        if body:
+            try:
+                bars = self.decoder(b'[' + body + b']')
+            except DECODE_ERRORS: # nested objects etc, decode the rest of the array and the tail in one go at the end
+                self.state = self.RAW
+                return
+            self._append(bars)
+        del self.buf[:cut + 1 if end >= 0 else cut]
+        if end >= 0: self.state = self.TAIL
+
+    def _append(self, bars: List):
+        if self.raw_bars is None:
+            try:
+                self.chunks.append(_columns(bars, self.fields))
+                return
+            except (KeyError, TypeError, ValueError): # e.g. a bar missing a field, keep dicts so validation sees (and rejects) it as sent
+                self.raw_bars = self._bars().to_list()
+                self.chunks = []
+        self.raw_bars.extend(bars)
+
+    def _bars(self):
+        if self.raw_bars is not None: return self.raw_bars
+        if not self.chunks: return BarColumns({k: np.empty(0, dtype=np.float64) for k in self.fields})
+        return BarColumns({k: np.concatenate([chunk[k] for chunk in self.chunks]) for k in self.fields})
+
+    def close(self) -> Dict:
+        """The decoded response, `results` as `BarColumns` (a plain list if a bar couldn't be represented as columns)"""
+        if self.state == self.RESULTS: self._results(final=True)
+        if self.state == self.HEADER or (self.state == self.RAW and not self.meta and not self.chunks and self.raw_bars is None):
+            result = self.decoder(bytes(self.buf)) # never got to (or never understood) `results`, it's all still buffered
+            if isinstance(result, dict) and isinstance(result.get('results'), list):
+                try: result['results'] = BarColumns(_columns(result['results'], self.fields))
+                except (KeyError, TypeError, ValueError): pass
+            return result
+        if self.state == self.RAW: # mid array: `{"results":[` + what's left is the rest of the object
+            rest = self.decoder(b'{"results":[' + bytes(self.buf).strip(WHITESPACE).lstrip(b','))
+            bars = self._bars()
+            bars = (bars.to_list() if isinstance(bars, BarColumns) else bars) + rest.pop('results')
+            return {**self.meta, 'results': bars, **rest}
+
+        tail = bytes(self.buf).strip(WHITESPACE).lstrip(b',').strip(WHITESPACE)
+        rest = self.decoder(b'{' + tail) if tail and tail != b'}' else {}
+        return {**self.meta, 'results': self._bars(), **rest}
+
+async def decode_stream(content, decoder: Callable[[bytes], Any] = json.loads, chunk_size: int = 64 * 1024) -> Dict:
+    """Decode an aggregates response from an aiohttp `response.content` stream while it downloads (see `AggsStreamDecoder`)"""
+    stream = AggsStreamDecoder(decoder, batch_bytes=chunk_size)
+    async for chunk in content.iter_chunked(chunk_size): stream.feed(chunk)
+    return stream.close()
+
+def decode_body(body, decoder: Callable[[bytes], Any] = json.loads) -> Any:
+    """Decode a whole raw aggregates body in one batch, straight into columns. Already decoded results pass through, undecodable bodies come back as bytes"""
+    if not isinstance(body, (bytes, bytearray, memoryview)): return body
+    stream = AggsStreamDecoder(decoder, batch_bytes=max(len(body), 1))
+    stream.feed(body)
+    try: return stream.close()
+    except DECODE_ERRORS: return bytes(body) # not json, invalidated as is
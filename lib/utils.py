@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 from functools import lru_cache, wraps
 from dotenv import load_dotenv
 import os
+import time
 from pathlib import Path
 import pandas_market_calendars as mcal
 from typing import List, Tuple, Union
@@ -12,9 +14,10 @@ def get_polygon_root() -> str:
     return "/Users/beneverman/Documents/Coding/bp-quant/shared_data/POLYGON/"
 
 def get_polygon_key():
-    didload = load_dotenv()
-    assert didload, "Failed to load .env file"
-    return os.getenv("POLYGON_API_KEY")
+    load_dotenv() # doesn't override a key already in the environment
+    key = os.getenv("POLYGON_API_KEY")
+    assert key is not None, "POLYGON_API_KEY isn't set, add it to .env or the environment"
+    return key
 
 #! Data ======================================================================
 @lru_cache  # cache the result of this function to avoid refetching
@@ -34,28 +37,108 @@ def validate_path(path: str):
     path.mkdir(parents=True, exist_ok=True)
 
 # ! Market Utils =====================================================================
+NYSE_CACHE_DIR = os.getenv('NYSE_CALENDAR_CACHE', str(Path.home() / '.cache' / 'asyncfetcher')) # on disk calendar cache, see NyseCalendar
+NYSE_CACHE_MAX_AGE = 7 * 24 * 3600 # seconds a cached span reaching the current year stays fresh, closures get announced at short notice
+
 def get_nyse_calendar(start: str, end: str) -> pd.DataFrame:
     """Returns a dataframe of the NYSE calendar."""
     nyse = mcal.get_calendar('NYSE')
     return nyse.schedule(start_date=start, end_date=end)
 
+def _covers(path: Path, first_year: int, last_year: int) -> bool:
+    """Whether a cached `nyse-{mcal version}-{y0}-{y1}.npz` spans first_year..last_year"""
+    y0, y1 = path.stem.rsplit('-', 2)[1:]
+    return int(y0) <= first_year and last_year <= int(y1)
+
+def _fresh(path: Path, max_age: float) -> bool:
+    """Past years don't change, a span reaching the current year is only trusted for `max_age` seconds"""
+    if int(path.stem.rsplit('-', 1)[1]) < pd.Timestamp.now().year: return True
+    return time.time() - path.stat().st_mtime < max_age
+
+class NyseCalendar:
+    def __init__(self, cache_dir: str = NYSE_CACHE_DIR, max_age: float = NYSE_CACHE_MAX_AGE):
+        """
+        NYSE sessions as arrays: session dates (datetime64[D], NYSE time) and open / close unix ms, early closes included.
+        Schedules are built from pandas_market_calendars a whole year span at a time, memoized in memory and in `cache_dir` (None to skip the disk),
+        so every later range query is a binary search + slice, no calendar work and no per day python.
+        Disk entries are keyed on the mcal version (a new release with new holidays rebuilds), spans reaching the current year expire after `max_age` seconds.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_age = max_age
+        self.prefix = f"nyse-{mcal.__version__.replace('-', '_')}"
+        self._spans = {} # (first year, last year) -> (dates, opens, closes)
+
+    def _build(self, first_year: int, last_year: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        schedule = get_nyse_calendar(f"{first_year}-01-01", f"{last_year}-12-31")
+        epoch = pd.Timestamp(0, tz='UTC')
+        to_ms = lambda col: ((schedule[col] - epoch) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64) # whole column at once
+        return schedule.index.to_numpy(dtype='datetime64[D]'), to_ms('market_open'), to_ms('market_close')
+
+    def _span(self, first_year: int, last_year: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        key = (first_year, last_year)
+        if key in self._spans: return self._spans[key]
+        for (y0, y1), span in self._spans.items(): # a wider span already in memory covers it
+            if y0 <= first_year and last_year <= y1: return span
+
+        path = self.cache_dir / f"{self.prefix}-{first_year}-{last_year}.npz" if self.cache_dir is not None else None
+        covering = [
+            p for p in self.cache_dir.glob(f'{self.prefix}-*-*.npz') if _covers(p, first_year, last_year) and _fresh(p, self.max_age)
+        ] if path is not None and self.cache_dir.exists() else []
+        if covering:
+            with np.load(covering[0]) as cached: span = (cached['dates'], cached['opens'], cached['closes'])
+        else:
+            span = self._build(first_year, last_year)
+            if path is not None:
+                try:
+                    validate_path(self.cache_dir)
+                    np.savez(path, dates=span[0], opens=span[1], closes=span[2])
+                except OSError as e: # read only home etc, the memory cache still works
+                    print(f"Couldn't cache the NYSE calendar to {path}: {e}")
+        for arr in span: arr.flags.writeable = False # sessions() hands out views of these
+        self._spans[key] = span
+        return span
+
+    def sessions(self, start: str, end: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(dates, opens, closes) for every session from start to end (dates, inclusive)"""
+        start, end = np.datetime64(pd.Timestamp(start).date(), 'D'), np.datetime64(pd.Timestamp(end).date(), 'D')
+        dates, opens, closes = self._span(start.astype(object).year, end.astype(object).year)
+        lo, hi = np.searchsorted(dates, start, side='left'), np.searchsorted(dates, end, side='right')
+        return dates[lo:hi], opens[lo:hi], closes[lo:hi]
+
+    def date_tups(self, start: str, end: str, unix: bool = False) -> List[Tuple]:
+        """(open, close) per session, unix ms or YYYY-MM-DD strings (see `get_nyse_date_tups`)"""
+        dates, opens, closes = self.sessions(start, end)
+        if unix: return list(zip(opens.tolist(), closes.tolist()))
+        days = np.datetime_as_string(dates, unit='D').tolist()
+        return list(zip(days, days)) # a session opens and closes on the same day
+
+    def trading_days(self, start: str, end: str) -> int:
+        """Number of sessions from start to end (inclusive)"""
+        return len(self.sessions(start, end)[0])
+
+    def is_trading_day(self, day: str) -> bool: return self.trading_days(day, day) == 1
+
+    def bars_expected(self, day: str) -> int:
+        """Regular session minute bars on `day`: 390, 210 on early closes, 0 if the market is closed"""
+        _, opens, closes = self.sessions(day, day)
+        return int((closes - opens).sum() // 60_000)
+
+def get_calendar() -> NyseCalendar:
+    """Shared NyseCalendar on `NYSE_CACHE_DIR`, so the in memory cache lives for the whole process"""
+    return _shared_calendar(NYSE_CACHE_DIR)
+
+@lru_cache
+def _shared_calendar(cache_dir: str) -> NyseCalendar: return NyseCalendar(cache_dir)
+
 def get_nyse_date_tups(start: str, end: str = 'today', unix=False) -> List[Tuple[str, str]]:
     """
     Get a list of tuples of (open, close) datetimes for NYSE trading days between start and end dates. Updated to optionally ouput unix timestamps.
+    Backed by the cached `NyseCalendar`, so repeated calls are cheap.
     """
     if end == 'today': end = pd.Timestamp.now().strftime('%Y-%m-%d') # get today! 
     assert pd.Timestamp(start) < pd.Timestamp(end), "start date must be before end date"
 
-    nyse = get_nyse_calendar(start, end) # get nyse calendar
-
-    decode_str = "%Y-%m-%d"
-    to_str = lambda x: pd.to_datetime(x, utc=True).tz_convert('America/New_York').strftime(decode_str) # convert to nyse tz, get string
-    to_unix = lambda x: int(pd.to_datetime(x, utc=True).tz_convert('America/New_York').timestamp() * 1000) # convert to nyse tz, get unix timestamp
-
-    if unix:
-        tups = [(to_unix(a), to_unix(b)) for a, b in zip(nyse['market_open'], nyse['market_close'])] # make unix tups from open/close
-    else:
-        tups = [(to_str(a), to_str(b)) for a, b in zip(nyse['market_open'], nyse['market_close'])] # make string tups from open/close
+    tups = get_calendar().date_tups(start, end, unix=unix)
 
     assert tups is not None and len(tups) > 0, "tups must be non-empty. you probably provided dates that are not NYSE trading days."
     return tups
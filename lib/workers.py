@@ -0,0 +1,98 @@
+import asyncio
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from lib.fetcher import ResponseParser, get_json_decoder
+from lib.polygon import validate_results_columnar
+from lib.streaming import decode_body
+
+class RawResponseParser(ResponseParser):
+    """ResponseParser that hands back json bodies as raw bytes, for decoding elsewhere (e.g. a `ParsePool`). Cached responses come back as bytes too"""
+    async def _json(self, response): return await response.read()
+
+# ! Worker side ===================================================================
+def _parse_batch(bodies: List, decoder: Optional[str]) -> Tuple[Optional[str], List[Tuple[str, str, int, int]], List[Tuple[str, int]], List[Any], List[int]]:
+    """
+    Runs in a worker process: decode + validate a batch of bodies, then copy the typed columns into one shared memory block.
+    Returns (block name, [(column, dtype, offset, length)], [(ticker, rows)] runs, invalidated responses, their positions in `bodies`).
+    Only the small layout (and the rare invalidated response) is pickled back, the caller unlinks the block.
+    """
+    results = [decode_body(body, get_json_decoder(decoder)) for body in bodies]
+    columns, invalidated = validate_results_columnar(results, as_frame=False)
+    invalid_ids = {id(result) for result in invalidated}
+    positions = [idx for idx, result in enumerate(results) if id(result) in invalid_ids]
+
+    tickers = columns.pop('ticker')
+    starts = np.flatnonzero(np.append(True, tickers[1:] != tickers[:-1])) if len(tickers) else np.empty(0, dtype=np.int64)
+    runs = [(str(tickers[s]), int(n)) for s, n in zip(starts, np.diff(np.append(starts, len(tickers))))]
+
+    layout, offset = [], 0
+    for k, col in columns.items():
+        layout.append((k, col.dtype.str, offset, len(col)))
+        offset += col.nbytes
+    if offset == 0: return None, layout, runs, invalidated, positions
+
+    shm = SharedMemory(create=True, size=offset)
+    for (k, dtype, start, n), col in zip(layout, columns.values()):
+        np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start)[:] = col
+    shm.close()
+    resource_tracker.unregister(shm._name, 'shared_memory') # the main process owns (and unlinks) it from here
+    return shm.name, layout, runs, invalidated, positions
+
+# ! Main side =====================================================================
+def _collect(name: Optional[str], layout, runs, as_frame: bool = True):
+    """Columns out of a worker's shared memory block (copied once, then the block is freed) + the ticker column"""
+    if name is None: columns = {k: np.empty(0, dtype=dtype) for k, dtype, _, _ in layout}
+    else:
+        shm = SharedMemory(name=name)
+        try:
+            views = {k: np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start) for k, dtype, start, n in layout}
+            columns = {k: view.copy() for k, view in views.items()}
+            del views # no exported pointers left, so the block can close
+        finally:
+            shm.close()
+            shm.unlink()
+    columns['ticker'] = np.repeat(np.array([ticker for ticker, _ in runs], dtype=object), [n for _, n in runs]) if runs else np.empty(0, dtype=object)
+    return pd.DataFrame(columns, copy=False) if as_frame else columns
+
+def _discard(future: Future):
+    """Free the block of a batch nobody is waiting for anymore"""
+    if future.cancelled() or future.exception() is not None: return
+    name = future.result()[0]
+    if name is None: return
+    shm = SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+class ParsePool:
+    def __init__(self, workers: int = None, decoder: str = None, mp_context=None):
+        """
+        Decode + validate response bodies in `workers` processes (default one per core), so neither the event loop nor the GIL is held by parsing.
+        Fetch raw bodies (`HttpRequestFetcher(parser=RawResponseParser())`) and `await pool.parse(bodies)` per batch; each worker returns its typed columns
+        through a shared memory block rather than pickling them back. `decoder` is a `get_json_decoder` name (default: fastest installed).
+        Give it to `lib.pipeline.Pipeline(parse_pool=...)` to keep every worker busy while the loop only does io.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.decoder = decoder
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context)
+
+    async def parse(self, bodies: List, as_frame: bool = True) -> Tuple[pd.DataFrame, List[Any], List[int]]:
+        """(bars of the valid responses, like `validate_results_columnar`, invalidated responses, their positions in `bodies`)"""
+        future = self.pool.submit(_parse_batch, list(bodies), self.decoder)
+        try:
+            name, layout, runs, invalidated, positions = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(_discard) # the worker may still finish it
+            raise
+        return _collect(name, layout, runs, as_frame), invalidated, positions
+
+    def close(self): self.pool.shutdown(wait=True)
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.close()
@@ -0,0 +1,63 @@
+# Benchmark json decoders on polygon aggregate payloads.
+# Uses real responses from a ResponseCache directory if one is given (python scripts/bench-decoders-v1.py <cache dir>), synthetic Snapshot shaped payloads otherwise.
+
+import json
+import random
+import sys
+import zlib
+from pathlib import Path
+from time import perf_counter
+
+from lib.fetcher import JSON_DECODERS
+
+def load_cached_payloads(cache_dir: str, limit: int = 500):
+    """Raw json bodies from a ResponseCache directory (see lib.cache)"""
+    payloads = []
+    for file in Path(cache_dir).glob('*/*'):
+        if file.name.endswith('.tmp'): continue
+        header, body = zlib.decompress(file.read_bytes()).split(b'\n', 1)
+        if 'json' in json.loads(header)['content_type']: payloads.append(body)
+        if len(payloads) >= limit: break
+    return payloads
+
+def synthetic_payload(n_bars: int = 800, ticker: str = 'AAPL', start: int = 1539264600000):
+    """Snapshot shaped payload with n_bars minute bars"""
+    price = 100 + random.random() * 100
+    results = []
+    for idx in range(n_bars):
+        o = round(price * (1 + random.gauss(0, 0.001)), 4)
+        c = round(o * (1 + random.gauss(0, 0.001)), 4)
+        results.append({'v': random.randint(100, 100000), 'vw': round((o + c) / 2, 4), 'o': o, 'c': c, 'h': max(o, c) + 0.01, 'l': min(o, c) - 0.01, 't': start + idx * 60000, 'n': random.randint(1, 1000)})
+        price = c
+    return json.dumps({'ticker': ticker, 'queryCount': n_bars, 'resultsCount': n_bars, 'adjusted': True, 'results': results, 'status': 'OK', 'request_id': 'bench', 'count': n_bars}).encode()
+
+def bench(decoder, payloads, repeat: int = 5) -> float:
+    """Best of `repeat` seconds to decode every payload"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for payload in payloads: decoder(payload)
+        best = min(best, perf_counter() - start)
+    return best
+
+def main():
+    if len(sys.argv) > 1:
+        payloads = load_cached_payloads(sys.argv[1])
+        source = f"{len(payloads)} cached responses from {sys.argv[1]}"
+    else:
+        payloads = [synthetic_payload(n) for n in [390, 800, 800, 5000, 50000] * 20]
+        source = f"{len(payloads)} synthetic responses"
+    assert len(payloads) > 0, "no payloads to benchmark"
+
+    total_mb = sum(len(p) for p in payloads) / 1e6
+    bars = sum(len(json.loads(p).get('results', [])) for p in payloads)
+    print(f"Decoding {source}: {total_mb:0.1f} MB, {bars} bars")
+
+    baseline = None
+    for name, decoder in reversed(JSON_DECODERS.items()): # stdlib first, as the baseline
+        elapsed = bench(decoder, payloads)
+        baseline = baseline or elapsed
+        print(f"{name:>8s}: {elapsed * 1000:8.1f} ms  {total_mb / elapsed:7.1f} MB/s  {bars / elapsed / 1e6:6.2f}M bars/s  {baseline / elapsed:5.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# End to end throughput benchmark of HttpRequestFetcher + BatchRequestExecutor against the local mock polygon server (lib.mock_server).
+# Measures requests/sec, p50/p99 time to first byte and peak memory (rss) across rps, concurrency and payload sizes.
+# The server runs in its own process and every case runs in a fresh process, so peak rss is per case.
+# Results are saved to bench/results/{git sha}.json, pass a previous results file to compare: python scripts/bench-throughput-v1.py bench/results/<sha>.json
+
+import asyncio
+import json
+import multiprocessing
+import resource
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.metrics import FetchMetrics
+from lib.mock_server import MockPolygonServer, LognormalLatency
+
+N_REQUESTS = 300
+RPS = [100, 500, 2000]
+MAX_IN_FLIGHT = [10, 100]
+DAYS_PER_REQUEST = [1, 10] # ~390 and ~3900 bars per response
+FIRST_OPEN = 1539264600000 # 2018-10-11 9:30 ET
+RESULTS_DIR = Path(__file__).resolve().parent.parent / 'bench' / 'results'
+
+def make_urls(server: MockPolygonServer, n: int, days: int):
+    day_ms = 86_400_000
+    return [server.url('AAPL', FIRST_OPEN + idx * days * day_ms, FIRST_OPEN + ((idx + 1) * days - 1) * day_ms + 389 * 60_000, limit=50000) for idx in range(n)]
+
+def _rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == 'darwin' else rss / 1e3 # bytes on mac, KB on linux
+
+async def _run_case(urls, rps: int, max_in_flight: int):
+    metrics = FetchMetrics()
+    fetcher = HttpRequestFetcher(rps=rps, metrics=metrics)
+    executor = BatchRequestExecutor(max_in_flight=max_in_flight)
+
+    start_rss = _rss_mb()
+    start = perf_counter()
+    bars = 0
+    async for _, result in executor.stream(urls, fetcher):
+        bars += result['resultsCount'] if result else 0
+    elapsed = perf_counter() - start
+
+    return {
+        'rps': rps,
+        'max_in_flight': max_in_flight,
+        'requests': len(urls),
+        'bars': bars,
+        'elapsed': elapsed,
+        'requests_per_second': len(urls) / elapsed,
+        'ttfb_p50': metrics.ttfb.quantile(0.5),
+        'ttfb_p99': metrics.ttfb.quantile(0.99),
+        'body_read_p99': metrics.body_read.quantile(0.99),
+        'failures': metrics.failures,
+        'peak_rss_mb': _rss_mb(),
+        'peak_rss_growth_mb': _rss_mb() - start_rss, # peak above what the process used before the run
+    }
+
+def run_case(urls, rps: int, max_in_flight: int):
+    """Runs in a fresh process (see main), so ru_maxrss is this case's peak"""
+    return asyncio.run(_run_case(urls, rps, max_in_flight))
+
+def git_sha() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def case_key(case) -> str: return f"rps={case['rps']} in_flight={case['max_in_flight']} bars/req={case['bars'] // case['requests']}"
+
+def main():
+    baseline = {case_key(case): case for case in json.loads(Path(sys.argv[1]).read_text())['cases']} if len(sys.argv) > 1 else {}
+
+    server = MockPolygonServer(latency=LognormalLatency(median=0.02, sigma=0.5, seed=0))
+    ctx = multiprocessing.get_context('spawn')
+    cases = []
+    with server.run_in_process(): # server gets its own process, so it doesn't compete with the client
+        for days in DAYS_PER_REQUEST:
+            urls = make_urls(server, N_REQUESTS, days)
+            with ctx.Pool(1) as pool: pool.apply(run_case, (urls, max(RPS), max(MAX_IN_FLIGHT))) # warm up, so the server has every payload cached
+            for rps in RPS:
+                for max_in_flight in MAX_IN_FLIGHT:
+                    with ctx.Pool(1) as pool: case = pool.apply(run_case, (urls, rps, max_in_flight)) # fresh process per case
+                    cases.append(case)
+
+                    key = case_key(case)
+                    delta = ''
+                    if key in baseline:
+                        delta = f" | {case['requests_per_second'] / baseline[key]['requests_per_second'] - 1:+6.1%} req/s vs baseline"
+                    print(f"{key:<40s} {case['requests_per_second']:8.1f} req/s  ttfb p50 {case['ttfb_p50'] * 1000:6.1f}ms p99 {case['ttfb_p99'] * 1000:6.1f}ms  peak rss {case['peak_rss_mb']:7.1f} MB (+{case['peak_rss_growth_mb']:0.1f}){delta}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    sha = git_sha()
+    path = RESULTS_DIR / f"{sha}.json"
+    path.write_text(json.dumps({'sha': sha, 'date': datetime.now().isoformat(), 'cases': cases}, indent=2))
+    print(f"Saved results to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# Integrity check of stored bars (replaces the check-raw-data notebooks): duplicates / ordering of t, missing minutes against the NYSE sessions,
+# OHLC consistency and volume anomalies, checked in parallel across tickers. Prints a compact report and saves the windows to refetch.
+# python scripts/check-data-v1.py [dataset|csv]
+
+import json
+import sys
+from time import perf_counter
+
+from lib.integrity import check_dataset, check_csvs, format_report, refetch_windows
+
+START_DATE = '2018-10-11'
+END_DATE = '2023-10-09'
+SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else 'dataset'
+    start = perf_counter()
+    if source == 'csv': reports = check_csvs(f"{SAVE_DIR}/raw", start=START_DATE, end=END_DATE)
+    else: reports = check_dataset(f"{SAVE_DIR}/dataset", start=START_DATE, end=END_DATE)
+    elapsed = perf_counter() - start
+
+    print(format_report(reports))
+    print(f"Checked {sum(r.rows for r in reports)} rows for {len(reports)} tickers in {elapsed:0.2f} seconds")
+
+    windows = refetch_windows(reports)
+    with open(f"{SAVE_DIR}/refetch.json", 'w') as f: json.dump(windows, f, indent=2)
+    print(f"{sum(len(w) for w in windows.values())} windows to refetch saved to {SAVE_DIR}/refetch.json")
+
+if __name__ == "__main__":
+    main()
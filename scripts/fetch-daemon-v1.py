@@ -0,0 +1,20 @@
+# Runs the fetch daemon (lib.daemon): one warm connection pool, limiter and response cache shared by every notebook / script on this machine.
+# Submit jobs with lib.daemon.DaemonClient instead of building a fetcher each time, e.g.
+#   async with DaemonClient() as client:
+#       job = await client.submit(tickers=['AAPL'], start='2023-10-02', end='2023-10-06')
+#       async for url, result in client.results(job['id']): ...
+
+import asyncio
+
+from lib.daemon import FetchDaemon, DEFAULT_PORT
+
+SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+REQUESTS_PER_SECOND = 100 # budget shared by all jobs
+JOB_IN_FLIGHT = 50 # per job, so concurrent jobs share the budget evenly
+PORT = DEFAULT_PORT
+SOCKET_PATH = None # e.g. "/tmp/asyncfetcher.sock" to serve on a unix socket instead of localhost http
+
+if __name__ == "__main__":
+    daemon = FetchDaemon(rps=REQUESTS_PER_SECOND, cache_dir=f"{SAVE_DIR}/cache", job_in_flight=JOB_IN_FLIGHT, port=PORT, path=SOCKET_PATH)
+    try: asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt: print("Fetch daemon stopped")
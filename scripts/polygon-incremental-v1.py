@@ -0,0 +1,48 @@
+# Incremental version of polygon-v3.py: brings each ticker's csv in {SAVE_DIR}/raw up to date instead of refetching the whole range.
+# Only sessions missing from disk (plus a session saved before its close) are fetched, packed into multi-day requests, then merged into one csv per ticker.
+
+import asyncio
+from datetime import datetime
+from time import perf_counter
+
+from lib.utils import get_93, get_polygon_key
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ConnectionPool
+from lib.limiter import AdaptiveLimiter
+from lib.retry import RetryPolicy
+from lib.metrics import FetchMetrics, ProgressReporter
+from lib.incremental import fetch_deltas
+from lib.repair import Repairer, Quarantine
+
+START_DATE = '2018-10-11'
+END_DATE = 'today'
+SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+REQUESTS_PER_SECOND = 100
+TICKERS_AT_ONCE = 8 # tickers refreshed concurrently, bounds how many csvs are loaded for merging at a time
+REPAIR_ATTEMPTS = 2 # refetches for error payloads / empty responses before they're quarantined
+
+async def main():
+    main_start = perf_counter()
+    api_key = get_polygon_key()
+    tickers = get_93()
+    end_date = datetime.now().strftime('%Y-%m-%d') if END_DATE == 'today' else END_DATE
+
+    metrics = FetchMetrics()
+    async with ConnectionPool(limit_per_host=REQUESTS_PER_SECOND) as pool, ProgressReporter(metrics, interval=10):
+        fetcher = HttpRequestFetcher(pool=pool, limiter=AdaptiveLimiter(rate=REQUESTS_PER_SECOND), retry_policy=RetryPolicy(retries=2, defer=True), metrics=metrics)
+        executor = BatchRequestExecutor()
+        quarantine = Quarantine(f"{SAVE_DIR}/quarantine/incremental-{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz") # responses the repair loop gave up on
+        repairer = Repairer(fetcher, executor, max_attempts=REPAIR_ATTEMPTS, quarantine=quarantine)
+
+        # tickers are independent, so refresh several at once and let the limiter pace the requests
+        summaries = await fetch_deltas(tickers, f"{SAVE_DIR}/raw", START_DATE, end_date, fetcher, executor, concurrency=TICKERS_AT_ONCE, api_key=api_key, repair=repairer)
+
+    for s in summaries:
+        if s['requests']: print(f"{s['ticker']}: {s['requests']} requests, +{s['new_rows']} rows -> {s['path']}")
+    invalidated = [result for s in summaries for result in s['invalidated']]
+    if repairer.stats: print(f"Repairs: {dict(repairer.stats)}, given up responses are in {quarantine.path}")
+
+    print(f"{sum(s['requests'] for s in summaries)} requests, {sum(s['new_rows'] for s in summaries)} new rows, {len(invalidated)} invalidated")
+    print(f"Total time elapsed: {perf_counter() - main_start:0.2f} seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
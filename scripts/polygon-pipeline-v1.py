@@ -0,0 +1,60 @@
+# Pipelined version of polygon-v3.py: fetching, validating and writing csvs run as concurrent stages (lib.pipeline) instead of
+# fetch everything for a ticker -> validate -> save. Csvs are written chunk by chunk, a slow disk throttles fetching instead of growing memory.
+
+import asyncio
+from time import perf_counter
+
+from lib.utils import get_93, get_nyse_date_tups
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ConnectionPool, ResponseParser
+from lib.limiter import AdaptiveLimiter
+from lib.cache import ResponseCache
+from lib.journal import RunJournal
+from lib.retry import RetryPolicy, HedgePolicy
+from lib.metrics import FetchMetrics, ProgressReporter
+from lib.polygon import make_urls
+from lib.pipeline import Pipeline, CsvSink
+from lib.store import DatasetWriter
+from lib.workers import ParsePool, RawResponseParser
+from lib.repair import Repairer, Quarantine
+
+START_DATE = '2018-10-11'
+END_DATE = '2023-10-09'
+SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+REQUESTS_PER_SECOND = 100
+STORAGE = 'parquet' # or 'csv'
+REQUEST_TIMEOUT = 30 # seconds per attempt, a hung connection is retried instead of stalling the run
+PARSE_WORKERS = 0 # > 0 decodes + validates in that many processes (lib.workers), 0 keeps it in a thread
+REPAIR_ATTEMPTS = 2 # refetches for error payloads / empty responses before they're quarantined
+
+async def main():
+    main_start = perf_counter()
+    tickers = get_93()
+    tups = get_nyse_date_tups(START_DATE, END_DATE, unix=True)
+    urls = make_urls(tickers, tups) # ticker by ticker, so each csv is appended to in order
+
+    journal = RunJournal.create(f"{SAVE_DIR}/runs", urls, meta={'tickers': tickers, 'start_date': START_DATE, 'end_date': END_DATE})
+    print(f"Starting run {journal.run_id}")
+
+    metrics = FetchMetrics()
+    parse_pool = ParsePool(workers=PARSE_WORKERS) if PARSE_WORKERS else None
+    parser = RawResponseParser() if parse_pool is not None else ResponseParser(streaming=True)
+    async with ConnectionPool(limit_per_host=REQUESTS_PER_SECOND) as pool, ProgressReporter(metrics, interval=10):
+        fetcher = HttpRequestFetcher(pool=pool, limiter=AdaptiveLimiter(rate=REQUESTS_PER_SECOND), cache=ResponseCache(f"{SAVE_DIR}/cache"), retry_policy=RetryPolicy(retries=2, defer=True), parser=parser, metrics=metrics, timeout=REQUEST_TIMEOUT, hedge=HedgePolicy())
+        if STORAGE == 'parquet': sink = DatasetWriter(f"{SAVE_DIR}/dataset") # partitioned by ticker/year/month, one row group per batch
+        else: sink = CsvSink(f"{SAVE_DIR}/raw", name=lambda ticker: f"{ticker}-{START_DATE}-{END_DATE}.csv")
+        executor = BatchRequestExecutor(max_in_flight=REQUESTS_PER_SECOND * 2)
+        repairer = Repairer(fetcher, executor, max_attempts=REPAIR_ATTEMPTS, quarantine=Quarantine(journal.dir / 'quarantine.ndjson.gz')) # same executor, so Ctrl-C stops repairs too
+        pipeline = Pipeline(fetcher, sink, executor=executor, ordered=True, parse_pool=parse_pool, repair=repairer)
+        with pipeline.executor.cancel_on_signal(): # Ctrl-C stops fetching, what was fetched is still validated, written and journaled
+            summary = await pipeline.run(urls, journal=journal)
+    if parse_pool is not None: parse_pool.close()
+
+    with open(journal.dir / 'metrics.json', 'w') as f: f.write(metrics.to_json(indent=2))
+
+    print(f"{summary['rows']} rows from {summary['urls']} urls, {len(summary['failed'])} failed, {summary['repaired']} repaired, {len(summary['invalidated'])} invalidated {dict(repairer.stats)}")
+    if summary['cancelled']: print(f"Cancelled, {len(summary['outstanding'])} urls outstanding (still pending in run {journal.run_id})")
+    print(f"Stages: validate {summary['validate']:0.1f}s, repair {summary['repair']:0.1f}s, write {summary['write']:0.1f}s, fetch blocked on a full queue {summary['blocked']:0.1f}s")
+    print(f"Total time elapsed: {perf_counter() - main_start:0.2f} seconds")
+
+if __name__ == "__main__":
+    asyncio.run(main())
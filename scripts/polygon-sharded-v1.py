@@ -0,0 +1,54 @@
+# Multi-process version of polygon-v3.py: tickers are fetched across worker processes that share one global rate limit,
+# and the cpu bound part (validating, building dataframes, writing csvs) runs in the workers instead of on the fetch loop.
+
+from datetime import datetime
+from time import perf_counter
+
+from lib.utils import get_93, get_polygon_key, get_nyse_date_tups, validate_path
+from lib.polygon import make_urls, validate_results_columnar
+from lib.cache import ResponseCache
+from lib.retry import RetryPolicy
+from lib.repair import Quarantine
+from lib.sharding import ShardedRunner
+
+START_DATE = '2018-10-11'
+END_DATE = '2023-10-09'
+SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+REPAIR_ATTEMPTS = 2 # refetches for error payloads / empty responses before they're quarantined
+
+def process_ticker(ticker, urls, results):
+    """Runs in a worker process: validate, build the dataframe and save one ticker. Returns (rows, n invalidated), invalidated responses are already in the quarantine"""
+    df, invalidated = validate_results_columnar(results)
+
+    validate_path(f"{SAVE_DIR}/raw")
+    if len(df) > 0: df.to_csv(f"{SAVE_DIR}/raw/{ticker}-{START_DATE}-{END_DATE}.csv")
+    return len(df), len(invalidated)
+
+def main():
+    main_start = perf_counter()
+    api_key = get_polygon_key()
+    tickers = get_93()
+
+    WORKERS = 8
+    REQUESTS_PER_SECOND = 100 # global, shared by every worker
+
+    tups = get_nyse_date_tups(START_DATE, END_DATE, unix=True) # get tups of open/close, unix
+    jobs = {ticker: make_urls(ticker, tups) for ticker in tickers} # one job per ticker
+    quarantine = Quarantine(f"{SAVE_DIR}/quarantine/sharded-{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz") # shared by every worker
+
+    runner = ShardedRunner(
+        workers=WORKERS,
+        rps=REQUESTS_PER_SECOND,
+        fetcher_kwargs={'cache': ResponseCache(f"{SAVE_DIR}/cache"), 'retry_policy': RetryPolicy(retries=2, defer=True)},
+        pool_kwargs={'limit_per_host': REQUESTS_PER_SECOND},
+        repair_kwargs={'max_attempts': REPAIR_ATTEMPTS, 'quarantine': quarantine},
+    )
+    out = runner.run(jobs, process_ticker)
+
+    rows = sum(n for n, _ in out.values())
+    invalidated = sum(n for _, n in out.values())
+    print(f"Saved {rows} rows for {len(out)} tickers, {invalidated} invalidated responses (see {quarantine.path})")
+    print(f"Total time elapsed: {perf_counter() - main_start:0.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
+import asyncio
+from collections import Counter
 import pandas as pd
-from typing import List, Dict
 from time import perf_counter
-import pickle
-from datetime import datetime
 
 from lib.utils import get_polygon_root, get_93, get_polygon_key, get_nyse_date_tups, estimate_time, validate_path
-from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
-from lib.polygon import make_urls, validate_results
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ConnectionPool
+from lib.limiter import AdaptiveLimiter
+from lib.cache import ResponseCache
+from lib.journal import RunJournal, INVALID
+from lib.retry import RetryPolicy
+from lib.metrics import FetchMetrics, ProgressReporter
+from lib.polygon import make_urls, validate_results_columnar, fetch_complete
+from lib.store import DatasetWriter
+from lib.repair import Repairer, Quarantine
 
 def save_tickers(concat_df: pd.DataFrame, start: str, end: str, base_path=get_polygon_root()):
     """
@@ -33,42 +39,26 @@ def save_tickers(concat_df: pd.DataFrame, start: str, end: str, base_path=get_po
             print(f"Saving {ticker}... {idx+ 1} of {len(df_ticker_tups)}")
             _save(df, ticker, start, end)
 
-def save_invalidated_results(invalidated_results: List[Dict], base_path=get_polygon_root()):
-    """
-    Saves a list of invalidated results to a pickle file
-    """
-    validate_path(base_path) # validate path (create if doesn't exist)
-    with open(f"{base_path}/invalidated_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pkl", 'wb') as f:
-        pickle.dump(invalidated_results, f)
-
-def process_results(results, start_date, end_date, save_dir):
-    """Function to process results and save to csvs"""
+def process_results(results, start_date, end_date, save_dir, storage='csv'):
+    """Function to process results and save to csvs (`storage='csv'`) or the parquet dataset in {save_dir}/dataset (`storage='parquet'`)"""
 
-    validated, invalidated = validate_results(results) # validate
+    df, invalidated = validate_results_columnar(results) # validate, straight into columns (no per bar objects)
     
     # ! Handle validated results
-    if len(validated) > 0:
-        # load valid results into dataframe
-        df = pd.DataFrame([
-            {
-                **result.model_dump(),
-                'ticker': snapshot.ticker
-            }
-            for snapshot in validated for result in snapshot.results])
-        
-        # save to csv
+    if len(df) > 0:
         print("Saving validated data...")
-        save_tickers(df, start_date, end_date, base_path=save_dir)
+        if storage == 'parquet':
+            with DatasetWriter(f"{save_dir}/dataset") as writer: writer.write(df) # partitioned by ticker/year/month, adds new part files
+        else:
+            save_tickers(df, start_date, end_date, base_path=save_dir)
     else:
         print("No validated results to save. RIP :(")
 
-    # ! Handle invalidated results
-    if len(invalidated) > 0:
-        # pickle invalid results
-        print("Saving invalidated data...")
-        save_invalidated_results(invalidated, base_path=save_dir)
-    else:
-        print("No invalidated results to save. Nice!")
+    # ! Handle invalidated results (already through the repair loop, what's left is in the run's quarantine)
+    if len(invalidated) > 0: print(f"{len(invalidated)} responses still invalid after repairs, see the run's quarantine")
+    else: print("No invalidated results. Nice!")
+
+    return invalidated
 
 def main():
     main_start = perf_counter()
@@ -76,34 +66,81 @@ def main():
     api_key = get_polygon_key()
     tickers = get_93()
 
-    tickers_ = tickers[40:]
+    tickers_ = tickers
     start_date = '2018-10-11'
     end_date = '2023-10-09'
 
     SAVE_DIR = "/Users/beneverman/Documents/Coding/AsyncFetcher-v1/data/"
+    RESUME_RUN_ID = None # set to a run id from {SAVE_DIR}/runs to pick up where a previous run stopped
 
     REQUESTS_PER_SECOND = 100
+    STORAGE = 'parquet' # or 'csv' for the old {ticker}-{start}-{end}.csv files
+    REPAIR_ATTEMPTS = 2 # refetches for error payloads / empty responses before they're quarantined
 
-    tups = get_nyse_date_tups(start_date, end_date, unix=True) # get tups of open/close, unix
+    if RESUME_RUN_ID: # re-plan from the run's manifest, not the constants above
+        journal = RunJournal(f"{SAVE_DIR}/runs", RESUME_RUN_ID)
+        tickers_, start_date, end_date = journal.meta['tickers'], journal.meta['start_date'], journal.meta['end_date']
+        print(f"Resuming run {RESUME_RUN_ID}: {journal.counts()}")
 
-    for idx, ticker in enumerate(tickers_): # iterate over tickers
-        print(f"Processing {ticker}... {idx + 1} of {len(tickers)}")
-
-        urls = make_urls(ticker, tups, api_key) # make urls
-        fetcher = HttpRequestFetcher(rps=REQUESTS_PER_SECOND, detailed_logs=False) # setup fetcher
-        executor = BatchRequestExecutor() # setup executor
-
-        # estimate_time(len(urls), rps=REQUESTS_PER_SECOND) # estimate time and print
-
-        fetch_start = perf_counter() # start timer
-        results = executor.execute(urls, fetcher) # execute
-        fetch_elapsed = perf_counter() - fetch_start # end timer
-
-        print(f"Data fetching complete. Time elapsed: {fetch_elapsed:0.2f} seconds")
-        print("Validating and parsing data...")
-
-        process_results(results, start_date, end_date, SAVE_DIR)
+    tups = get_nyse_date_tups(start_date, end_date, unix=True) # get tups of open/close, unix
 
+    if not RESUME_RUN_ID:
+        all_urls = [url for ticker in tickers_ for url in make_urls(ticker, tups)]
+        journal = RunJournal.create(f"{SAVE_DIR}/runs", all_urls, meta={'tickers': tickers_, 'start_date': start_date, 'end_date': end_date})
+        print(f"Starting run {journal.run_id}")
+
+    loop = asyncio.get_event_loop() # one loop for the whole run, the pool's session is bound to it
+    pool = ConnectionPool(limit_per_host=REQUESTS_PER_SECOND) # shared across tickers, keeps connections warm
+    loop.run_until_complete(pool.warm("https://api.polygon.io/", n=REQUESTS_PER_SECOND // 2)) # handshakes happen here, not on the first batch
+    limiter = AdaptiveLimiter(rate=REQUESTS_PER_SECOND) # starting guess, settles near the real ceiling and carries over between tickers
+    cache = ResponseCache(f"{SAVE_DIR}/cache") # re-runs (after a crash or schema change) skip days already fetched
+    retry_policy = RetryPolicy(retries=2, defer=True) # jittered backoff, no retries on 4xx, slow retries wait until after each batch
+    metrics = FetchMetrics() # shared by every ticker's fetcher, so it covers the whole run
+    reporter = ProgressReporter(metrics, interval=10)
+    reporter.start(loop) # runs whenever the loop does, i.e. during each executor.execute
+
+    executor = BatchRequestExecutor() # one for the run, so Ctrl-C cancels it wherever it is
+    quarantine = Quarantine(journal.dir / 'quarantine.ndjson.gz') # responses the repair loop gave up on
+    repair_stats = Counter()
+    with executor.cancel_on_signal(): # first Ctrl-C stops after the ticker in flight is saved, its unfetched urls stay pending for a resume
+        for idx, ticker in enumerate(tickers_): # iterate over tickers
+            print(f"Processing {ticker}... {idx + 1} of {len(tickers)}")
+
+            urls = make_urls(ticker, tups, api_key) # make urls
+            pending = journal.pending(urls)
+            if not pending:
+                print(f"{ticker} already complete in run {journal.run_id}, skipping")
+                continue
+            # csv: refetch the whole ticker so its csv is complete, urls already done are served from the cache
+            # parquet: only what's pending, the dataset already has the rest (a cancelled ticker's fetched days included) and takes new part files
+            if STORAGE == 'parquet': urls = pending
+            fetcher = HttpRequestFetcher(detailed_logs=False, pool=pool, limiter=limiter, cache=cache, retry_policy=retry_policy, metrics=metrics) # setup fetcher
+
+            # estimate_time(len(urls), rps=REQUESTS_PER_SECOND) # estimate time and print
+
+            fetch_start = perf_counter() # start timer
+            results = loop.run_until_complete(fetch_complete(urls, fetcher, executor, journal=journal)) # execute, checkpointing each url and completing any window that hit the limit
+            repairer = Repairer(fetcher, executor, max_attempts=REPAIR_ATTEMPTS, quarantine=quarantine)
+            results = loop.run_until_complete(repairer.repair(urls, results)) # refetch error payloads / empty responses instead of a second full pass
+            repair_stats += repairer.stats
+            fetch_elapsed = perf_counter() - fetch_start # end timer
+
+            print(f"Data fetching complete. Time elapsed: {fetch_elapsed:0.2f} seconds, rate: {limiter.rate:0.1f} rps")
+            print("Validating and parsing data...")
+
+            invalidated = process_results(results, start_date, end_date, SAVE_DIR, storage=STORAGE)
+            invalid_ids = {id(result) for result in invalidated}
+            for url, result in zip(urls, results):
+                if result is not None and id(result) in invalid_ids: journal.record(url, INVALID) # failed fetches are already recorded
+            journal.flush()
+            if executor.cancelled:
+                print(f"Run {journal.run_id} cancelled, {len(executor.outstanding)} urls of {ticker} outstanding, set RESUME_RUN_ID = '{journal.run_id}' to finish it")
+                break
+
+    reporter.stop()
+    if repair_stats: print(f"Repairs: {dict(repair_stats)}")
+    loop.run_until_complete(pool.close())
+    with open(journal.dir / 'metrics.json', 'w') as f: f.write(metrics.to_json(indent=2)) # keep the run's metrics next to its journal
     main_elapsed = perf_counter() - main_start
     print(f"Total time elapsed: {main_elapsed:0.2f} seconds")
 
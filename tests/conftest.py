@@ -0,0 +1,68 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from lib import utils
+from lib.store import DatasetWriter
+from lib.mock_server import snapshot_payload
+from lib.polygon import validate_results_columnar
+
+@pytest.fixture(autouse=True, scope='session')
+def polygon_key():
+    """Tests never need a real key, and shouldn't depend on a local .env"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('POLYGON_API_KEY', 'test_key')
+        yield 'test_key'
+
+@pytest.fixture(autouse=True, scope='session')
+def calendar_cache(tmp_path_factory):
+    """Keep the shared NYSE calendar's disk cache out of ~/.cache"""
+    cache_dir = str(tmp_path_factory.mktemp('nyse-calendar'))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(utils, 'NYSE_CACHE_DIR', cache_dir)
+        yield cache_dir
+
+# ! Data ======================================================
+def make_bars(tickers, start, end, **kwargs):
+    """Validated synthetic bars (validate_results_columnar frame) for one ticker or a list, every session minute from start to end. GE gets fractional volume like the real feed"""
+    tickers = [tickers] if isinstance(tickers, str) else tickers
+    payloads = [snapshot_payload(ticker, start, end, limit=10**6, **{'float_volume': ticker == 'GE', **kwargs}) for ticker in tickers]
+    df, _ = validate_results_columnar(payloads)
+    return df
+
+@pytest.fixture
+def bars():
+    """`make_bars`, e.g. `bars('AAPL', '2023-10-02', '2023-10-06')`"""
+    return make_bars
+
+@pytest.fixture
+def reopened(tmp_path):
+    """Dataset in tmp_path where one writer (`max_open=1`) rewrote the same AAPL bar 11 times with c = 0..10, each rewrite in a new part file. Returns the bar"""
+    bar, other = make_bars('AAPL', '2023-10-02', '2023-10-02').head(1), make_bars('AAPL', '2023-09-29', '2023-09-29').head(1)
+    with DatasetWriter(tmp_path, max_open=1) as writer:
+        for idx in range(11):
+            writer.write(bar.assign(c=float(idx)))
+            writer.write(other) # another partition, evicts the first
+    return bar
+
+# ! Servers ===================================================
+@pytest_asyncio.fixture
+async def serve():
+    """
+    Start local aiohttp servers: `server = await serve({'/ok': handler, ...}, hits=hits)` serves every method on each route, extra kwargs become attributes on the server
+    (state the handlers share with the test). Servers are closed after the test.
+    """
+    servers = []
+
+    async def _serve(routes, **attrs):
+        app = web.Application()
+        for path, handler in routes.items(): app.router.add_route('*', path, handler)
+        server = TestServer(app)
+        for name, value in attrs.items(): setattr(server, name, value)
+        await server.start_server()
+        servers.append(server)
+        return server
+
+    yield _serve
+    for server in servers: await server.close()
@@ -0,0 +1,87 @@
+import os
+import time
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from lib.cache import ResponseCache, normalize_url
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ResponseParser
+
+# ! Fixtures =================================================
+@pytest.fixture
+def cache(tmp_path) -> ResponseCache:
+    return ResponseCache(tmp_path / 'cache')
+
+@pytest_asyncio.fixture
+async def counting_server(serve):
+    """Local server that counts the requests it serves"""
+    async def handler(request):
+        server.count += 1
+        return web.json_response({"ticker": request.match_info['ticker']})
+
+    server = await serve({'/{ticker}': handler}, count=0)
+    return server
+
+# ! Tests ====================================================
+def test_normalize_url():
+    a = "https://api.polygon.io/v2/aggs/ticker/AAPL/range/1/minute/1/2?adjusted=true&sort=asc&limit=1000&apiKey=secret"
+    b = "https://API.polygon.io/v2/aggs/ticker/AAPL/range/1/minute/1/2?limit=1000&apiKey=other&sort=asc&adjusted=true"
+    assert normalize_url(a) == normalize_url(b), "param order, host case and apiKey should not change the key"
+    assert 'secret' not in normalize_url(a), "apiKey should be dropped"
+
+@pytest.mark.asyncio
+async def test_roundtrip(cache):
+    url = "https://example.com/data?apiKey=secret"
+    assert cache.get(url) is None
+    cache.set(url, b'{"key": "value"}', 'application/json; charset=utf-8')
+
+    cached = cache.get("https://example.com/data?apiKey=rotated")
+    assert cached is not None, "cache key should ignore the apiKey"
+    assert await ResponseParser().parse(cached) == {"key": "value"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_ttl(cache):
+    cache.ttl = 60
+    cache.set("https://example.com/a", b'a', 'text/plain')
+    assert "https://example.com/a" in cache
+
+    file = cache._file(cache.key("https://example.com/a"))
+    old = time.time() - 120
+    os.utime(file, (old, old))
+    assert "https://example.com/a" not in cache, "entries older than ttl should expire"
+    assert not file.exists(), "expired entries should be removed"
+
+def test_max_bytes_evicts_lru(cache):
+    body = os.urandom(1000) # incompressible, so each entry is > 1000 bytes on disk
+    cache.max_bytes = 2500
+    cache.set("https://example.com/1", body, 'text/plain')
+    cache.set("https://example.com/2", body, 'text/plain')
+
+    old = time.time() - 100
+    os.utime(cache._file(cache.key("https://example.com/1")), (old, old)) # 1 is the least recently used
+    cache.set("https://example.com/3", body, 'text/plain')
+
+    assert "https://example.com/1" not in cache, "least recently used entry should be evicted"
+    assert "https://example.com/2" in cache and "https://example.com/3" in cache
+
+def test_evict_low_water(cache, monkeypatch):
+    body = os.urandom(1000)
+    cache.max_bytes, cache.low_water = 10_500, 0.5
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+    for idx in range(20): cache.set(f"https://example.com/{idx}", body, 'text/plain')
+
+    assert len(scans) == 2, f"each eviction should make room for several writes, scanned {len(scans)} times"
+    assert cache._size == sum(f.stat().st_size for f in cache._entries()) <= cache.max_bytes, "tracked size should match what's on disk"
+
+@pytest.mark.asyncio
+async def test_fetcher_cache_hits_skip_network(cache, counting_server):
+    urls = [str(counting_server.make_url(f'/{ticker}')) + '?apiKey=secret' for ticker in ['AAPL', 'MSFT']]
+
+    first = await BatchRequestExecutor().execute_async(urls, HttpRequestFetcher(rps=100, cache=cache))
+    assert counting_server.count == 2
+
+    second = await BatchRequestExecutor().execute_async(urls, HttpRequestFetcher(rps=100, cache=cache))
+    assert second == first == [{"ticker": "AAPL"}, {"ticker": "MSFT"}]
+    assert counting_server.count == 2, "second run should be served entirely from the cache"
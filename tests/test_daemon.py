@@ -0,0 +1,85 @@
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+
+from lib.daemon import FetchDaemon, DaemonClient, Job, FINISHED
+from lib.mock_server import MockPolygonServer, ConstantLatency
+
+@pytest_asyncio.fixture
+async def server():
+    async with MockPolygonServer() as server: yield server
+
+@pytest.mark.asyncio
+async def test_submit_and_stream(server, tmp_path):
+    urls = [server.url(ticker, '2023-10-09', '2023-10-09') for ticker in ['AAPL', 'GE', 'MSFT']]
+    async with FetchDaemon(rps=100, cache_dir=tmp_path / 'cache', port=0) as daemon, DaemonClient(f"http://127.0.0.1:{daemon.port}") as client:
+        job = await client.submit(urls=urls, name='test')
+        results = {url: result async for url, result in client.results(job['id'])}
+        assert results.keys() == set(urls) and all(len(result['results']) == 390 for result in results.values())
+        assert (await client.job(job['id']))['state'] == FINISHED
+        assert daemon.jobs[job['id']].path.parent == daemon.spool_dir and daemon.jobs[job['id']].path.stat().st_size > 3 * 390 * 50, "results are spooled to disk"
+
+        again = [url async for url, _ in client.results(job['id'], start=1)]
+        assert len(again) == 2, "results can be streamed again from an offset"
+        assert [url async for url, _ in client.results(job['id'], start=10)] == [], "past the end streams nothing"
+        with pytest.raises(RuntimeError, match='400'):
+            async for _ in client.results(job['id'], start=-1): pass
+
+        job = await client.submit(urls=urls)
+        assert len([url async for url, _ in client.results(job['id'])]) == 3
+        status = await client.status()
+        assert status['metrics']['cache_hits'] == 3 and status['metrics']['requests'] == 3, "the cache outlives jobs"
+        assert status['jobs'] == {FINISHED: 2}
+
+        with pytest.raises(RuntimeError):
+            await client.job('nope')
+        with pytest.raises(RuntimeError):
+            await client.submit(urls=[])
+
+@pytest.mark.asyncio
+async def test_jobs_share_limiter(server):
+    big = [server.url('AAPL', start, start) for start in range(1696858200000, 1696858200000 + 40 * 60_000, 60_000)]
+    small = [server.url('GE', start, start) for start in range(1696858200000, 1696858200000 + 8 * 60_000, 60_000)]
+    async with FetchDaemon(rps=40, job_in_flight=4, port=0) as daemon, DaemonClient(f"http://127.0.0.1:{daemon.port}") as client:
+        big_job = await client.submit(urls=big)
+        await asyncio.sleep(0.1)
+        small_job = await client.submit(urls=small)
+        async for _ in client.results(small_job['id']): pass
+        assert (await client.job(big_job['id']))['state'] != FINISHED, "a later, smaller job shouldn't wait for the first one to finish"
+        async for _ in client.results(big_job['id']): pass
+        assert daemon.metrics.requests == 48
+
+@pytest.mark.asyncio
+async def test_unix_socket_ticker_job_cancel(tmp_path):
+    async with MockPolygonServer(latency=ConstantLatency(0.2)) as server:
+        async with FetchDaemon(path=str(tmp_path / 'daemon.sock'), api_key='test', base=server.base_url, job_in_flight=1) as daemon, DaemonClient(path=str(tmp_path / 'daemon.sock')) as client:
+            job = await client.submit(tickers=['AAPL', 'GE'], start='2023-10-09', end='2023-10-13')
+            assert job['urls'] == 10 and daemon.jobs[job['id']].urls[0].startswith(server.base_url)
+            async for url, result in client.results(job['id']):
+                assert result['ticker'] == 'AAPL'
+                break
+            info = await client.cancel(job['id'])
+            await asyncio.sleep(0)
+            assert daemon.jobs == {} and info['completed'] < 10
+            assert not list(daemon.spool_dir.iterdir()), "a deleted job's results are removed"
+            assert (await client.status())['jobs'] == {}
+
+@pytest.mark.asyncio
+async def test_job_spool(tmp_path):
+    job = Job(['a', 'b', 'c'], spool=tmp_path)
+    job.add('a', b'{"ticker": "AAPL",\n "results": []}')
+    job.add('b', b'{"ticker": "AAPL", "resul') # truncated body
+    job.add('c', None)
+    job.finish(FINISHED)
+
+    lines, end = job.read(0)
+    assert end == 3 and [json.loads(line) for line in lines.splitlines()] == [
+        {'url': 'a', 'result': {'ticker': 'AAPL', 'results': []}},
+        {'url': 'b', 'result': '{"ticker": "AAPL", "resul'}, # still a valid line, the body comes back as a string
+        {'url': 'c', 'result': None},
+    ]
+    assert job.read(1, max_bytes=1) == (lines.splitlines(keepends=True)[1], 2), "reads are chunked, at least one line at a time"
+    assert job.info()['completed'] == 3 and job.failed == 1
+    job.discard()
+    assert not job.path.exists()
@@ -1,34 +1,190 @@
+import time
 from time import perf_counter
+import asyncio
+import signal
 import pytest
-import warnings
+import pytest_asyncio
+from aiohttp import web
 
-from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor, ConnectionPool
+from lib.limiter import AdaptiveLimiter
+from lib.mock_server import MockPolygonServer
+from lib.polygon import session_bounds
 
 
 def test_fetcher_and_executor():
-    warnings.filterwarnings("ignore", category=DeprecationWarning) # suppress warning about no event loop
-    # ? tests/test_fetcher_and_executor.py::test_fetcher_and_executor
-    # ? /Users/beneverman/Documents/Coding/AsyncFetcher-v1/lib/fetcher.py:44: DeprecationWarning: There is no current event loop
-    # ? loop = loop or asyncio.get_event_loop() # get event loop if not provided, else use provided
-
     rps = 1
     n_requests = 3
     retries = 2
 
     executor = BatchRequestExecutor() # init executor
     fetcher = HttpRequestFetcher(retries=retries, rps=rps) # init fetcher
-    
-    urls = ["https://www.google.com"] * n_requests # generate urls
+    opens, closes = session_bounds('2023-10-09', '2023-10-09')
 
-    start = perf_counter()
-    responses = executor.execute(urls, fetcher) # execute
-    elapsed = perf_counter() - start
+    with MockPolygonServer().run_in_thread() as server: # local stand in for polygon, no network needed
+        urls = [server.url('AAPL', opens[0], closes[0])] * n_requests # generate urls
+
+        start = perf_counter()
+        responses = executor.execute(urls, fetcher) # execute
+        elapsed = perf_counter() - start
 
-    assert len(responses) == n_requests, f"Expected 4 responses, got {len(responses)}" # works because errors return None
-    assert elapsed >= rps / n_requests, f"Expected elapsed time to be at least {(n_requests / rps) - 1}s, got {elapsed:0.2f}"
-    #? max time should be n_requests / rps - 1s, since we start the first request immediately at 0s, and the last request at n_requests / rps - 1s
-    # print(responses[0])
+    assert len(responses) == n_requests, f"Expected {n_requests} responses, got {len(responses)}"
+    assert all(response['ticker'] == 'AAPL' and len(response['results']) == 390 for response in responses), "every request should return a full session"
+    assert elapsed >= (n_requests - 1) / rps - 0.1, f"Expected at least {(n_requests - 1) / rps}s at {rps} rps, got {elapsed:0.2f}s"
+    #? the first request starts immediately, the last at (n_requests - 1) / rps
 
-    invalid_data_type = [["https://www.google.com"]] # invalid data type, list of lists
+    invalid_data_type = [[urls[0]]] # invalid data type, list of lists
     with pytest.raises(AssertionError):
-        responses = executor.execute(invalid_data_type, fetcher)
\ No newline at end of file
+        responses = executor.execute(invalid_data_type, fetcher)
+
+class FakeFetcher:
+    """Stand in for HttpRequestFetcher, returns the url after a per-url delay and tracks concurrency"""
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self): pass
+    async def __aexit__(self, exc_type, exc, tb): pass
+
+    async def fetch(self, url, ref=None, parse=True):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delays.get(url, 0.001))
+        self.in_flight -= 1
+        return url
+
+
+async def _collect(agen): return [item async for item in agen]
+
+@pytest.mark.asyncio
+async def test_stream_caps_in_flight():
+    urls = [f"url-{i}" for i in range(50)]
+    fetcher = FakeFetcher()
+    results = await _collect(BatchRequestExecutor().stream(urls, fetcher, max_in_flight=5))
+
+    assert sorted(results) == sorted((url, url) for url in urls), "every url should be yielded exactly once"
+    assert fetcher.max_in_flight <= 5, f"Expected at most 5 requests in flight, got {fetcher.max_in_flight}"
+
+@pytest.mark.asyncio
+async def test_stream_yields_as_completed():
+    urls = ["slow", "fast"]
+    fetcher = FakeFetcher(delays={"slow": 0.05, "fast": 0.001})
+    results = await _collect(BatchRequestExecutor().stream(urls, fetcher))
+    assert [url for url, _ in results] == ["fast", "slow"], "results should be yielded in completion order"
+
+@pytest.mark.asyncio
+async def test_stream_ordered():
+    urls = [f"url-{i}" for i in range(20)]
+    fetcher = FakeFetcher(delays={url: 0.001 * (20 - i) for i, url in enumerate(urls)}) # later urls finish first
+    results = await _collect(BatchRequestExecutor(max_in_flight=4).stream(iter(urls), fetcher, ordered=True))
+
+    assert [url for url, _ in results] == urls, "ordered stream should yield results in url order"
+    assert fetcher.max_in_flight <= 4
+
+@pytest.mark.asyncio
+async def test_batch_deadline():
+    urls = [f"url-{i}" for i in range(6)]
+    fetcher = FakeFetcher(delays={"url-2": 10})
+    start = perf_counter()
+    results = await BatchRequestExecutor(deadline=0.2).execute_async(urls, fetcher)
+    assert results == [url if url != "url-2" else None for url in urls] and perf_counter() - start < 1, "a hung url is cut off at the deadline"
+
+    results = await _collect(BatchRequestExecutor(max_in_flight=2, deadline=0.2).stream(iter(urls), fetcher, ordered=True))
+    assert results == [("url-0", "url-0"), ("url-1", "url-1"), ("url-2", None), ("url-3", "url-3")], "the hung url comes back as None, unstarted ones are dropped"
+
+@pytest.mark.asyncio
+async def test_batch_cancel():
+    urls = [f"url-{i}" for i in range(6)]
+    fetcher = FakeFetcher(delays={"url-4": 10, "url-5": 10})
+    executor = BatchRequestExecutor(grace=0.1)
+    asyncio.get_running_loop().call_later(0.1, executor.cancel)
+    start = perf_counter()
+    results = await executor.execute_async(urls, fetcher)
+    assert results == urls[:4] + [None, None] and perf_counter() - start < 1, "finished urls are kept, the rest come back as None"
+    assert executor.cancelled and executor.outstanding == ["url-4", "url-5"]
+    assert await executor.execute_async(urls, fetcher) == [None] * 6 and len(executor.outstanding) == 8, "a cancelled executor doesn't start new runs"
+
+    executor = BatchRequestExecutor(max_in_flight=2, grace=0.1)
+    asyncio.get_running_loop().call_later(0.1, executor.cancel)
+    results = await _collect(executor.stream(iter(urls), FakeFetcher(delays={"url-2": 10, "url-4": 10})))
+    assert sorted(results) == [("url-0", "url-0"), ("url-1", "url-1"), ("url-3", "url-3")], "completed results are still yielded"
+    assert sorted(executor.outstanding) == ["url-2", "url-4", "url-5"], "in flight and unstarted urls are outstanding"
+
+class SignalFetcher(FakeFetcher):
+    """Records the SIGINT handler in place while fetching"""
+    async def fetch(self, url, ref=None, parse=True):
+        self.handler = signal.getsignal(signal.SIGINT)
+        return await super().fetch(url, ref, parse)
+
+def test_execute_signal_opt_out():
+    loop = asyncio.new_event_loop()
+    try:
+        fetcher = SignalFetcher()
+        BatchRequestExecutor().execute(["url-0"], fetcher, loop=loop)
+        assert fetcher.handler is not signal.default_int_handler, "ctrl-c cancels the batch by default"
+        BatchRequestExecutor().execute(["url-0"], fetcher, loop=loop, handle_signals=False)
+        assert fetcher.handler is signal.default_int_handler, "worker processes keep ctrl-c as KeyboardInterrupt"
+    finally:
+        loop.close()
+
+# ! Connection pool ==========================================
+@pytest_asyncio.fixture
+async def local_server(serve):
+    """Tiny local server that records the client port of every request (one port per connection)"""
+    ports, times = set(), []
+
+    async def handler(request):
+        ports.add(request.transport.get_extra_info('peername')[1])
+        return web.json_response({"ok": True})
+
+    async def throttled(request):
+        return web.json_response({"status": "ERROR"}, status=429, headers={'Retry-After': request.query.get('retry_after', '0')})
+
+    async def timed(request):
+        times.append(time.monotonic())
+        return web.json_response({"ok": True})
+
+    return await serve({'/': handler, '/429': throttled, '/timed': timed}, ports=ports, times=times)
+
+@pytest.mark.asyncio
+async def test_pool_shared_across_fetchers(local_server):
+    url = str(local_server.make_url('/'))
+    async with ConnectionPool(limit_per_host=2) as pool:
+        for _ in range(3): # new fetcher per "ticker", like polygon-v3.py
+            fetcher = HttpRequestFetcher(rps=100, pool=pool)
+            results = await BatchRequestExecutor().execute_async([url] * 4, fetcher)
+            assert results == [{"ok": True}] * 4
+            assert not pool.closed, "fetcher should not close the pool's session"
+
+        assert len(local_server.ports) <= 2, f"connections should be reused across fetchers, saw {len(local_server.ports)}"
+    assert pool.closed
+
+@pytest.mark.asyncio
+async def test_pool_warm(local_server):
+    url = str(local_server.make_url('/'))
+    async with ConnectionPool() as pool:
+        opened = await pool.warm(url, n=3)
+        assert opened == 3
+        assert len(local_server.ports) == 3, "warm should open n separate connections"
+
+        fetcher = HttpRequestFetcher(rps=100, pool=pool)
+        await BatchRequestExecutor().execute_async([url] * 3, fetcher)
+        assert len(local_server.ports) == 3, "requests after warm up should reuse the warm connections"
+
+
+@pytest.mark.asyncio
+async def test_fetcher_adaptive_feedback(local_server):
+    fetcher = HttpRequestFetcher(retries=0, rps=20, adaptive=True)
+    await BatchRequestExecutor().execute_async([str(local_server.make_url('/'))] * 5, fetcher)
+    assert fetcher.limiter.rate > 20, "successes should raise the rate"
+
+    await BatchRequestExecutor().execute_async([str(local_server.make_url('/429'))], fetcher)
+    assert fetcher.limiter.rate < 20, "a 429 should lower the rate"
+
+    fetcher = HttpRequestFetcher(retries=0, limiter=AdaptiveLimiter(rate=10, increase=0))
+    start = time.monotonic()
+    await BatchRequestExecutor().execute_async([str(local_server.make_url('/429').with_query(retry_after='0.5'))] + [str(local_server.make_url('/timed'))] * 4, fetcher)
+    starts = [t - start for t in local_server.times]
+    assert min(starts) >= 0.45, f"requests queued before the 429 should wait out its Retry-After, started at {starts}"
+    assert all(b - a >= 0.18 for a, b in zip(starts, starts[1:])), f"and go at the halved rate, started at {starts}"
@@ -0,0 +1,85 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.incremental
+from lib.incremental import existing_files, existing_t, load_existing, missing_sessions, missing_runs, plan_delta, fetch_delta, fetch_deltas
+from lib.polygon import session_bounds
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.mock_server import MockPolygonServer, synthetic_bar, session_minutes
+
+def _bars(ticker, start_ms, end_ms):
+    return pd.DataFrame([{**synthetic_bar(ticker, t), 'ticker': ticker} for t in session_minutes(start_ms, end_ms)])
+
+def test_existing_files(tmp_path):
+    for name in ['BRK.B-2023-01-03-2023-01-31.csv', 'BRK-2023-01-03-2023-01-31.csv', 'AAPL-2023-02-01-2023-02-28.csv', 'AAPL-2023-01-03-2023-01-31.csv', 'AAPL-notes.csv']:
+        (tmp_path / name).write_text('')
+    assert [f[1] for f in existing_files(tmp_path, 'AAPL')] == ['2023-01-03', '2023-02-01']
+    assert len(existing_files(tmp_path, 'BRK')) == 1
+    assert load_existing(tmp_path, 'MSFT').empty
+
+def test_missing_sessions():
+    opens, closes = session_bounds('2023-10-09', '2023-10-20') # 10 sessions
+    full = np.array([t for o, c in zip(opens[:3], closes[:3]) for t in range(o, c, 60_000)] + [opens[5], opens[6] + 60_000 * 100])
+    missing = missing_sessions(full, opens, closes)
+    assert missing.tolist() == [False] * 3 + [True] * 2 + [False, True] + [True] * 3, "day 5 has bars, day 6 stops short of the close so it's refetched"
+    assert missing_runs(missing) == [(3, 5), (6, 10)]
+    assert not missing_sessions(full, opens, closes, refresh_last=False)[6]
+    assert missing_sessions(np.empty(0), opens, closes).all()
+
+def test_plan_delta_only_missing():
+    opens, closes = session_bounds('2023-01-01', '2023-12-31')
+    have = np.concatenate([np.arange(o, c, 60_000) for o, c in zip(opens[:-5], closes[:-5])]) # all but the last week
+    plan = plan_delta('AAPL', have, '2023-01-01', '2023-12-31', api_key='test_key')
+    assert len(plan) == 1 and plan[0].days == 5 and plan[0].start == opens[-5] and plan[0].end == closes[-1]
+    assert plan_delta('AAPL', np.concatenate([have, np.arange(opens[-5], closes[-1], 60_000)]), '2023-01-01', '2023-12-31', api_key='test_key') == []
+
+class RecordingRepair:
+    """Stand in for lib.repair.Repairer, passes results through"""
+    def __init__(self): self.urls = []
+    async def repair(self, urls, results):
+        self.urls.extend(urls)
+        return results
+
+@pytest.mark.asyncio
+async def test_fetch_delta_merges(tmp_path):
+    opens, closes = session_bounds('2023-10-09', '2023-10-20')
+    _bars('AAPL', int(opens[0]), int(closes[4])).to_csv(tmp_path / 'AAPL-2023-10-09-2023-10-13.csv') # first week already on disk
+
+    repair = RecordingRepair()
+    async with MockPolygonServer() as server:
+        summary = await fetch_delta('AAPL', tmp_path, '2023-10-09', '2023-10-20', HttpRequestFetcher(rps=100), BatchRequestExecutor(), api_key='test', base=server.base_url, repair=repair)
+        assert server.stats['requests'] == 1, "only the missing week should be requested"
+        assert len(repair.urls) == 1, "fetched responses go through the repair loop before merging"
+        again = await fetch_delta('AAPL', tmp_path, '2023-10-09', '2023-10-20', HttpRequestFetcher(rps=100), BatchRequestExecutor(), api_key='test', base=server.base_url)
+
+    assert summary['new_rows'] == 5 * 390 and summary['rows'] == 10 * 390
+    assert [f[0].name for f in existing_files(tmp_path, 'AAPL')] == ['AAPL-2023-10-09-2023-10-20.csv'], "merged csv replaces the old one"
+    df = load_existing(tmp_path, 'AAPL')
+    assert df['t'].is_monotonic_increasing and df['t'].is_unique and len(df) == 10 * 390
+    assert again['requests'] == 0, "nothing left to fetch"
+
+def test_existing_t(tmp_path):
+    opens, closes = session_bounds('2023-10-09', '2023-10-20')
+    _bars('AAPL', int(opens[0]), int(closes[5])).to_csv(tmp_path / 'AAPL-2023-10-09-2023-10-16.csv')
+    _bars('AAPL', int(opens[5]), int(closes[9])).to_csv(tmp_path / 'AAPL-2023-10-16-2023-10-20.csv') # overlaps a day
+    t = existing_t(tmp_path, 'AAPL')
+    assert t.tolist() == load_existing(tmp_path, 'AAPL')['t'].tolist() and len(t) == 10 * 390
+    assert len(existing_t(tmp_path, 'MSFT')) == 0
+
+@pytest.mark.asyncio
+async def test_fetch_deltas_bounded(tmp_path, monkeypatch):
+    running, peak = 0, 0
+
+    async def _fetch_delta(ticker, *args, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {'ticker': ticker}
+
+    monkeypatch.setattr(lib.incremental, 'fetch_delta', _fetch_delta)
+    summaries = await fetch_deltas([f"T{idx}" for idx in range(10)], tmp_path, '2023-10-09', '2023-10-20', None, None, concurrency=3)
+    assert [s['ticker'] for s in summaries] == [f"T{idx}" for idx in range(10)] and peak == 3
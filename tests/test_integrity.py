@@ -0,0 +1,53 @@
+import pandas as pd
+
+from lib.integrity import check_bars, check_csvs, check_dataset, format_report, refetch_windows, COLUMNS
+from lib.store import DatasetWriter
+
+WEEKS = ('2023-10-02', '2023-10-13') # two weeks, 10 sessions
+
+def _cols(df): return {k: df[k].to_numpy() for k in COLUMNS}
+
+def test_clean(bars):
+    report = check_bars('AAPL', _cols(bars('AAPL', *WEEKS)), '2023-10-02', '2023-10-13')
+    assert report.ok and report.rows == report.sessions * 390 == 10 * 390 and report.missing_minutes == 0
+
+def test_problems(bars):
+    df = bars('AAPL', *WEEKS)
+    day = pd.to_datetime(df['t'], unit='ms', utc=True).dt.tz_convert('America/New_York').dt.strftime('%Y-%m-%d')
+    df = df[(day != '2023-10-04') & ~((day == '2023-10-10') & (df.index % 3 != 0))] # a whole missing day and a sparse one
+    df = pd.concat([df, df.iloc[:5]], ignore_index=True) # duplicates, out of order at the end
+    df.loc[100, 'l'] = df.loc[100, 'h'] + 1 # 2023-10-02
+    df.loc[500, 'v'] = 0 # 2023-10-03
+
+    report = check_bars('AAPL', _cols(df), '2023-10-02', '2023-10-13')
+    assert report.duplicates == 5 and report.non_monotonic == 1
+    assert report.missing_sessions == 1 and report.sparse_sessions == 1
+    assert report.ohlc == 1 and report.zero_volume == 1 and report.fractional_volume == 0
+    assert report.refetch == [('2023-10-02', '2023-10-04'), ('2023-10-10', '2023-10-10')]
+    assert not report.ok
+
+def test_fractional_volume(bars):
+    report = check_bars('GE', _cols(bars('GE', *WEEKS)))
+    assert report.fractional_volume == report.rows and report.ok, "GE style volume is reported, not a reason to refetch"
+    assert report.sessions == 10, "range defaults to the data's first and last day"
+
+def test_check_sources(tmp_path, bars):
+    aapl, msft = bars('AAPL', *WEEKS), bars('MSFT', *WEEKS)
+    msft = msft[msft['t'] < msft['t'].iloc[-390]] # last day missing
+    aapl.to_csv(tmp_path / 'AAPL-2023-10-02-2023-10-13.csv')
+    msft.to_csv(tmp_path / 'MSFT-2023-10-02-2023-10-13.csv')
+    with DatasetWriter(tmp_path / 'dataset') as writer: writer.write(pd.concat([aapl, msft], ignore_index=True))
+
+    for reports in [check_csvs(tmp_path, start='2023-10-02', end='2023-10-13'), check_dataset(tmp_path / 'dataset', start='2023-10-02', end='2023-10-13')]:
+        assert [r.ticker for r in reports] == ['AAPL', 'MSFT']
+        assert refetch_windows(reports) == {'MSFT': [('2023-10-13', '2023-10-13')]}
+        text = format_report(reports)
+        assert 'MSFT' in text and '\nAAPL' not in text and '1/2 tickers clean' in text
+
+def test_check_dataset_rewritten(tmp_path, bars):
+    week = bars('AAPL', '2023-10-02', '2023-10-06')
+    for _ in range(2): # the same week fetched twice
+        with DatasetWriter(tmp_path) as writer: writer.write(week)
+    report, = check_dataset(tmp_path, start='2023-10-02', end='2023-10-06')
+    assert report.rows == 5 * 390 and report.duplicates == 0 and report.refetch == [] and report.ok
+    assert report.rewritten == 5 * 390, "superseded bars are reported, not refetched"
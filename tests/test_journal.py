@@ -0,0 +1,68 @@
+import pytest
+
+from lib.journal import RunJournal, resume, DONE, FAILED, INVALID
+from lib.fetcher import BatchRequestExecutor
+
+URLS = [f"https://api.polygon.io/v2/aggs/ticker/AAPL/range/1/minute/{i}/{i + 1}?limit=1000&apiKey=secret" for i in range(5)]
+
+class FakeFetcher:
+    """Fails every url in `fail`, returns {} for the rest"""
+    def __init__(self, fail=()): self.fail = set(fail)
+    async def __aenter__(self): pass
+    async def __aexit__(self, exc_type, exc, tb): pass
+    async def fetch(self, url, ref=None, parse=True): return None if url in self.fail else {}
+
+def test_manifest_hides_api_key(tmp_path):
+    journal = RunJournal.create(tmp_path, URLS, run_id='run')
+    assert 'secret' not in (tmp_path / 'run' / 'manifest.json').read_text(), "manifest should not store the apiKey"
+    assert journal.counts() == {DONE: 0, FAILED: 0, INVALID: 0, 'outstanding': 5}
+
+def test_resume_outstanding(tmp_path):
+    with RunJournal.create(tmp_path, URLS, run_id='run', meta={'ticker': 'AAPL'}) as journal:
+        journal.record(URLS[0], DONE)
+        journal.record(URLS[1], FAILED)
+        journal.record(URLS[2], DONE)
+        journal.record(URLS[2], INVALID) # last record wins
+
+    journal, outstanding = resume('run', tmp_path, params={'apiKey': 'secret'})
+    assert journal.meta == {'ticker': 'AAPL'}
+    assert len(outstanding) == 4 and all(url.endswith('apiKey=secret') for url in outstanding)
+    assert journal.pending(URLS) == URLS[1:], "pending should keep the original urls that aren't done"
+
+def test_batched_writes(tmp_path):
+    journal = RunJournal.create(tmp_path, URLS, run_id='run', flush_every=3, flush_interval=60)
+    log = tmp_path / 'run' / 'journal.log'
+    journal.record(URLS[0], DONE)
+    journal.record(URLS[1], DONE)
+    assert log.read_text() == "", "records should be buffered"
+    journal.record(URLS[2], DONE)
+    assert len(log.read_text().splitlines()) == 3, "buffer should flush after flush_every records"
+
+def test_torn_line_ignored(tmp_path):
+    with RunJournal.create(tmp_path, URLS, run_id='run') as journal: journal.record(URLS[0], DONE)
+    with open(tmp_path / 'run' / 'journal.log', 'a') as f: f.write("1 do") # crash mid write
+    assert RunJournal(tmp_path, 'run').counts()[DONE] == 1
+
+def test_torn_line_then_append(tmp_path):
+    with RunJournal.create(tmp_path, URLS, run_id='run') as journal: journal.record(URLS[0], DONE)
+    with open(tmp_path / 'run' / 'journal.log', 'a') as f: f.write("1") # crash mid write
+    with RunJournal(tmp_path, 'run') as journal: journal.record(URLS[3], DONE) # resumed run appends
+    journal = RunJournal(tmp_path, 'run')
+    assert journal.is_done(URLS[3]) and not journal.is_done(URLS[1]) and journal.counts()[DONE] == 2, "the append shouldn't join onto the torn line"
+    assert (tmp_path / 'run' / 'journal.log').read_text() == "0 done\n3 done\n"
+
+def test_unplanned_url(tmp_path):
+    journal = RunJournal.create(tmp_path, URLS, run_id='run')
+    with pytest.raises(AssertionError):
+        journal.record("https://example.com", DONE)
+
+@pytest.mark.asyncio
+async def test_executor_records(tmp_path):
+    journal = RunJournal.create(tmp_path, URLS, run_id='run')
+    await BatchRequestExecutor().execute_async(URLS, FakeFetcher(fail=[URLS[3]]), journal=journal)
+    assert RunJournal(tmp_path, 'run').outstanding() == [journal.urls[3]], "only the failed url should be outstanding"
+
+    journal, outstanding = resume('run', tmp_path, params={'apiKey': 'secret'})
+    results = [item async for item in BatchRequestExecutor().stream(outstanding, FakeFetcher(), journal=journal)]
+    assert len(results) == 1
+    assert RunJournal(tmp_path, 'run').counts()['outstanding'] == 0
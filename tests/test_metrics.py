@@ -0,0 +1,62 @@
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from lib.metrics import FetchMetrics, Histogram, ProgressReporter
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.retry import RetryPolicy
+
+@pytest_asyncio.fixture
+async def status_server(serve):
+    async def ok(request): return web.json_response({"results": list(range(100))})
+    async def missing(request): return web.json_response({"status": "NOT_FOUND"}, status=404)
+    return await serve({'/ok': ok, '/404': missing})
+
+def test_histogram():
+    hist = Histogram(buckets=(0.1, 1, 10))
+    for value in [0.05] * 50 + [0.5] * 49 + [5]: hist.observe(value)
+    assert hist.count == 100
+    assert hist.quantile(0.5) == 0.1
+    assert hist.quantile(0.99) == 1
+    assert hist.quantile(1.0) == 10
+    assert Histogram().quantile(0.5) == 0, "empty histogram"
+
+@pytest.mark.asyncio
+async def test_fetcher_metrics(status_server):
+    metrics = FetchMetrics()
+    fetcher = HttpRequestFetcher(rps=100, metrics=metrics, retry_policy=RetryPolicy(retries=1))
+    urls = [str(status_server.make_url('/ok'))] * 3 + [str(status_server.make_url('/404'))]
+    await BatchRequestExecutor().execute_async(urls, fetcher)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['requests'] == 4
+    assert snapshot['statuses'] == {'200': 3, '404': 1}
+    assert snapshot['failures'] == 1 and snapshot['retries'] == 0, "404s fail without retries"
+    assert snapshot['completed'] == snapshot['total'] == 4
+    assert snapshot['in_flight'] == 0
+    assert snapshot['bytes'] > 0
+    assert snapshot['ttfb']['count'] == 4 and snapshot['body_read']['count'] == 3 and snapshot['limiter_wait']['count'] == 4
+    assert json.loads(metrics.to_json())["requests"] == 4, "snapshot should be json serializable"
+
+def test_prometheus():
+    metrics = FetchMetrics()
+    metrics.requests = 5
+    metrics.statuses[200] = 5
+    metrics.ttfb.observe(0.02)
+    text = metrics.to_prometheus()
+    assert "asyncfetcher_requests_total 5" in text
+    assert 'asyncfetcher_responses_total{status="200"} 5' in text
+    assert 'asyncfetcher_ttfb_seconds_bucket{le="+Inf"} 1' in text
+    assert 'asyncfetcher_ttfb_seconds_bucket{le="0.01"} 0' in text and 'asyncfetcher_ttfb_seconds_bucket{le="0.025"} 1' in text, "buckets should be cumulative"
+
+@pytest.mark.asyncio
+async def test_progress_reporter():
+    lines = []
+    metrics = FetchMetrics()
+    metrics.total, metrics.completed = 10, 5
+    async with ProgressReporter(metrics, interval=0.01, out=lines.append):
+        await asyncio.sleep(0.05)
+    assert len(lines) >= 2, "should report periodically and once more on exit"
+    assert "5/10 urls" in lines[-1]
@@ -0,0 +1,63 @@
+import time
+import pytest
+
+from lib.mock_server import MockPolygonServer, snapshot_payload, session_minutes, ConstantLatency, LognormalLatency
+from lib.models import Snapshot
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.retry import RetryPolicy
+
+DAY_OPEN = 1697031000000 # 2023-10-11 9:30 ET
+DAY_CLOSE = DAY_OPEN + 389 * 60_000
+
+def test_snapshot_payload():
+    payload = snapshot_payload('AAPL', str(DAY_OPEN), str(DAY_CLOSE))
+    snapshot = Snapshot(**payload)
+    assert snapshot.resultsCount == len(snapshot.results) == 390, "one bar per minute of the session"
+    assert snapshot.next_url is None
+    assert payload == snapshot_payload('AAPL', str(DAY_OPEN), str(DAY_CLOSE)), "payloads should be deterministic"
+    assert isinstance(snapshot_payload('GE', str(DAY_OPEN), str(DAY_CLOSE), float_volume=True)['results'][0]['v'], float)
+
+def test_snapshot_payload_truncated():
+    payload = snapshot_payload('AAPL', '2023-10-09', '2023-10-13', limit=1000, next_url_base='http://mock')
+    assert payload['resultsCount'] == 1000
+    assert payload['next_url'].startswith('http://mock/v2/aggs/ticker/AAPL/range/1/minute/')
+    assert len(list(session_minutes(DAY_OPEN, DAY_OPEN + 6 * 86_400_000))) == 390 * 4 + 1, "wed - fri, mon and the first minute of tue, weekends have no bars"
+    assert 'results' not in snapshot_payload('AAPL', '2023-10-14', '2023-10-15'), "no bars on a weekend"
+
+@pytest.mark.asyncio
+async def test_fetch_and_validate():
+    async with MockPolygonServer() as server:
+        urls = [server.url('AAPL', DAY_OPEN + day * 86_400_000, DAY_CLOSE + day * 86_400_000) for day in range(3)]
+        results = await BatchRequestExecutor().execute_async(urls, HttpRequestFetcher(rps=100))
+    snapshots = [Snapshot(**result) for result in results]
+    assert [s.resultsCount for s in snapshots] == [390, 390, 390]
+    assert server.stats['ok'] == 3
+
+@pytest.mark.asyncio
+async def test_rate_limit_enforced():
+    async with MockPolygonServer(rps_limit=5) as server:
+        fetcher = HttpRequestFetcher(rps=1000, retry_policy=RetryPolicy(retries=0))
+        results = await BatchRequestExecutor().execute_async([server.url('AAPL', DAY_OPEN, DAY_CLOSE)] * 10, fetcher)
+    assert server.stats['throttled'] == 5 and server.stats['ok'] == 5
+    assert results.count(None) == 5
+
+@pytest.mark.asyncio
+async def test_error_injection_and_latency():
+    async with MockPolygonServer(error_rate=1.0, error_statuses=[503], latency=ConstantLatency(0.05)) as server:
+        fetcher = HttpRequestFetcher(rps=100, retry_policy=RetryPolicy(retries=0))
+        start = time.perf_counter()
+        results = await BatchRequestExecutor().execute_async([server.url('AAPL', DAY_OPEN, DAY_CLOSE)], fetcher)
+        assert time.perf_counter() - start >= 0.05
+    assert results == [None] and server.stats['errors'] == 1
+
+def test_run_in_thread():
+    server = MockPolygonServer()
+    with server.run_in_thread():
+        results = BatchRequestExecutor().execute([server.url('MSFT', DAY_OPEN, DAY_CLOSE)], HttpRequestFetcher(rps=100))
+    assert results[0]['ticker'] == 'MSFT'
+
+def test_run_in_process():
+    server = MockPolygonServer(latency=LognormalLatency(median=0.001, seed=0))
+    with server.run_in_process():
+        results = BatchRequestExecutor().execute([server.url('GE', DAY_OPEN, DAY_CLOSE)], HttpRequestFetcher(rps=100))
+    assert results[0]['resultsCount'] == 390
@@ -1,7 +1,13 @@
 import pytest
 import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
 
-from lib.fetcher import ResponseParser
+from lib.fetcher import ResponseParser, get_json_decoder, JSON_DECODERS, HttpRequestFetcher, BatchRequestExecutor
+from lib.metrics import FetchMetrics
+from lib.mock_server import MockPolygonServer, snapshot_payload
+from lib.polygon import validate_results, validate_results_columnar
+from lib.streaming import AggsStreamDecoder, BarColumns
 
 class FakeResponse:
     def __init__(self, data, content_type):
@@ -10,6 +16,9 @@ class FakeResponse:
 
     async def json(self):
         return self.data
+
+    async def read(self):
+        return (self.data if isinstance(self.data, str) else json.dumps(self.data)).encode()
     
     async def text(self):
         return self.data
@@ -74,4 +83,83 @@ async def test_invalid_content_type(invalid_content_type_response):
     parser = ResponseParser()
 
     with pytest.raises(ValueError):
-        await parser.parse(invalid_content_type_response)
\ No newline at end of file
+        await parser.parse(invalid_content_type_response)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(JSON_DECODERS))
+async def test_json_decoders(name, json_response):
+    parser = ResponseParser(decoder=get_json_decoder(name))
+    assert await parser.parse(json_response) == {"key": "value"}, f"{name} decoder should match stdlib"
+
+def test_default_decoder():
+    assert get_json_decoder() is next(iter(JSON_DECODERS.values())), "default should be the fastest installed decoder"
+    assert get_json_decoder('json') is json.loads, "stdlib json is always available"
+    with pytest.raises(AssertionError):
+        get_json_decoder('not-a-decoder')
+
+@pytest.mark.asyncio
+async def test_offload(json_response):
+    calls = []
+    class CountingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            calls.append(args)
+            return super().submit(*args, **kwargs)
+
+    with CountingExecutor(1) as executor:
+        parser = ResponseParser(offload_threshold=1000, executor=executor)
+        assert await parser.parse(json_response) == {"key": "value"}
+        assert len(calls) == 0, "small bodies should be decoded inline"
+
+        parser.offload_threshold = 1
+        assert await parser.parse(json_response) == {"key": "value"}
+        assert len(calls) == 1, "bodies over the threshold should be decoded in the executor"
+
+# ! Streaming ================================================
+
+def _stream(body: bytes, chunk: int, **kwargs):
+    stream = AggsStreamDecoder(**kwargs)
+    for i in range(0, len(body), chunk): stream.feed(body[i:i + chunk])
+    return stream.close()
+
+@pytest.mark.parametrize("chunk", [1, 7, 4096, 10 ** 7])
+def test_stream_decoder_matches_json(chunk):
+    payload = snapshot_payload('GE', '2023-10-09', '2023-10-10', limit=500, float_volume=True, next_url_base='http://localhost')
+    body = json.dumps(payload, indent=1 if chunk == 7 else None).encode() # whitespace between tokens too
+    result = _stream(body, chunk, batch_bytes=1024)
+    assert isinstance(result['results'], BarColumns) and len(result['results']) == 500
+    assert result['results'].to_list() == payload['results']
+    assert {k: v for k, v in result.items() if k != 'results'} == {k: v for k, v in payload.items() if k != 'results'}, "ticker, resultsCount, next_url etc. are kept"
+    assert list(result) == list(payload), "key order is kept"
+
+def test_stream_decoder_fallbacks():
+    assert _stream(b'{"ticker":"AAPL","resultsCount":0,"status":"OK"}', 5) == {"ticker": "AAPL", "resultsCount": 0, "status": "OK"}, "no results key"
+    assert len(_stream(b'{"ticker":"AAPL","results":[],"status":"OK"}', 3)['results']) == 0
+
+    payload = snapshot_payload('AAPL', '2023-10-09', '2023-10-09', limit=50)
+    payload['results'][30].pop('vw')
+    result = _stream(json.dumps(payload).encode(), 64, batch_bytes=256)
+    assert result['results'] == payload['results'], "a bar that can't be a column row keeps every bar as a dict"
+    assert len(validate_results_columnar([result])[1]) == 1, "... and the response is still invalidated"
+
+    payload = {"ticker": "AAPL", "results": [{"t": 1, "x": {"y": [1, 2]}}, {"t": 2, "x": {}}], "status": "OK"}
+    assert _stream(json.dumps(payload).encode(), 4, batch_bytes=8) == payload, "nested values fall back to one decode"
+
+def test_streamed_validation():
+    payloads = [snapshot_payload(ticker, '2023-10-09', '2023-10-13', limit=50000) for ticker in ['AAPL', 'GE']]
+    streamed = [_stream(json.dumps(p).encode(), 65536) for p in payloads]
+    expected, _ = validate_results_columnar(payloads)
+    df, invalidated = validate_results_columnar(streamed)
+    assert not invalidated and df.equals(expected)
+    assert len(validate_results(streamed)[0]) == 2, "the pydantic path still accepts streamed results"
+
+@pytest.mark.asyncio
+async def test_streaming_fetch():
+    metrics = FetchMetrics()
+    fetcher = HttpRequestFetcher(rps=100, metrics=metrics, parser=ResponseParser(streaming=True, chunk_size=4096))
+    async with MockPolygonServer() as server:
+        urls = [server.url('AAPL', '2023-10-09', '2023-10-13', limit=50000), server.url('AAPL', '2023-10-14', '2023-10-15')]
+        results = await BatchRequestExecutor().execute_async(urls, fetcher)
+    week, weekend = results
+    assert isinstance(week['results'], BarColumns) and len(week['results']) == week['resultsCount'] == 5 * 390
+    assert 'results' not in weekend and weekend['resultsCount'] == 0
+    assert metrics.bytes > 5 * 390 * 50, "bytes are counted without reading the body up front"
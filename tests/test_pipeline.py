@@ -0,0 +1,126 @@
+import asyncio
+import time
+import pandas as pd
+import pytest
+
+from lib.pipeline import Pipeline, CsvSink
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.mock_server import MockPolygonServer, snapshot_payload
+from lib.polygon import session_bounds
+from lib.repair import Repairer, Quarantine
+
+class PayloadFetcher:
+    """Stand in for HttpRequestFetcher, returns a one hour snapshot per url ('TICKER/start_ms') and counts fetches"""
+    def __init__(self):
+        self.fetched = 0
+
+    async def __aenter__(self): pass
+    async def __aexit__(self, exc_type, exc, tb): pass
+
+    async def fetch(self, url, ref=None, parse=True):
+        await asyncio.sleep(0.001)
+        self.fetched += 1
+        ticker, start = url.split('/')
+        return snapshot_payload(ticker, start, str(int(start) + 59 * 60_000))
+
+class SlowSink:
+    def __init__(self, fetcher, delay=0.02):
+        self.fetcher, self.delay = fetcher, delay
+        self.rows, self.max_behind = 0, 0
+
+    def write(self, df):
+        time.sleep(self.delay) # blocking, like a slow disk
+        self.rows += len(df)
+        self.max_behind = max(self.max_behind, self.fetcher.fetched - self.rows // 60) # responses fetched but not written yet
+
+    def close(self): pass
+
+@pytest.mark.asyncio
+async def test_pipeline_writes_csvs(tmp_path):
+    opens, closes = session_bounds('2023-10-09', '2023-10-13')
+    async with MockPolygonServer() as server:
+        urls = [server.url(ticker, o, c) for ticker in ['AAPL', 'GE'] for o, c in zip(opens, closes)]
+        sink = CsvSink(tmp_path, name=lambda ticker: f"{ticker}-2023-10-09-2023-10-13.csv")
+        summary = await Pipeline(HttpRequestFetcher(rps=100), sink, batch_size=3, queue_size=1, ordered=True).run(urls)
+
+    assert summary['urls'] == 10 and summary['rows'] == 10 * 390 and not summary['failed'] and not summary['invalidated']
+    df = pd.read_csv(tmp_path / 'AAPL-2023-10-09-2023-10-13.csv', index_col=0)
+    assert list(df.index) == list(range(5 * 390)), "index should continue across chunks"
+    assert df["t"].is_monotonic_increasing and df["t"].is_unique and set(df['ticker']) == {'AAPL'}
+    assert pd.read_csv(tmp_path / 'GE-2023-10-09-2023-10-13.csv', index_col=0)['v'].dtype == float
+
+@pytest.mark.asyncio
+async def test_pipeline_backpressure():
+    fetcher = PayloadFetcher()
+    sink = SlowSink(fetcher)
+    urls = (f"T{idx}/1696858200000" for idx in range(60))
+    summary = await Pipeline(fetcher, sink, executor=BatchRequestExecutor(max_in_flight=4), batch_size=2, queue_size=1).run(urls)
+
+    assert sink.rows == 60 * 60 and summary['rows'] == 60 * 60
+    assert summary['blocked'] > 0, "a slow sink should make the fetch stage wait"
+    assert sink.max_behind <= 4 + 2 * (1 + 1) + 2 * 2, "in flight + queued + in progress batches, regardless of how many urls"
+
+@pytest.mark.asyncio
+async def test_pipeline_stage_failure():
+    class BrokenSink:
+        def write(self, df): raise IOError("disk full")
+        def close(self): pass
+
+    urls = [f"T{idx}/1696858200000" for idx in range(50)]
+    with pytest.raises(IOError):
+        await asyncio.wait_for(Pipeline(PayloadFetcher(), BrokenSink(), batch_size=1, queue_size=1).run(urls), timeout=10)
+
+@pytest.mark.asyncio
+async def test_pipeline_invalidated():
+    class MixedFetcher(PayloadFetcher):
+        async def fetch(self, url, ref=None, parse=True):
+            return {'status': 'ERROR'} if url.startswith('BAD') else await super().fetch(url)
+
+    urls = ['AAPL/1696858200000', 'BAD/1', 'AAPL/1696944600000']
+    summary = await Pipeline(MixedFetcher(), SlowSink(PayloadFetcher(), delay=0)).run(urls)
+    assert summary['invalidated'] == [{'status': 'ERROR'}] and summary['rows'] == 120
+
+@pytest.mark.asyncio
+async def test_pipeline_cancel():
+    class HangingFetcher(PayloadFetcher):
+        async def fetch(self, url, ref=None, parse=True):
+            if url.startswith('HANG'): await asyncio.sleep(10)
+            return await super().fetch(url)
+
+    urls = [f"T{idx}/1696858200000" for idx in range(10)] + [f"HANG{idx}/1696858200000" for idx in range(3)]
+    sink = SlowSink(PayloadFetcher(), delay=0)
+    pipeline = Pipeline(HangingFetcher(), sink, executor=BatchRequestExecutor(max_in_flight=20, grace=0.1), batch_size=4)
+    asyncio.get_running_loop().call_later(0.2, pipeline.cancel)
+    summary = await asyncio.wait_for(pipeline.run(urls), timeout=5)
+    assert summary['cancelled'] and sorted(summary['outstanding']) == [f"HANG{idx}/1696858200000" for idx in range(3)]
+    assert sink.rows == summary['rows'] == 10 * 60, "everything fetched before the cancel is still written"
+
+@pytest.mark.asyncio
+async def test_pipeline_repair(tmp_path):
+    class FlakyFetcher(PayloadFetcher):
+        """First fetch of T3 and every fetch of BAD come back as an error payload"""
+        def __init__(self):
+            super().__init__()
+            self.seen = set()
+
+        async def fetch(self, url, ref=None, parse=True):
+            first = url not in self.seen
+            self.seen.add(url)
+            if url.startswith('BAD') or (url.startswith('T3') and first): return {'status': 'ERROR', 'error': 'upstream timeout'}
+            if url.startswith('HALTED'): return {'ticker': 'HALTED', 'status': 'OK', 'queryCount': 0, 'resultsCount': 0, 'adjusted': True, 'request_id': 'x'}
+            return await super().fetch(url)
+
+    class FrameSink:
+        def __init__(self): self.frames = []
+        def write(self, df): self.frames.append(df)
+        def close(self): pass
+
+    fetcher, sink = FlakyFetcher(), FrameSink()
+    urls = [f"T{idx}/1696858200000" for idx in range(6)] + ['BAD/1', 'HALTED/1']
+    repairer = Repairer(fetcher, max_attempts=1, backoff=0, quarantine=Quarantine(tmp_path / 'quarantine.ndjson.gz'))
+    summary = await Pipeline(fetcher, sink, repair=repairer, batch_size=4, ordered=True).run(urls)
+
+    assert summary['repaired'] == 1 and summary['invalidated'] == [{'status': 'ERROR', 'error': 'upstream timeout'}] and summary['rows'] == 6 * 60
+    assert list(pd.concat(sink.frames)['ticker'].unique()) == [f"T{idx}" for idx in range(6)], "a repaired response keeps its place in the batch"
+    assert [record['url'] for record in repairer.quarantine] == ['BAD/1'], "an empty session isn't bad data"
+    assert fetcher.seen == set(urls) and repairer.stats['no_data'] == 1
@@ -1,8 +1,16 @@
 import pytest
+import numpy as np
+import pandas as pd
 from typing import List
 
 from lib.utils import get_polygon_key, get_nyse_date_tups
 from lib.polygon import make_url, validate, make_urls
+from lib.polygon import parse_aggs_url, with_range, is_truncated, split_remaining, stitch, fetch_complete
+from lib.polygon import session_bounds, plan_windows, plan_urls, trim_to_sessions
+from lib.polygon import validate_results, validate_results_columnar, BAR_FIELDS
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+from lib.mock_server import MockPolygonServer, snapshot_payload
+from lib.models import Snapshot
 
 def test_make_url_sanity():
     url = make_url('AAPL', '2022-01-01', '2022-01-31', api_key='test_key')
@@ -31,4 +39,112 @@ def test_make_urls():
     tups = get_nyse_date_tups('2022-01-01', '2022-01-31')
     urls = make_urls(tickers, tups)
     assert isinstance(urls, list), "urls should be a list"
-    assert not _has_direct_sublist(urls), "urls should not have sublists"
\ No newline at end of file
+    assert not _has_direct_sublist(urls), "urls should not have sublists"
+
+# ! Pagination / range splitting ==============================
+WEEK_START, WEEK_END = 1696858200000, 1697227140000 # 2023-10-09 9:30 ET - 2023-10-13 15:59 ET, 5 * 390 bars
+
+def test_parse_aggs_url():
+    url = make_url('AAPL', 1, 2, limit=500, api_key='test_key')
+    parts = parse_aggs_url(url)
+    assert (parts['ticker'], parts['start'], parts['end']) == ('AAPL', '1', '2')
+    assert parts['query']['limit'] == '500' and parts['query']['apiKey'] == 'test_key'
+    assert parse_aggs_url(with_range(url, 10, 20))['start'] == '10'
+
+def test_is_truncated():
+    assert is_truncated({'resultsCount': 1000}, 1000)
+    assert is_truncated({'resultsCount': 10, 'next_url': 'https://...'}, 1000)
+    assert not is_truncated({'resultsCount': 999}, 1000)
+    assert not is_truncated(None, 1000)
+
+def test_split_and_stitch():
+    url = make_url('AAPL', WEEK_START, WEEK_END, limit=1000, api_key='test_key')
+    first = snapshot_payload('AAPL', str(WEEK_START), str(WEEK_END), limit=1000)
+    sub_urls = split_remaining(url, first, 1000)
+    assert len(sub_urls) >= 2
+    starts = [int(parse_aggs_url(u)['start']) for u in sub_urls]
+    assert starts[0] == first['results'][-1]['t'] + 1, "sub ranges should start after the last bar we have"
+
+    rest = [snapshot_payload('AAPL', parse_aggs_url(u)['start'], parse_aggs_url(u)['end'], limit=1000) for u in sub_urls]
+    merged = stitch([first] + rest[::-1])
+    ts = [bar['t'] for bar in merged['results']]
+    assert ts == sorted(set(ts)) and len(ts) == 5 * 390, "stitched bars should be complete, sorted and unique"
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("follow_next_url", [False, True])
+async def test_fetch_complete(follow_next_url):
+    async with MockPolygonServer() as server:
+        urls = [server.url('AAPL', WEEK_START, WEEK_END, limit=500), server.url('MSFT', WEEK_START, WEEK_START + 60 * 60_000, limit=500)]
+        results = await fetch_complete(urls, HttpRequestFetcher(rps=1000), BatchRequestExecutor(), follow_next_url=follow_next_url)
+
+    week, hour = [Snapshot(**result) for result in results]
+    assert week.resultsCount == len(week.results) == 5 * 390, "truncated window should be completed"
+    assert [bar.t for bar in week.results] == sorted(bar.t for bar in week.results)
+    assert week.next_url is None
+    assert hour.resultsCount == 61, "windows under the limit are left alone"
+
+
+# ! Request planning ==========================================
+
+def test_session_bounds_early_close():
+    opens, closes = session_bounds('2023-11-20', '2023-11-28')
+    assert len(opens) == 6, "thanksgiving is a holiday"
+    assert list((closes - opens) // 60_000) == [390, 390, 390, 210, 390, 390], "black friday closes early"
+
+def test_plan_windows():
+    opens, closes = session_bounds('2023-01-01', '2023-12-31')
+    windows = plan_windows(opens, closes, limit=50000, fill=0.9)
+    assert sum(days for _, _, days, _, _ in windows) == len(opens), "every session should be planned exactly once"
+    assert all(max_rows <= 45000 for *_, max_rows in windows), "worst case should fit under the limit"
+    assert len(windows) <= len(opens) / 30, "should pack many days per request"
+    assert windows[0][0] == opens[0] and windows[-1][1] == closes[-1]
+    assert sum(expected for _, _, _, expected, _ in windows) == ((closes - opens) // 60_000).sum()
+
+    assert len(plan_windows(opens, closes, limit=1000, fill=1)) == len(opens), "limit 1000 is one day per request"
+
+def test_plan_urls():
+    plan = plan_urls(['AAPL', 'MSFT'], '2023-01-01', '2023-06-30', limit=50000, api_key='test_key')
+    assert len({p.ticker for p in plan}) == 2
+    assert all(f"/{p.start}/{p.end}?" in p.url and 'limit=50000' in p.url for p in plan)
+    assert len(plan) < 2 * len(get_nyse_date_tups('2023-01-01', '2023-06-30')) / 10, "order of magnitude fewer requests than one per day"
+
+@pytest.mark.asyncio
+async def test_planned_fetch_matches_per_day():
+    opens, closes = session_bounds('2023-10-09', '2023-10-13')
+    (start, end, days, expected, _), = plan_windows(opens, closes)
+    async with MockPolygonServer() as server:
+        result, = await BatchRequestExecutor().execute_async([server.url('AAPL', start, end, limit=50000)], HttpRequestFetcher(rps=100))
+    assert trim_to_sessions(result, opens, closes)['resultsCount'] == expected == days * 390
+
+
+# ! Columnar validation =======================================
+
+def _pydantic_frame(results):
+    validated, invalidated = validate_results(results)
+    return pd.DataFrame([{**bar.model_dump(), 'ticker': s.ticker} for s in validated for bar in s.results]), invalidated
+
+def test_columnar_matches_pydantic():
+    results = [snapshot_payload(ticker, str(WEEK_START), str(WEEK_END), limit=50000, float_volume=ticker == 'GE') for ticker in ['AAPL', 'GE']]
+    results.append(snapshot_payload('MSFT', '2023-10-14', '2023-10-15')) # weekend, no results key
+    results.append({**snapshot_payload('IBM', str(WEEK_START), str(WEEK_START)), 'results': []})
+
+    expected, expected_invalid = _pydantic_frame(results)
+    df, invalidated = validate_results_columnar(results)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    assert df['t'].dtype == df['n'].dtype == np.int64 and df['c'].dtype == np.float64
+    assert df['v'].dtype == np.float64, "GE's float volume makes the column float"
+    assert [id(r) for r in invalidated] == [id(r) for r in expected_invalid]
+
+def test_columnar_invalid():
+    good = snapshot_payload('AAPL', str(WEEK_START), str(WEEK_START + 10 * 60_000))
+    def _with_bar(**bar): return {**good, 'results': good['results'][:-1] + [{**good['results'][-1], **bar}]}
+    missing_field = {**good, 'results': good['results'][:-1] + [{k: v for k, v in good['results'][-1].items() if k != 'vw'}]}
+    bad = [None, {'status': 'ERROR'}, {**good, 'ticker': None}, missing_field, _with_bar(c=None), _with_bar(o='abc'), _with_bar(n=1.5), {**good, 'results': [1, 2]}]
+
+    df, invalidated = validate_results_columnar([good] + bad)
+    assert len(df) == len(good['results']) and set(df['ticker']) == {'AAPL'}
+    assert len(invalidated) == len(bad)
+    assert len(validate_results(bad)[1]) == len(bad), "should agree with the pydantic path"
+
+    columns, _ = validate_results_columnar([good], as_frame=False)
+    assert list(columns) == list(BAR_FIELDS) + ['ticker'] and all(isinstance(col, np.ndarray) for col in columns.values())
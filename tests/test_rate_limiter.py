@@ -2,6 +2,8 @@ import asyncio, time
 from aiolimiter import AsyncLimiter
 import pytest
 
+from lib.limiter import AdaptiveLimiter, parse_retry_after
+
 @pytest.mark.asyncio
 async def test_aiolimiter():
     limiter = AsyncLimiter(4, 8)
@@ -14,4 +16,76 @@ async def test_aiolimiter():
 
     tasks = [_task(i) for i in range(3)]
     # ref = time.time(); result = asyncio.run(asyncio.wait(tasks)) 
-    ref = time.time(); results = await asyncio.gather(*tasks)
\ No newline at end of file
+    ref = time.time(); results = await asyncio.gather(*tasks)
+
+# ! Adaptive limiter =========================================
+
+def test_adaptive_increase_and_decrease():
+    limiter = AdaptiveLimiter(rate=10, min_rate=2, max_rate=12, cooldown=0)
+
+    for _ in range(100): limiter.success()
+    assert limiter.rate == 12, f"rate should be capped at max_rate, got {limiter.rate}"
+
+    limiter.feedback(429)
+    assert limiter.rate == 6, f"429 should halve the rate, got {limiter.rate}"
+    for _ in range(5): limiter.feedback(503)
+    assert limiter.rate == 2, f"rate should be floored at min_rate, got {limiter.rate}"
+
+    limiter.feedback(404) # not a rate limit signal, not a success
+    assert limiter.rate == 2
+
+def test_adaptive_cooldown():
+    limiter = AdaptiveLimiter(rate=16, cooldown=60)
+    for _ in range(10): limiter.throttle()
+    assert limiter.rate == 8, "a burst of 429s inside the cooldown should only back off once"
+
+@pytest.mark.asyncio
+async def test_adaptive_pacing():
+    limiter = AdaptiveLimiter(rate=50, increase=0)
+    start = time.monotonic()
+    for _ in range(11):
+        async with limiter: pass
+    elapsed = time.monotonic() - start
+    assert elapsed >= 0.19, f"11 requests @ 50 rps should take ~0.2s, took {elapsed:0.3f}s"
+
+@pytest.mark.asyncio
+async def test_adaptive_retry_after():
+    limiter = AdaptiveLimiter(rate=1000)
+    limiter.throttle(retry_after=0.2)
+    start = time.monotonic()
+    async with limiter: pass
+    assert time.monotonic() - start >= 0.19, "requests should wait out Retry-After"
+
+@pytest.mark.asyncio
+async def test_adaptive_feedback_reaches_queued_requests():
+    limiter = AdaptiveLimiter(rate=10, increase=0, cooldown=0)
+    start = time.monotonic()
+
+    async def _request():
+        async with limiter: return time.monotonic() - start
+
+    tasks = [asyncio.ensure_future(_request()) for _ in range(6)] # all queued up front, like `execute_async`
+    await asyncio.sleep(0.05)
+    limiter.feedback(429, 0.5) # halves the rate and holds everything for 0.5s
+    starts = sorted(await asyncio.gather(*tasks))
+    assert starts[0] < 0.05 and starts[1] >= 0.5, f"queued requests should wait out Retry-After, started at {starts}"
+    assert all(b - a >= 0.19 for a, b in zip(starts[1:], starts[2:])), f"queued requests should go at the halved rate, started at {starts}"
+
+@pytest.mark.asyncio
+async def test_adaptive_priority():
+    limiter = AdaptiveLimiter(rate=20)
+    order = []
+
+    async def _request(name, priority=False):
+        async with limiter.priority() if priority else limiter: order.append(name)
+
+    tasks = [asyncio.ensure_future(_request(idx)) for idx in range(5)]
+    await asyncio.sleep(0.01) # 0 is through, 1-4 are queued
+    await asyncio.gather(_request('hedge', priority=True), *tasks)
+    assert order[:2] == [0, 'hedge'], f"a priority request should take the next slot, got {order}"
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0, "dates in the past mean retry now"
@@ -0,0 +1,61 @@
+import time
+import numpy as np
+import pytest
+
+from lib.reader import DatasetReader
+from lib.store import DatasetWriter
+from lib.polygon import to_ms
+
+TICKERS = ['AAPL', 'MSFT', 'GE']
+
+@pytest.fixture(params=['parquet', 'ipc'])
+def dataset(tmp_path, bars, request):
+    with DatasetWriter(tmp_path, format=request.param) as writer:
+        writer.write(bars(TICKERS, '2023-08-01', '2023-10-31'))
+    return tmp_path, request.param
+
+def test_load_range(dataset, bars):
+    root, format = dataset
+    reader = DatasetReader(root, format=format)
+    assert reader.tickers() == sorted(TICKERS)
+
+    df = reader.load(['AAPL', 'GE'], '2023-10-09', '2023-10-13')
+    assert len(df) == 2 * 5 * 390
+    assert df['t'].min() >= to_ms('2023-10-09') and df['t'].max() <= to_ms('2023-10-13', end=True)
+    expected = bars(['GE'], '2023-10-09', '2023-10-13')
+    got = df[df['ticker'] == 'GE'].reset_index(drop=True)
+    assert got['t'].tolist() == expected['t'].tolist() and np.allclose(got['v'], expected['v'])
+
+    assert list(reader.load('AAPL', '2023-10-09', '2023-10-09', columns=['t', 'c']).columns) == ['t', 'c']
+    assert len(reader.load('AAPL', 1696858200000, 1696858200000 + 60_000)) == 2, "unix ms bounds are inclusive"
+    assert len(reader.load('AAPL', '2023-10-14', '2023-10-15')) == 0, "weekend"
+    assert len(reader.load('MSFT')) == len(bars(['MSFT'], '2023-08-01', '2023-10-31'))
+
+def test_load_reopened_partition(tmp_path, reopened):
+    bar = reopened
+    df = DatasetReader(tmp_path).load('AAPL')
+    assert df.loc[df['t'] == bar['t'].iloc[0], 'c'].tolist() == [10.0], "newest of 11 part files wins"
+
+def test_load_is_memory_mapped(dataset):
+    root, format = dataset
+    reader = DatasetReader(root, format=format)
+    reader.load(TICKERS, '2023-10-09', '2023-10-13') # first query compacts and maps
+    table = reader.load('AAPL', '2023-10-09', '2023-10-13', as_frame=False)
+    mapped = reader._tables['AAPL']['t'].chunk(0).buffers()[1]
+    sliced = table['t'].chunk(0).buffers()[1]
+    assert sliced.address == mapped.address, "slices should share the mapped buffer"
+
+    start = time.perf_counter()
+    reader.load(TICKERS, '2023-10-09', '2023-10-13')
+    assert time.perf_counter() - start < 0.5, "a mapped query shouldn't parse anything"
+
+def test_rebuild_after_new_data(dataset, bars):
+    root, format = dataset
+    reader = DatasetReader(root, format=format)
+    assert len(reader.load('AAPL', '2023-11-01', '2023-11-30')) == 0
+    time.sleep(0.01) # new part files must be newer than the compacted one
+    with DatasetWriter(root, format=format) as writer:
+        writer.write(bars(['AAPL'], '2023-10-30', '2023-11-03')) # overlaps two days already stored
+    reader.refresh()
+    df = reader.load('AAPL', '2023-10-30', '2023-11-03')
+    assert len(df) == 5 * 390 and df['t'].is_unique and df['t'].is_monotonic_increasing
@@ -0,0 +1,88 @@
+from collections import Counter
+import pytest
+from aiohttp import web
+
+from lib.cache import ResponseCache
+from lib.fetcher import HttpRequestFetcher
+from lib.mock_server import snapshot_payload
+from lib.repair import Repairer, Quarantine, classify_invalid, ERROR_PAYLOAD, EMPTY, NO_DATA, UNDECODABLE, SCHEMA
+
+def _payload(ticker='AAPL'): return snapshot_payload(ticker, '1696858200000', str(1696858200000 + 59 * 60_000))
+
+def _drifted():
+    payload = _payload('GE')
+    payload['results'][3]['v'] = 'n/a'
+    return payload
+
+def _no_data():
+    payload = _payload('HALT')
+    del payload['results']
+    payload['resultsCount'] = payload['queryCount'] = 0
+    return payload
+
+def test_classify_invalid():
+    lost = _payload()
+    del lost['results'] # resultsCount still says 60
+    assert classify_invalid({'status': 'ERROR', 'error': 'internal error'}) == ERROR_PAYLOAD
+    assert classify_invalid(lost) == EMPTY and classify_invalid(_no_data()) == NO_DATA
+    assert classify_invalid(b'{"ticker": "AAPL", "resul') == UNDECODABLE
+    assert classify_invalid(_drifted()) == SCHEMA and classify_invalid([1, 2]) == SCHEMA
+
+class FlakyFetcher:
+    """Stand in for HttpRequestFetcher, serves `responses[url]` one at a time (the last one repeats)"""
+    def __init__(self, responses):
+        self.responses = responses
+        self.fetched = Counter()
+
+    async def __aenter__(self): pass
+    async def __aexit__(self, exc_type, exc, tb): pass
+
+    async def fetch(self, url, ref=None, parse=True):
+        options = self.responses[url]
+        self.fetched[url] += 1
+        return options[min(self.fetched[url], len(options)) - 1]
+
+@pytest.mark.asyncio
+async def test_repair_and_quarantine(tmp_path):
+    error = {'status': 'ERROR', 'error': 'internal error'}
+    fetcher = FlakyFetcher({'ok': [_payload()], 'flaky': [_payload('GE')], 'down': [error], 'drift': [_drifted()]})
+    quarantine = Quarantine(tmp_path / 'q' / 'quarantine.ndjson.gz')
+    repairer = Repairer(fetcher, max_attempts=2, backoff=0, quarantine=quarantine)
+
+    urls = ['ok', 'flaky', 'down', 'drift', 'failed', 'halted']
+    results = await repairer.repair(urls, [_payload(), error, error, _drifted(), None, _no_data()])
+    assert results[0] == _payload() and results[1] == _payload('GE') and results[4] is None, "error payloads are refetched, failed fetches pass through"
+    assert results[2] == error and results[3]['ticker'] == 'GE' and results[5] == _no_data(), "given up and empty responses stay in place"
+    assert fetcher.fetched == {'flaky': 1, 'down': 2}, "retryable kinds get max_attempts refetches, schema drift and empty sessions none"
+    assert repairer.stats == {'repaired': 1, ERROR_PAYLOAD: 1, SCHEMA: 1, NO_DATA: 1}
+
+    records = list(quarantine)
+    assert [(r['url'], r['kind'], r['attempts']) for r in records] == [('down', ERROR_PAYLOAD, 2), ('drift', SCHEMA, 0)]
+    assert records[1]['payload']['results'][3]['v'] == 'n/a' and quarantine.counts() == {ERROR_PAYLOAD: 1, SCHEMA: 1}
+
+@pytest.mark.asyncio
+async def test_repair_cancelled(tmp_path):
+    repairer = Repairer(FlakyFetcher({'down': [{'status': 'ERROR'}]}), backoff=0, quarantine=Quarantine(tmp_path / 'quarantine.ndjson.gz'))
+    repairer.cancel()
+    results = await repairer.repair(['down'], [{'status': 'ERROR'}])
+    assert results == [{'status': 'ERROR'}] and not list(repairer.quarantine), "untried responses aren't quarantined, a resumed run gets to them"
+
+@pytest.mark.asyncio
+async def test_repair_bypasses_cache(tmp_path, serve):
+    hits = Counter()
+
+    async def aggs(request):
+        hits[request.path] += 1
+        if hits[request.path] == 1: return web.json_response({'status': 'ERROR', 'error': 'upstream timeout'}) # 200 with an error body
+        return web.json_response(_payload())
+
+    server = await serve({'/{name}': aggs})
+    url = str(server.make_url('/aapl'))
+    fetcher = HttpRequestFetcher(rps=100, cache=ResponseCache(tmp_path / 'cache'))
+    async with fetcher:
+        first = await fetcher.fetch(url)
+        results = await Repairer(fetcher, backoff=0).repair([url], [first]) # nests the fetcher's context
+        assert not fetcher.session.closed, "a nested run must not close the outer session"
+
+    assert first['status'] == 'ERROR' and results[0] == _payload() and hits['/aapl'] == 2
+    assert b'"OK"' in fetcher.cache.get(url).body, "the repaired body replaces the cached error"
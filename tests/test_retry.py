@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+import pytest_asyncio
+import aiohttp
+from aiohttp import web
+
+import time
+
+from lib.metrics import FetchMetrics
+from lib.retry import RetryPolicy, HedgePolicy, RETRYABLE, FATAL, RATE_LIMITED
+from lib.fetcher import HttpRequestFetcher, BatchRequestExecutor
+
+def _status_error(status):
+    return aiohttp.ClientResponseError(request_info=None, history=(), status=status)
+
+@pytest_asyncio.fixture
+async def flaky_server(serve):
+    """`/ok` always works, `/404` never does, `/flaky/{n}` fails with a 503 the first n times it's hit, `/hang/{n}` hangs for 5s the first n times"""
+    hits = {}
+
+    async def ok(request): return web.json_response({"ok": True})
+    async def missing(request):
+        hits['404'] = hits.get('404', 0) + 1
+        return web.json_response({"status": "NOT_FOUND"}, status=404)
+    async def flaky(request):
+        path = request.path
+        hits[path] = hits.get(path, 0) + 1
+        if hits[path] <= int(request.match_info['n']): return web.json_response({"status": "ERROR"}, status=503)
+        return web.json_response({"ok": True})
+    async def hang(request):
+        path = request.path_qs
+        hits[path] = hits.get(path, 0) + 1
+        if hits[path] <= int(request.match_info['n']): await asyncio.sleep(5)
+        return web.json_response({"ok": True})
+
+    return await serve({'/ok': ok, '/404': missing, '/flaky/{n}': flaky, '/hang/{n}': hang}, hits=hits)
+
+# ! Policy ===================================================
+def test_classify():
+    policy = RetryPolicy()
+    assert policy.classify(_status_error(404)) == FATAL
+    assert policy.classify(_status_error(503)) == RETRYABLE
+    assert policy.classify(_status_error(429)) == RATE_LIMITED
+    assert policy.classify(aiohttp.ServerDisconnectedError()) == RETRYABLE
+    assert policy.classify(asyncio.TimeoutError()) == RETRYABLE
+    assert policy.classify(ValueError()) == FATAL
+
+def test_backoff_jitter():
+    policy = RetryPolicy(base=1, cap=10)
+    delays = [policy.backoff(2) for _ in range(200)]
+    assert all(1 <= d <= 6 for d in delays), "decorrelated jitter should be between base and 3 * previous"
+    assert len(set(delays)) > 100, "delays should be jittered"
+    assert all(policy.backoff(100) <= 10 for _ in range(20)), "delays should be capped"
+    assert policy.backoff(None, retry_after=20) == 20, "Retry-After should be honored"
+
+def test_budget():
+    policy = RetryPolicy(retries=5, budget=3)
+    assert [policy.should_retry(RETRYABLE, 0) for _ in range(5)] == [True] * 3 + [False] * 2
+    assert policy.spent == 3
+    assert not RetryPolicy().should_retry(FATAL, 0), "fatal errors are never retried"
+    assert not RetryPolicy(retries=2).should_retry(RETRYABLE, 2), "no retries past `retries`"
+
+# ! Fetcher ==================================================
+@pytest.mark.asyncio
+async def test_fatal_not_retried(flaky_server):
+    fetcher = HttpRequestFetcher(rps=100, retry_policy=RetryPolicy(retries=3, base=0.01))
+    results = await BatchRequestExecutor().execute_async([str(flaky_server.make_url('/404'))], fetcher)
+    assert results == [None]
+    assert flaky_server.hits['404'] == 1, "a 404 should not be retried"
+
+@pytest.mark.asyncio
+async def test_retryable_retried(flaky_server):
+    fetcher = HttpRequestFetcher(rps=100, retry_policy=RetryPolicy(retries=2, base=0.01, cap=0.02))
+    results = await BatchRequestExecutor().execute_async([str(flaky_server.make_url('/flaky/2'))], fetcher)
+    assert results == [{"ok": True}]
+
+@pytest.mark.asyncio
+async def test_deferred_execute(flaky_server):
+    """With retries=0 a flaky url is deferred, and retried after the rest of the batch"""
+    fetcher = HttpRequestFetcher(rps=100, retry_policy=RetryPolicy(retries=0, defer=True))
+    urls = [str(flaky_server.make_url('/flaky/1')), str(flaky_server.make_url('/ok'))]
+    assert await BatchRequestExecutor().execute_async(urls, fetcher) == [{"ok": True}] * 2
+
+@pytest.mark.asyncio
+async def test_deferred_stream(flaky_server):
+    fetcher = HttpRequestFetcher(rps=100, retry_policy=RetryPolicy(retries=0, defer=True))
+    urls = [str(flaky_server.make_url('/flaky/1'))] + [str(flaky_server.make_url('/ok'))] * 3
+    results = [item async for item in BatchRequestExecutor().stream(urls, fetcher)]
+    assert results[-1] == (urls[0], {"ok": True}), "deferred url should come back after the main batch"
+    assert len(results) == 4
+
+    ordered = [item async for item in BatchRequestExecutor().stream([str(flaky_server.make_url('/flaky/11'))] + urls[1:], fetcher, ordered=True)]
+    assert ordered[0][1] is None and len(ordered) == 4, "deferred url that fails again should come back as None, in order"
+
+# ! Timeouts and hedging =====================================
+def test_hedge_policy():
+    policy = HedgePolicy(quantile=0.9, min_delay=0.01, min_samples=10, budget=0.1)
+    for seconds in [0.02] * 9: policy.observe(seconds)
+    assert policy.delay() is None, "no hedging before min_samples latencies"
+    for seconds in [0.02] * 8 + [0.5, 1.0]: policy.observe(seconds)
+    assert policy.delay() == pytest.approx(0.5), "delay is the latency quantile"
+
+    policy = HedgePolicy(min_samples=1, budget=0.1)
+    policy.observe(0.1)
+    allowed = 0
+    for _ in range(100):
+        policy.delay()
+        allowed += policy.allow()
+    assert allowed == 10, "hedges are capped at budget * requests"
+
+@pytest.mark.asyncio
+async def test_timeout(flaky_server):
+    fetcher = HttpRequestFetcher(rps=100, timeout=0.2, retry_policy=RetryPolicy(retries=1, base=0.01))
+    start = time.perf_counter()
+    results = await BatchRequestExecutor().execute_async([str(flaky_server.make_url('/hang/1'))], fetcher)
+    assert results == [{"ok": True}] and time.perf_counter() - start < 2, "a hung request times out and is retried"
+
+@pytest.mark.asyncio
+async def test_hedged_fetch(flaky_server):
+    metrics = FetchMetrics()
+    hedge = HedgePolicy(quantile=0.5, min_delay=0.05, min_samples=5, budget=0.5)
+    fetcher = HttpRequestFetcher(rps=1000, hedge=hedge, metrics=metrics)
+    await BatchRequestExecutor().execute_async([str(flaky_server.make_url('/ok'))] * 10, fetcher) # latency samples
+
+    start = time.perf_counter()
+    results = await BatchRequestExecutor().execute_async([str(flaky_server.make_url(f'/hang/1?url={idx}')) for idx in range(4)], fetcher)
+    assert results == [{"ok": True}] * 4 and time.perf_counter() - start < 2, "slow requests are answered by their hedges"
+    assert metrics.hedges == 4 and metrics.hedge_wins == 4 and metrics.requests == 10 + 8, "hedges go through the limiter like any request"
+    assert metrics.in_flight == 0, "the slow originals are cancelled"
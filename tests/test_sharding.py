@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+import time
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from lib.repair import Quarantine, ERROR_PAYLOAD
+from lib.sharding import SharedTokenBucket, ShardedRunner
+
+def _drain(bucket, n, barrier, times):
+    """Acquire n tokens in a fresh event loop (runs in a child process), puts the monotonic time each one was granted on `times`"""
+    async def _go():
+        granted = []
+        for _ in range(n):
+            async with bucket: granted.append(time.monotonic())
+        return granted
+    barrier.wait() # start together, spawn time isn't part of the measurement
+    times.put(asyncio.run(_go()))
+
+def count_results(key, urls, results):
+    """Handler for ShardedRunner, runs in the worker"""
+    return key, sum(result == {"ok": True} for result in results)
+
+@pytest_asyncio.fixture
+async def ok_server(serve):
+    async def ok(request): return web.json_response({"ok": True})
+    return await serve({'/{path:.*}': ok})
+
+def test_bucket_is_global_across_processes():
+    ctx = multiprocessing.get_context('spawn')
+    bucket = SharedTokenBucket(rate=50, ctx=ctx)
+    barrier, times = ctx.Barrier(2), ctx.Queue()
+    procs = [ctx.Process(target=_drain, args=(bucket, 10, barrier, times)) for _ in range(2)]
+    for proc in procs: proc.start()
+    per_proc = [times.get(timeout=30) for _ in procs]
+    for proc in procs: proc.join()
+    assert all(proc.exitcode == 0 for proc in procs)
+
+    granted = sorted(sum(per_proc, []))
+    spans = [b - a for a, b in zip(granted, granted[9:])] # a late wakeup squeezes one gap, not a run of them
+    assert min(spans) >= 0.8 * 9 / 50, f"any 10 grants across both processes take 9 / rate, shortest took {min(spans):0.3f}s"
+    assert granted[-1] - granted[0] >= 0.9 * 19 / 50, "20 tokens @ 50 rps take ~0.38s, not ~0.18s per process side by side"
+    assert max(min(t) for t in per_proc) < min(max(t) for t in per_proc), "the processes drained at the same time"
+
+@pytest.mark.asyncio
+async def test_sharded_runner(ok_server):
+    jobs = {ticker: [str(ok_server.make_url(f'/{ticker}/{i}')) for i in range(5)] for ticker in ['AAPL', 'MSFT', 'GE']}
+    runner = ShardedRunner(workers=2, rps=200)
+    out = await asyncio.to_thread(runner.run, jobs, count_results, False) # blocking, keep the server's loop free
+    assert out == {ticker: (ticker, 5) for ticker in jobs}
+
+@pytest.mark.asyncio
+async def test_sharded_runner_repair(ok_server, tmp_path):
+    jobs = {ticker: [str(ok_server.make_url(f'/{ticker}/{i}')) for i in range(3)] for ticker in ['AAPL', 'MSFT']}
+    quarantine = Quarantine(tmp_path / 'quarantine.ndjson.gz')
+    runner = ShardedRunner(workers=2, rps=200, repair_kwargs={'max_attempts': 1, 'backoff': 0, 'quarantine': quarantine})
+    await asyncio.to_thread(runner.run, jobs, count_results, False)
+    records = list(quarantine) # {"ok": true} isn't a polygon response
+    assert sorted(r['url'] for r in records) == sorted(sum(jobs.values(), [])), "both workers append to the one quarantine"
+    assert {(r['kind'], r['attempts']) for r in records} == {(ERROR_PAYLOAD, 1)}
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from lib.store import DatasetWriter, read_dataset, partition_keys
+
+def test_partition_keys_nyse_time():
+    t = np.array([1698796740000, 1698796800000]) # 2023-10-31 23:59 / 2023-11-01 00:00 UTC, both still October in New York
+    years, months = partition_keys(t)
+    assert list(years) == [2023, 2023] and list(months) == [10, 10]
+
+@pytest.mark.parametrize("format", ['parquet', 'ipc'])
+def test_dataset_roundtrip(tmp_path, bars, format):
+    aapl, ge = bars('AAPL', '2023-09-25', '2023-10-06'), bars('GE', '2023-09-25', '2023-10-06')
+    with DatasetWriter(tmp_path, format=format) as writer:
+        writer.write(pd.concat([aapl, ge], ignore_index=True))
+    assert writer.rows == len(aapl) + len(ge)
+    assert sorted(p.relative_to(tmp_path).parent.as_posix() for p in tmp_path.rglob('part-*')) == [
+        f"ticker={ticker}/year=2023/month={month}" for ticker in ['AAPL', 'GE'] for month in ['09', '10']
+    ]
+
+    df = read_dataset(tmp_path, tickers=['GE'], format=format).sort_values('t').reset_index(drop=True)
+    assert df['t'].tolist() == ge['t'].tolist() and np.allclose(df['v'], ge['v'])
+    assert list(read_dataset(tmp_path, columns=['t', 'c'], format=format).columns) == ['t', 'c'], "only the requested columns are read"
+
+def test_append_row_groups(tmp_path, bars):
+    week1, week2 = bars('AAPL', '2023-10-02', '2023-10-06'), bars('AAPL', '2023-10-09', '2023-10-13')
+    with DatasetWriter(tmp_path) as writer:
+        writer.write(week1)
+        writer.write(week2)
+    part, = tmp_path.rglob('*.parquet')
+    assert pq.ParquetFile(part).num_row_groups == 2, "each write appends a row group to the open file"
+
+    with DatasetWriter(tmp_path) as writer: writer.write(bars('AAPL', '2023-10-16', '2023-10-20')) # a later run
+    assert len(list(tmp_path.rglob('*.parquet'))) == 2 and pq.ParquetFile(part).num_row_groups == 2, "existing files aren't rewritten"
+    assert len(read_dataset(tmp_path)) == 3 * 5 * 390
+
+def test_max_open(tmp_path, bars):
+    with DatasetWriter(tmp_path, max_open=1) as writer:
+        for _ in range(2):
+            writer.write(bars('AAPL', '2023-09-25', '2023-10-06')) # alternates between two partitions
+        assert len(writer.writers) == 1
+    assert len(list(tmp_path.rglob('*.parquet'))) == 4, "a closed partition gets a new part file"
+    assert len(read_dataset(tmp_path)) == 10 * 390, "bars written twice are read back once"
+
+def test_reopened_partition_order(tmp_path, reopened):
+    bar = reopened
+    assert len(list((tmp_path / 'ticker=AAPL' / 'year=2023' / 'month=10').glob('part-*'))) == 11
+    df = read_dataset(tmp_path)
+    assert df.loc[df['t'] == bar['t'].iloc[0], 'c'].tolist() == [10.0], "the 11th part file sorts after the 10th"
+
+def test_read_dataset_dedup(tmp_path, bars):
+    week = bars('AAPL', '2023-10-02', '2023-10-06')
+    with DatasetWriter(tmp_path) as writer: writer.write(week)
+    rerun = week.copy()
+    rerun['c'] = rerun['c'] + 1 # a re-run that got corrected bars
+    with DatasetWriter(tmp_path) as writer: writer.write(pd.concat([rerun, bars('GE', '2023-10-02', '2023-10-06')], ignore_index=True))
+
+    df = read_dataset(tmp_path, tickers=['AAPL'])
+    assert len(df) == 5 * 390 and df['t'].is_unique and np.allclose(df['c'], rerun['c']), "the newest part file wins on duplicate t"
+    assert list(read_dataset(tmp_path, columns=['c']).columns) == ['c'] and len(read_dataset(tmp_path)) == 2 * 5 * 390
@@ -1,4 +1,10 @@
-from lib.utils import get_polygon_key
+from pathlib import Path
+import pandas as pd
+import pandas_market_calendars as mcal
+import pytest
+
+from lib import utils
+from lib.utils import get_polygon_key, NyseCalendar, get_nyse_calendar
 
 def test_get_polygon_key():
     """Test get_polygon_key()."""
@@ -6,4 +12,57 @@ def test_get_polygon_key():
 
 def test_get_nyse_date_tups():
     #  make sure no weekdays or holidays
-    pass
\ No newline at end of file
+    pass
+
+# ! NYSE calendar ===============================================
+
+def _reference_tups(start, end, unix):
+    """The original per row implementation"""
+    nyse = get_nyse_calendar(start, end)
+    to_str = lambda x: pd.to_datetime(x, utc=True).tz_convert('America/New_York').strftime("%Y-%m-%d")
+    to_unix = lambda x: int(pd.to_datetime(x, utc=True).tz_convert('America/New_York').timestamp() * 1000)
+    convert = to_unix if unix else to_str
+    return [(convert(a), convert(b)) for a, b in zip(nyse['market_open'], nyse['market_close'])]
+
+@pytest.mark.parametrize("unix", [False, True])
+def test_calendar_matches_reference(tmp_path, unix):
+    calendar = NyseCalendar(cache_dir=tmp_path)
+    for start, end in [('2018-10-11', '2023-10-09'), ('2023-11-24', '2023-11-24'), ('2020-12-31', '2021-01-04')]:
+        assert calendar.date_tups(start, end, unix=unix) == _reference_tups(start, end, unix)
+
+def test_calendar_lookups(tmp_path):
+    calendar = NyseCalendar(cache_dir=tmp_path)
+    assert calendar.trading_days('2023-11-20', '2023-11-26') == 4, "thanksgiving"
+    assert calendar.bars_expected('2023-11-24') == 210, "black friday closes early"
+    assert calendar.bars_expected('2023-11-22') == 390
+    assert calendar.bars_expected('2023-11-23') == 0 and not calendar.is_trading_day('2023-11-23')
+
+def test_calendar_disk_cache(tmp_path, monkeypatch):
+    NyseCalendar(cache_dir=tmp_path).sessions('2022-03-01', '2023-02-01')
+    assert [p.name for p in tmp_path.iterdir()] == [f'nyse-{mcal.__version__}-2022-2023.npz']
+
+    def _fail(*args): raise AssertionError("should be served from the disk cache")
+    monkeypatch.setattr(utils, 'get_nyse_calendar', _fail)
+    calendar = NyseCalendar(cache_dir=tmp_path)
+    dates, opens, closes = calendar.sessions('2022-06-01', '2022-06-30')
+    assert len(dates) == 21 and not opens.flags.writeable
+    assert calendar.trading_days('2022-01-01', '2022-12-31') == 251, "the 2022-2023 span covers 2022 alone too"
+
+def test_calendar_disk_cache_invalidation(tmp_path, monkeypatch):
+    NyseCalendar(cache_dir=tmp_path).sessions('2022-03-01', '2022-04-01')
+    builds = []
+    monkeypatch.setattr(utils, 'get_nyse_calendar', lambda *args: builds.append(args) or get_nyse_calendar(*args))
+    monkeypatch.setattr(mcal, '__version__', '99.0')
+    NyseCalendar(cache_dir=tmp_path).sessions('2022-03-01', '2022-04-01')
+    assert len(builds) == 1, "another mcal version doesn't trust the old file"
+
+    year = pd.Timestamp.now().year
+    NyseCalendar(cache_dir=tmp_path).sessions(f'{year}-01-01', f'{year}-01-31')
+    NyseCalendar(cache_dir=tmp_path).sessions(f'{year}-01-01', f'{year}-01-31')
+    assert len(builds) == 2, "fresh enough"
+    NyseCalendar(cache_dir=tmp_path, max_age=0).sessions(f'{year}-01-01', f'{year}-01-31')
+    NyseCalendar(cache_dir=tmp_path, max_age=0).sessions('2022-03-01', '2022-04-01')
+    assert len(builds) == 3, "the current year expires, past years don't"
+
+def test_shared_calendar_cache_dir(calendar_cache):
+    assert utils.get_calendar().cache_dir == Path(calendar_cache)
@@ -0,0 +1,55 @@
+import json
+import os
+import pandas as pd
+import pytest
+
+from lib.fetcher import HttpRequestFetcher
+from lib.journal import RunJournal, INVALID
+from lib.mock_server import MockPolygonServer, snapshot_payload
+from lib.pipeline import Pipeline, CsvSink
+from lib.polygon import session_bounds, validate_results_columnar
+from lib.workers import ParsePool, RawResponseParser
+
+def _shm_blocks():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+@pytest.fixture(scope='module')
+def pool():
+    with ParsePool(workers=2) as pool: yield pool
+
+@pytest.mark.asyncio
+async def test_parse_pool_matches_columnar(pool):
+    payloads = [snapshot_payload(ticker, '2023-10-09', '2023-10-13', limit=50000, float_volume=ticker == 'GE') for ticker in ['AAPL', 'GE', 'AAPL']]
+    before = _shm_blocks()
+    df, invalidated, positions = await pool.parse([json.dumps(p).encode() for p in payloads])
+    expected, _ = validate_results_columnar(payloads)
+    assert df.equals(expected) and not invalidated and not positions
+    assert _shm_blocks() == before, "shared memory blocks are freed once copied out"
+
+@pytest.mark.asyncio
+async def test_parse_pool_invalidated(pool):
+    good = json.dumps(snapshot_payload('AAPL', '2023-10-09', '2023-10-09')).encode()
+    df, invalidated, positions = await pool.parse([b'{"status": "ERROR"}', good, b'<html>', b'{"status": "ERROR"}'])
+    assert len(df) == 390 and positions == [0, 2, 3]
+    assert invalidated == [{'status': 'ERROR'}, b'<html>', {'status': 'ERROR'}], "undecodable bodies come back as is"
+
+    df, invalidated, positions = await pool.parse([b'{"status": "ERROR"}'])
+    assert len(df) == 0 and list(df.columns) == list(expected_columns()) and positions == [0]
+
+def expected_columns(): return validate_results_columnar([])[0].columns
+
+@pytest.mark.asyncio
+async def test_pipeline_parse_pool(tmp_path, pool):
+    opens, closes = session_bounds('2023-10-09', '2023-10-13')
+    async with MockPolygonServer() as server:
+        urls = [server.url(ticker, o, c) for ticker in ['AAPL', 'GE'] for o, c in zip(opens, closes)] + [server.url('AAPL', '2023-10-14', '2023-10-14')] # a weekend, no results
+        journal = RunJournal.create(tmp_path / 'runs', urls)
+        sink = CsvSink(tmp_path, name=lambda ticker: f"{ticker}.csv")
+        fetcher = HttpRequestFetcher(rps=100, parser=RawResponseParser())
+        summary = await Pipeline(fetcher, sink, batch_size=2, queue_size=1, ordered=True, parse_pool=pool).run(urls, journal=journal)
+
+    assert summary['urls'] == 11 and summary['rows'] == 10 * 390 and len(summary['invalidated']) == 1
+    assert journal.counts()[INVALID] == 1 and not journal.is_done(urls[-1])
+    df = pd.read_csv(tmp_path / 'AAPL.csv', index_col=0)
+    assert len(df) == 5 * 390 and df['t'].is_monotonic_increasing, "batches are written in order"
+    assert pd.read_csv(tmp_path / 'GE.csv', index_col=0)['v'].dtype == float